@@ -1,3 +1,5 @@
+import os
+import pathlib
 import cv2 as cv
 import PIL
 from PIL import JpegImagePlugin # required for JpegImagePlugin Check below
@@ -52,15 +54,20 @@ def hash_to_binary_array(value) -> [int]:
         # if value is list of string convert to list of int
         value = list(map(int, value))
     if isinstance(value, int):
-        # converting int to binary array
-        value = [int(x) for x in list('{0:0b}'.format(value).zfill(64))]
+        # converting int to binary array, unpacking its bytes at once
+        bits = max(value.bit_length(), 64)
+        packed = np.frombuffer(value.to_bytes((bits + 7) // 8, 'big'), dtype=np.uint8)
+        value = np.unpackbits(packed)[-bits:].tolist()
     return value
 
 
 def format_image_to_PIL(image, order):
     """
     convert an image of type PIL or opencv2 image or numpy array to a PIL image
+    encoded images (bytes of an image file) are decoded, whatever the order
     """
+    if is_buffer(image):
+        return PIL.Image.fromarray(BGR2RGB(decode_buffer(image)))
     if isinstance(image, np.ndarray) and order.lower() in ['bgr', 'rgb']:
         if order.lower() == 'bgr':
             return PIL.Image.fromarray(BGR2RGB(image))
@@ -71,7 +78,38 @@ def format_image_to_PIL(image, order):
         return image
     else:
         raise ValueError(
-            'parameter image is not a PIL image, cv2 image or numpy array')
+            'parameter image is not a PIL image, cv2 image, numpy array or encoded image bytes')
+
+
+def format_image_to_gray_array(image, order):
+    """
+    convert a numpy array (opencv image) of channel order RGB/BGR (with or without alpha) to a grayscale numpy array
+    with PIL's convert('L') (integer ITU-R 601-2 luma), so that the hashes of an array and of the PIL image of the same
+    pixels are the same. 2 dimensional arrays are considered grayscale already and returned as is
+    """
+    if image.ndim == 2:
+        return image
+    channels = image.shape[2]
+    if channels == 1:
+        return image[:, :, 0]
+    if order.lower() == 'bgr':
+        image = cv.cvtColor(image, cv.COLOR_BGR2RGB if channels == 3 else cv.COLOR_BGRA2RGBA)
+    elif order.lower() != 'rgb':
+        raise ValueError('parameter order must be either RGB or BGR')
+    return np.asarray(PIL.Image.fromarray(image).convert('L'))
+
+
+def format_image_for_hashing(image, order):
+    """
+    numpy arrays (opencv images) are converted to a grayscale array, see format_image_to_gray_array.
+    PIL images are returned as is.
+    encoded images (bytes of an image file) are decoded straight to grayscale
+    """
+    if is_buffer(image):
+        return decode_buffer(image, grayscale=True)
+    if isinstance(image, np.ndarray):
+        return format_image_to_gray_array(image, order)
+    return format_image_to_PIL(image, order)
 
 
 ###############################################
@@ -85,6 +123,165 @@ def imread(file_name):
         return inst
 
 
+# reduction factors of the JPEG decoder (DCT scaling) and the matching opencv read flags
+IMREAD_REDUCED_FLAGS = {
+    (8, False): cv.IMREAD_REDUCED_COLOR_8,
+    (4, False): cv.IMREAD_REDUCED_COLOR_4,
+    (2, False): cv.IMREAD_REDUCED_COLOR_2,
+    (1, False): cv.IMREAD_COLOR,
+    (8, True): cv.IMREAD_REDUCED_GRAYSCALE_8,
+    (4, True): cv.IMREAD_REDUCED_GRAYSCALE_4,
+    (2, True): cv.IMREAD_REDUCED_GRAYSCALE_2,
+    (1, True): cv.IMREAD_GRAYSCALE,
+}
+
+
+# os.PathLike and os.fspath are python >= 3.6, the path objects of the older versions are pathlib paths
+if hasattr(os, 'PathLike'):
+    PATH_TYPES = (str, os.PathLike)
+    fspath = os.fspath
+else:
+    PATH_TYPES = (str, pathlib.PurePath)
+
+    def fspath(path) -> str:
+        """ file system representation of a path, see os.fspath """
+        return path if isinstance(path, str) else str(path)
+
+
+def is_path(item) -> bool:
+    """ True if item refers to an image file rather than an in-memory image """
+    return isinstance(item, PATH_TYPES)
+
+
+def is_buffer(item) -> bool:
+    """ True if item is an encoded image (the bytes of an image file) """
+    return isinstance(item, (bytes, bytearray, memoryview))
+
+
+# JPEG start of frame markers, which hold the size of the image
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def exif_orientation(tiff) -> int:
+    """ orientation tag (1 to 8) of the TIFF structure of an EXIF segment, 1 if there is none """
+    byteorder = 'little' if bytes(tiff[:2]) == b'II' else 'big'
+    offset = int.from_bytes(tiff[4:8], byteorder)
+    count = int.from_bytes(tiff[offset:offset + 2], byteorder)
+    for entry in range(offset + 2, min(offset + 2 + 12 * count, len(tiff) - 11), 12):
+        if int.from_bytes(tiff[entry:entry + 2], byteorder) == 0x0112:
+            return int.from_bytes(tiff[entry + 8:entry + 10], byteorder)
+    return 1
+
+
+def jpeg_size(buffer):
+    """
+    read the size of a JPEG image from its markers, without decoding nor copying the buffer
+    returns (width, height) as displayed, i.e. with the EXIF orientation applied, None if buffer is not a JPEG image
+    """
+    data = memoryview(buffer).cast('B')
+    if bytes(data[:2]) != b'\xff\xd8':
+        return None
+    orientation, position = 1, 2
+    while position + 9 <= len(data):
+        if data[position] != 0xFF:
+            return None
+        marker = data[position + 1]
+        if marker == 0xFF:
+            # fill byte
+            position += 1
+            continue
+        length = int.from_bytes(data[position + 2:position + 4], 'big')
+        if marker == 0xE1 and bytes(data[position + 4:position + 10]) == b'Exif\x00\x00':
+            orientation = exif_orientation(data[position + 10:position + 2 + length])
+        elif marker in JPEG_SOF_MARKERS:
+            height = int.from_bytes(data[position + 5:position + 7], 'big')
+            width = int.from_bytes(data[position + 7:position + 9], 'big')
+            # orientations 5 to 8 are transposed
+            return (height, width) if orientation in (5, 6, 7, 8) else (width, height)
+        position += 2 + length
+    return None
+
+
+def image_file_info(file_name):
+    """
+    read the header of an image file (not the pixels), file_name may also be an encoded image (bytes),
+    of which only JPEG images are recognized
+    returns (format, (width, height)) as displayed, i.e. with the EXIF orientation applied,
+    None if the format is not known to PIL
+    """
+    if is_buffer(file_name):
+        size = jpeg_size(file_name)
+        return ('JPEG', size) if size is not None else None
+    try:
+        with PIL.Image.open(file_name) as image:
+            width, height = image.size
+            # orientations 5 to 8 are transposed
+            if image.format == 'JPEG' and image.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+                width, height = height, width
+            return image.format, (width, height)
+    except (IOError, SyntaxError):
+        return None
+
+
+def reduction_factor(size, target_size) -> int:
+    """ largest JPEG reduction factor (1, 2, 4 or 8) keeping an image of size (width, height) at least target_size """
+    for factor in (8, 4, 2):
+        if size[0] // factor >= target_size[0] and size[1] // factor >= target_size[1]:
+            return factor
+    return 1
+
+
+def imread_scaled(file_name, target_size=None, grayscale: bool = False):
+    """
+    read an image given its path/file_name or its encoded bytes, at the least resolution needed to downscale it to
+    target_size. JPEG images are decoded at 1/2, 1/4 or 1/8 of their size by the JPEG decoder (DCT scaling) when that
+    is still at least target_size, which divides the decoding time and memory. With grayscale, JPEG images are decoded
+    to their luma channel only. Other formats are decoded in full and, with grayscale, converted with opencv
+    as in-memory images are.
+    Params:
+        file_name  - path of the image file, or the encoded image as bytes, bytearray or memoryview (not copied)
+        target_size- (width, height) the image is going to be downscaled to, or a function returning it
+                     given the (width, height) of the image. None decodes the image at full size
+        grayscale  - (bool) return a grayscale (2 dimensional) array
+    Returns:
+        numpy array in channel order BGR (or grayscale), None if the image can not be read
+    """
+    if not is_buffer(file_name):
+        file_name = fspath(file_name)
+    info = image_file_info(file_name)
+    flags = cv.IMREAD_COLOR
+    if info is not None and info[0] == 'JPEG':
+        factor = 1
+        if target_size is not None:
+            if callable(target_size):
+                target_size = target_size(info[1])
+            factor = reduction_factor(info[1], target_size)
+        flags = IMREAD_REDUCED_FLAGS[factor, grayscale]
+    image = imdecode(file_name, flags) if is_buffer(file_name) else cv.imread(file_name, flags)
+    if grayscale and image is not None:
+        image = format_image_to_gray_array(image, 'bgr')
+    return image
+
+
+def imdecode(buffer, flags=cv.IMREAD_COLOR):
+    """
+    decode an encoded image (bytes of an image file) without copying the buffer
+    returns the numpy array in channel order BGR, None if the buffer can not be decoded
+    """
+    return cv.imdecode(np.frombuffer(buffer, dtype=np.uint8), flags)
+
+
+def decode_buffer(buffer, target_size=None, grayscale: bool = False):
+    """
+    decode an encoded image (bytes, bytearray or memoryview of an image file) without copying it, see imread_scaled
+    raises ValueError if the buffer can not be decoded
+    """
+    image = imread_scaled(buffer, target_size, grayscale)
+    if image is None:
+        raise ValueError('unable to decode the image buffer')
+    return image
+
+
 def imwrite(file_name, img):
     """ write an image object to the disk """
     try:
@@ -117,8 +314,13 @@ def PIL2BGR(img):
 
 
 def image2BGR(img, order):
-    """ convert an image in PIL or cv2 or numpy array to numpy array to a channel order BGR """
-    if isinstance(img, np.ndarray):
+    """
+    convert an image in PIL or cv2 or numpy array to numpy array to a channel order BGR
+    encoded images (bytes of an image file) are decoded, whatever the order
+    """
+    if is_buffer(img):
+        img = decode_buffer(img)
+    elif isinstance(img, np.ndarray):
         if order.lower() == 'rgb':
             img = RGB2BGR(img)
     elif isinstance(img, PIL.JpegImagePlugin.JpegImageFile) or isinstance(
@@ -126,7 +328,7 @@ def image2BGR(img, order):
         img = PIL2BGR(img)
     else:
         raise ValueError(
-            'parameter img is not a PIL image, cv2 image or numpy array')
+            'parameter img is not a PIL image, cv2 image, numpy array or encoded image bytes')
     return img
 
 def format_output_order_input_RGB(img, order):
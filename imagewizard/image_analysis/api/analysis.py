@@ -8,7 +8,7 @@ class Analysis():
     def mean_color(self, img, order: str = 'rgb'):
         """ Calculates and returns the mean/average color of an image
             Params:
-                img: (numpy.array, PIL.image, cv2.image)
+                img: (numpy.array, PIL.image, cv2.image, encoded image bytes)
                 order: (RGB, BGR) input order of the colors BGR/RGB. Deafult order: RGB
             Returns:
                 Tuple of RGB values of the mean color calculated
@@ -19,7 +19,7 @@ class Analysis():
     def frequent_color(self, img, order: str = 'rgb'):
         """ Calculates and returns the frequent/mode color of an image
             Params:
-                img: (numpy.array, PIL.image, cv2.image)
+                img: (numpy.array, PIL.image, cv2.image, encoded image bytes)
                 order: (RGB, BGR) input order of the colors BGR/RGB. Deafult order: RGB
             Returns:
                 Tuple of RGB values of the mode color calculated
@@ -30,7 +30,7 @@ class Analysis():
     def dominant_colors(self, img, no_of_colors: int = 3, order: str = 'rgb'):
         """ Return n dominant colors in an image
             Params:
-                img: (numpy.array, PIL.image, cv2.image)
+                img: (numpy.array, PIL.image, cv2.image, encoded image bytes)
                 no_of_colors: (int) number of dominant colors (RGB) to return
                 order: (RGB, BGR) input order of the colors BGR/RGB. Deafult order: RGB
             Returns:
@@ -42,7 +42,7 @@ class Analysis():
     def trim_to_content(self, img, order: str = 'rgb'):
         """ Trim/Crop an image to its content (removes uniform color spaced padding around the image)
             Params:
-                img: (numpy.array, PIL.image, cv2.image)
+                img: (numpy.array, PIL.image, cv2.image, encoded image bytes)
                 order: (RGB, BGR) input order of the colors BGR/RGB. Deafult order: RGB
             Returns:
                 numpy.array of the order specified
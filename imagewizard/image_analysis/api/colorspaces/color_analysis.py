@@ -24,7 +24,7 @@ def frequent_color(image):
 def mean_color(img):
     """ Calculates and returns the mean/average color of an image
         Params:
-            img: (numpy.array, PIL.image, cv2.image)
+            img: (numpy.array, PIL.image, cv2.image, encoded image bytes)
         Returns:
             Tuple of RGB values 
     """
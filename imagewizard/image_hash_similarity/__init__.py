@@ -1,3 +1,8 @@
 from imagewizard.image_hash_similarity.api.similarity import Similarity
+from imagewizard.image_hash_similarity.api.bk_tree import BKTreeIndex
+from imagewizard.image_hash_similarity.api.mih import MIHIndex
+from imagewizard.image_hash_similarity.api.lsh import LSHIndex
+from imagewizard.image_hash_similarity.api.mapped_index import MappedHashIndex
+from imagewizard.image_hash_similarity.api.sqlite_store import SQLiteHashStore
 
-__all__ = ['Similarity']
+__all__ = ['Similarity', 'BKTreeIndex', 'MIHIndex', 'LSHIndex', 'MappedHashIndex', 'SQLiteHashStore']
@@ -0,0 +1,209 @@
+"""
+Vectorized distances between packed hashes.
+A set of hashes is held as a numpy array of uint64 words of shape (N, W), one hash per row, most significant word
+first (see image_hashing.api.hash_io.packed_to_uint64), and compared with XOR and popcount, one chunk of rows at
+a time so that the temporary arrays stay small whatever the number of hashes.
+The metrics are computed from popcounts like BitDistanceAlgorithms computes them for a single pair, and return the
+values DistanceAlgorithms returns for the bit arrays of the hashes (Similarity.similarity).
+"""
+import numpy
+from imagewizard.image_hashing.api import hash_io
+from imagewizard.image_hashing.api.hash_algorithms import ImageHash, PackedImageHash
+
+BIT_METRICS = ('hamming', 'manhattan', 'euclidean', 'cosine', 'jaccard', 'bit_jaccard', 'minkowski', 'min')
+# number of (row, row) comparisons per chunk
+CHUNK_SIZE = 1 << 18
+
+_POPCOUNT_TABLE = numpy.array([bin(byte).count('1') for byte in range(256)], dtype=numpy.uint8)
+
+
+def _popcount_table(words: numpy.ndarray) -> numpy.ndarray:
+    """ number of set bits of every element of an unsigned integer array, with a lookup table of the bytes """
+    words = numpy.ascontiguousarray(words)
+    counts = _POPCOUNT_TABLE[words.view(numpy.uint8)].reshape(words.shape + (words.itemsize, ))
+    return counts.sum(axis=-1, dtype=numpy.uint8)
+
+
+popcount = _popcount_table
+# numpy.bitwise_count (numpy >= 2.0) counts with the cpu popcount instruction
+if hasattr(numpy, 'bitwise_count'):
+    popcount = numpy.bitwise_count
+
+
+def int_popcount(value: int) -> int:
+    """ number of set bits of a (non negative) python integer """
+    return bin(value).count('1')
+
+
+# int.bit_count (python >= 3.10) is considerably faster than counting the binary string
+if hasattr(int, 'bit_count'):
+    int_popcount = int.bit_count
+
+
+def row_popcount(words: numpy.ndarray) -> numpy.ndarray:
+    """ number of set bits of every row (last axis) of an array of words """
+    counts = popcount(words)
+    if counts.shape[-1] == 1:
+        return counts[..., 0]
+    return counts.sum(axis=-1, dtype=numpy.uint16)
+
+
+def hash_value(value):
+    """ (integer value, number of bits) of a single hash of any of the forms Similarity.similarity accepts """
+    if isinstance(value, ImageHash):
+        value = value.pack()
+    if isinstance(value, PackedImageHash):
+        return value.value, value.size
+    if isinstance(value, str):
+        digits = value[2:] if value[:2].lower() == '0x' else value
+        return int(digits, 16), len(digits) * 4
+    if isinstance(value, (list, tuple, numpy.ndarray)):
+        bits = [int(bit) for bit in numpy.asarray(value).ravel()]
+        return int(''.join(map(str, bits)) or '0', 2), len(bits)
+    if isinstance(value, (int, numpy.integer)):
+        return int(value), int(value).bit_length()
+    raise TypeError('{} is not a hash'.format(type(value).__name__))
+
+
+def to_words(hashes, words: int = None) -> numpy.ndarray:
+    """
+    Params:
+        hashes     - numpy.array of uint64 words (N, W) or (N, ) for 64 bit hashes, numpy.array of uint8 packed hashes
+                     (N, B) (see hash_io), or a list of hashes: <ImageHash>, <PackedImageHash>, hex strings, integers
+                     or arrays of bits
+        words      - (integer) number of words of the result, hashes are padded with leading zero words to it
+    Returns:
+        numpy.array of uint64 of shape (N, W), hashes of any number of bits are padded on the left to whole
+        words like hash_to_binary_array pads them to 64 bits
+    """
+    if isinstance(hashes, numpy.ndarray) and hashes.dtype == numpy.uint64:
+        packed = hashes[:, None] if hashes.ndim == 1 else hashes
+    elif isinstance(hashes, numpy.ndarray) and hashes.dtype == numpy.uint8 and hashes.ndim == 2:
+        packed = hash_io.packed_to_uint64(hashes)
+    elif isinstance(hashes, numpy.ndarray):
+        raise TypeError('hashes must be an array of uint64 words or of uint8 packed hashes, not {}'.format(hashes.dtype))
+    else:
+        hashes = list(hashes)
+        if hashes and all(isinstance(image_hash, ImageHash) for image_hash in hashes):
+            packed = hash_io.packed_to_uint64(hash_io.hashes_to_packed(hashes))
+        else:
+            values = [hash_value(value) for value in hashes]
+            width = max([1] + [(bits + 63) // 64 for _, bits in values])
+            buffer = b''.join(value.to_bytes(width * 8, 'big') for value, _ in values)
+            packed = numpy.frombuffer(buffer, dtype='>u8').astype(numpy.uint64).reshape(len(values), width)
+    if words is not None and packed.shape[1] != words:
+        if packed.shape[1] > words:
+            raise ValueError('hashes of {} words do not fit in {} words'.format(packed.shape[1], words))
+        padding = numpy.zeros((len(packed), words - packed.shape[1]), dtype=numpy.uint64)
+        packed = numpy.concatenate((padding, packed), axis=1)
+    return packed
+
+
+def bit_metric(words_a: numpy.ndarray, words_b: numpy.ndarray, metric: str = 'hamming') -> numpy.ndarray:
+    """
+    metric between the (broadcast) rows of two arrays of words of the same width, see BIT_METRICS
+    The bit arrays compared are the W * 64 bits of the words, as Similarity.similarity compares 64 bit arrays
+    """
+    if metric not in BIT_METRICS:
+        raise ValueError("Invalid value '{}' for argument 'metric'".format(metric))
+    if metric in ('hamming', 'manhattan', 'euclidean', 'minkowski', 'min'):
+        distance = row_popcount(words_a ^ words_b)
+        if metric == 'euclidean':
+            return numpy.sqrt(distance, dtype=numpy.float64)
+        if metric in ('minkowski', 'min'):
+            return numpy.round(numpy.power(distance, 1 / 3.0, dtype=numpy.float64), 3)
+        return distance
+
+    if metric == 'bit_jaccard':
+        either = row_popcount(words_a | words_b).astype(numpy.float64)
+        common = row_popcount(words_a & words_b)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return numpy.where(either > 0, common / either, 1.0)
+
+    ones_a, ones_b = row_popcount(words_a).astype(numpy.float64), row_popcount(words_b).astype(numpy.float64)
+    if metric == 'cosine':
+        common = row_popcount(words_a & words_b)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return numpy.round(common / (numpy.round(numpy.sqrt(ones_a), 3) * numpy.round(numpy.sqrt(ones_b), 3)), 3)
+
+    # jaccard index of the sets of the bit values (0 and/or 1) of the arrays, as DistanceAlgorithms computes it
+    bits = words_a.shape[-1] * 64
+    has_one_a, has_one_b = ones_a > 0, ones_b > 0
+    has_zero_a, has_zero_b = ones_a < bits, ones_b < bits
+    intersection = (has_one_a & has_one_b).astype(numpy.float64) + (has_zero_a & has_zero_b)
+    union = (has_one_a | has_one_b).astype(numpy.float64) + (has_zero_a | has_zero_b)
+    return intersection / union
+
+
+def _result_dtype(metric: str):
+    return numpy.int32 if metric in ('hamming', 'manhattan') else numpy.float64
+
+
+def one_to_many(query, candidates, metric: str = 'hamming', chunk_size: int = CHUNK_SIZE) -> numpy.ndarray:
+    """
+    metric between a hash and every hash of a set, see Similarity.similarity_many
+    """
+    if metric not in BIT_METRICS:
+        raise ValueError("Invalid value '{}' for argument 'metric'".format(metric))
+    if not isinstance(candidates, numpy.ndarray):
+        candidates = to_words(candidates)
+    query = to_words([query])
+    width = max(query.shape[1], to_words(candidates[:1]).shape[1])
+    query = to_words(query, width)
+
+    chunk_size = max(chunk_size, 1)
+    result = numpy.empty(len(candidates), dtype=_result_dtype(metric))
+    for start in range(0, len(candidates), chunk_size):
+        # memory mapped uint8 hashes are converted to words one chunk at a time
+        chunk = to_words(candidates[start:start + chunk_size], width)
+        result[start:start + len(chunk)] = bit_metric(chunk, query, metric)
+    return result
+
+
+def many_to_many(hashes_a, hashes_b, metric: str = 'hamming', chunk_size: int = CHUNK_SIZE) -> numpy.ndarray:
+    """
+    metric between every pair of hashes of two sets, see Similarity.cdist
+    """
+    if metric not in BIT_METRICS:
+        raise ValueError("Invalid value '{}' for argument 'metric'".format(metric))
+    words_a, words_b = to_words(hashes_a), to_words(hashes_b)
+    width = max(words_a.shape[1], words_b.shape[1])
+    words_a, words_b = to_words(words_a, width), to_words(words_b, width)
+
+    result = numpy.empty((len(words_a), len(words_b)), dtype=_result_dtype(metric))
+    # rows of hashes_a compared at a time, so that a chunk holds about chunk_size pairs
+    rows = max(chunk_size // max(len(words_b), 1), 1)
+    for start in range(0, len(words_a), rows):
+        result[start:start + rows] = bit_metric(words_a[start:start + rows, None, :], words_b[None, :, :], metric)
+    return result
+
+
+# hashes added to an index one by one are scanned linearly until there are this many of them, then indexed
+MAX_PENDING = 1 << 16
+
+
+class PendingWords():
+    """
+    Mixin of the indexes whose tables are built over the words of all their hashes (self._words) at once: the words of
+    the hashes added since the tables were built are pending, the queries scan them linearly until there are enough
+    of them to build the tables again (see _pending_limit). _init_pending must be called by __init__
+    """
+    def _init_pending(self):
+        self._pending_words = []
+        self._pending = 0
+
+    def _pending_limit(self) -> int:
+        """ number of pending hashes the tables are built again at """
+        return MAX_PENDING
+
+    def _add_pending(self, words: numpy.ndarray) -> bool:
+        """ add the words of new hashes to the pending ones, returns True when the tables must be built again """
+        self._pending_words.append(words)
+        self._pending += len(words)
+        return self._pending >= self._pending_limit()
+
+    def _flush_pending(self):
+        """ append the pending words to self._words """
+        if self._pending_words:
+            self._words = numpy.concatenate([self._words] + self._pending_words)
+            self._pending_words, self._pending = [], 0
@@ -1,11 +1,16 @@
 from math import sqrt, pow
 from decimal import Decimal
 from imagewizard.helpers import hex_str_to_int
+from imagewizard.image_hash_similarity.api import bit_ops
 """
 Class containing methods to calculate distances between image hashes
 Code inspired by https://dataconomy.com/2015/04/implementing-the-five-most-popular-similarity-measures-in-python/
 """
 
+# the metrics measuring a similarity (the higher, the closer), the others measure a distance
+SIMILARITY_METRICS = ('cosine', 'jaccard', 'bit_jaccard')
+
+
 class DistanceAlgorithms():
     """ Five similarity measures function """
     def euclidean_distance(self, _x, _y):
@@ -62,6 +67,68 @@ class DistanceAlgorithms():
         union_cardinality = len(set.union(*[set(_x), set(_y)]))
         return intersection_cardinality / float(union_cardinality)
 
+    def bit_jaccard_similarity(self, _x: ([int]), _y: ([int])) -> float:
+        """ returns the jaccard similarity of the set bits of two binary lists: common set bits / set bits of either """
+
+        common_bits = sum(1 for a, b in zip(_x, _y) if a and b)
+        either_bits = sum(1 for a in _x if a) + sum(1 for b in _y if b) - common_bits
+        return common_bits / float(either_bits) if either_bits else 1.0
+
+
+class BitDistanceAlgorithms():
+    """
+    The similarity measures of DistanceAlgorithms for binary hashes held as integers (the bits of the hash, first bit
+    most significant), computed from popcounts rather than bit by bit: every measure is a couple of integer
+    operations whatever the metric. The values are the values of DistanceAlgorithms for the bit arrays of the
+    hashes, padded on the left with 0's to 'bits' bits (see hash_to_binary_array).
+    bit_ops computes the same measures on whole numpy arrays of hashes.
+    """
+    def __init__(self, bits: int = 64):
+        """
+        Params:
+            bits       - (integer) length of the compared bit arrays, only used by jaccard_similarity
+        """
+        self.bits = bits
+
+    def hamming_distance(self, _x: int, _y: int) -> int:
+        """ return the number of different bits: popcount(x ^ y) """
+
+        return bit_ops.int_popcount(_x ^ _y)
+
+    def manhattan_distance(self, _x: int, _y: int) -> int:
+        """ for xi,yi Є {0,1} the manhattan distance is the hamming distance """
+
+        return self.hamming_distance(_x, _y)
+
+    def euclidean_distance(self, _x: int, _y: int) -> float:
+        """ return the euclidean distance: sqrt(popcount(x ^ y)) """
+
+        return sqrt(self.hamming_distance(_x, _y))
+
+    def minkowski_distance(self, _x: int, _y: int, p_value: int = 3) -> float:
+        """ return the minkowski distance, rounded like DistanceAlgorithms.minkowski_distance: popcount(x ^ y) ** (1 / p) """
+
+        return round(self.hamming_distance(_x, _y)**(1 / float(p_value)), 3)
+
+    def cosine_similarity(self, _x: int, _y: int) -> float:
+        """ return the cosine similarity, rounded like DistanceAlgorithms.cosine_similarity: popcount(x & y) / sqrt(popcount(x) * popcount(y)) """
+
+        denominator = round(sqrt(bit_ops.int_popcount(_x)), 3) * round(sqrt(bit_ops.int_popcount(_y)), 3)
+        return round(bit_ops.int_popcount(_x & _y) / float(denominator), 3)
+
+    def jaccard_similarity(self, _x: int, _y: int) -> float:
+        """ return the jaccard similarity of DistanceAlgorithms: of the sets of the bit values (0 and/or 1) of the arrays """
+
+        values_x = {value for value, present in ((1, _x != 0), (0, bit_ops.int_popcount(_x) < self.bits)) if present}
+        values_y = {value for value, present in ((1, _y != 0), (0, bit_ops.int_popcount(_y) < self.bits)) if present}
+        return len(values_x & values_y) / float(len(values_x | values_y))
+
+    def bit_jaccard_similarity(self, _x: int, _y: int) -> float:
+        """ return the jaccard similarity of the set bits: popcount(x & y) / popcount(x | y) """
+
+        either_bits = bit_ops.int_popcount(_x | _y)
+        return bit_ops.int_popcount(_x & _y) / float(either_bits) if either_bits else 1.0
+
 
 # LEGACY CODE
 def hamming_distance(hash_src: int, hash_target: [int]) -> list:
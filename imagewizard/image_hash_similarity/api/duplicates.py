@@ -0,0 +1,305 @@
+"""
+All pairs near-duplicate join of a set of hashes: the pairs of hashes within a radius of each other, and the groups of
+duplicates they connect.
+The hashes are split into m substrings (see MIHIndex): two hashes within radius r = m * a + b (b < m) of each other
+have one of their first b + 1 substrings within a bits, or one of the others within a - 1 bits. For every substring,
+the buckets of its values (the tables of mih.build_table) are joined with the buckets of the values within that
+many bits, through every XOR mask of that many bits, and only the distances of the pairs of hashes of joined buckets
+are computed. A pair is reported by the first substring it is found through only, so every pair is found once.
+The tables are written to a temporary base segment file (see mapped_index), which the worker processes map: they
+share its pages, and only copy the hashes in the order of the table they join (8 bytes per word per hash), so that
+the hashes of a bucket are a range of rows. Each task joins the buckets of a substring through a few masks, verifying
+the candidate pairs a chunk at a time.
+"""
+import collections
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy
+from imagewizard.image_hash_similarity.api import bit_ops, mapped_index, mih
+
+# candidate pairs verified at a time, bounds the memory of a task
+PAIRS_CHUNK_SIZE = 1 << 20
+# XOR masks of the substring neighbourhoods joined per task
+MASKS_PER_TASK = 32
+# time of the lookup of a bucket relative to the verification of a candidate pair, measured
+LOOKUP_COST = 0.3
+
+
+def join_substrings(bits: int, count: int, radius: int) -> int:
+    """
+    number of substrings m of the join of count distinct hashes of the given number of bits, of the least estimated
+    cost: count bucket lookups per XOR mask (LOOKUP_COST each), and count ** 2 / 2 candidate pairs times the
+    probability that two random hashes have neighbouring substrings. Substrings are at most mih.MAX_OFFSETS_BITS bits
+    """
+    least = max(-(-bits // mih.MAX_OFFSETS_BITS), 1)
+    best, best_cost = least, None
+    for substrings in range(least, max(min(bits, radius + 1), least) + 1):
+        masks, probability = 0, 0.0
+        lengths = [length for _, length in mih.table_layout(bits, -(-bits // 64), substrings)]
+        for length, table_radius in zip(lengths, mih.table_radii(substrings, radius)):
+            if table_radius >= 0:
+                neighbours = mih.neighbourhood_size(length, table_radius)
+                masks += neighbours
+                probability += neighbours / 2**length
+        cost = count * masks * LOOKUP_COST + count * count / 2 * probability
+        if best_cost is None or cost < best_cost:
+            best, best_cost = substrings, cost
+    return best
+
+
+def _expand(starts: numpy.ndarray, counts: numpy.ndarray) -> numpy.ndarray:
+    """ concatenation of the ranges [start, start + count) """
+    counts = counts.astype(numpy.int64)
+    if not len(counts):
+        return numpy.zeros(0, dtype=numpy.int64)
+    firsts = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+    return numpy.repeat(starts.astype(numpy.int64) - firsts, counts) + numpy.arange(counts.sum())
+
+
+# the join of the current (worker) process, see _init_join
+_join = {}
+
+
+def _init_join(file_name: str, radius: int, chunk_size: int):
+    """ map the segment of the hashes to join, once per process and join """
+    if _join.get('file_name') == file_name:
+        return
+    _, hashes, _, tables = mapped_index.read_segment(file_name)
+    _join.clear()
+    # plain views of the mapping, indexing a numpy.memmap wraps every result in a memmap
+    _join.update({
+        'file_name': file_name,
+        'hashes': hashes.view(numpy.ndarray),
+        'tables': [(start, length, offsets.view(numpy.ndarray), order.view(numpy.ndarray))
+                   for start, length, offsets, order in tables],
+        'radius': radius,
+        'radii': mih.table_radii(len(tables), radius),
+        'chunk_size': chunk_size
+    })
+
+
+def _table(table: int) -> dict:
+    """
+    the arrays of a table joined by the tasks of this process, of the last table only:
+        values, starts, counts - the values of the non empty buckets, and the range of positions of their hashes in the
+                                 order of the table
+        present                - whether the bucket of every value is non empty (a byte per value)
+        hashes                 - the hashes in the order of the table, so that a bucket is a range of rows
+    """
+    if _join.get('table', {}).get('table') != table:
+        _, _, offsets, order = _join['tables'][table]
+        counts = numpy.diff(offsets).astype(numpy.int64)
+        values = numpy.flatnonzero(counts)
+        _join['table'] = {
+            'table': table,
+            'values': values,
+            'starts': offsets[values].astype(numpy.int64),
+            'counts': counts[values],
+            'present': counts > 0,
+            'hashes': _join['hashes'][order.astype(numpy.intp)]
+        }
+    return _join['table']
+
+
+def _verify(table: int, lefts: numpy.ndarray, right_starts: numpy.ndarray, right_counts: numpy.ndarray):
+    """
+    yield the (left, right, distance) arrays of the pairs within radius among the pairs of the hash at every position
+    of lefts and the hashes at the right_counts positions from right_starts (in the order of the table), a chunk of
+    pairs at a time
+    """
+    tables, chunk_size, radius = _join['tables'], _join['chunk_size'], _join['radius']
+    order, hashes = tables[table][3], _table(table)['hashes']
+    if len(right_counts) and right_counts.max() > chunk_size:
+        # rows of more pairs than a chunk are split
+        pieces = -(-right_counts // chunk_size)
+        rows = numpy.repeat(numpy.arange(len(right_counts)), pieces)
+        piece_starts = _expand(numpy.zeros(len(pieces)), pieces) * chunk_size
+        lefts, right_starts = lefts[rows], right_starts[rows] + piece_starts
+        right_counts = numpy.minimum(right_counts[rows] - piece_starts, chunk_size)
+    cumulative = numpy.cumsum(right_counts)
+    start = 0
+    while start < len(right_counts):
+        done = cumulative[start - 1] if start else 0
+        stop = max(int(numpy.searchsorted(cumulative, done + chunk_size, side='right')), start + 1)
+        lefts_chunk = numpy.repeat(lefts[start:stop], right_counts[start:stop])
+        rights_chunk = _expand(right_starts[start:stop], right_counts[start:stop])
+        start = stop
+        distances = bit_ops.row_popcount(hashes[lefts_chunk] ^ hashes[rights_chunk])
+        matches = numpy.flatnonzero(distances <= radius)
+        lefts_chunk, rights_chunk, distances = lefts_chunk[matches], rights_chunk[matches], distances[matches]
+        for earlier in range(table):
+            # the pairs an earlier table joins are reported by that table
+            bit, length = tables[earlier][:2]
+            substring_distances = bit_ops.popcount(mih.substring(hashes[lefts_chunk], bit, length) ^
+                                                   mih.substring(hashes[rights_chunk], bit, length))
+            later = substring_distances > _join['radii'][earlier]
+            lefts_chunk, rights_chunk, distances = lefts_chunk[later], rights_chunk[later], distances[later]
+        if len(distances):
+            yield (order[lefts_chunk].astype(numpy.int64), order[rights_chunk].astype(numpy.int64),
+                   distances.astype(numpy.int32))
+
+
+def _join_task(task, file_name: str, radius: int, chunk_size: int) -> tuple:
+    """
+    worker entry point, task is a tuple of (table, XOR masks): join the buckets of the table's substring values
+    with the buckets of the values XOR every mask, in the segment file_name (see _init_join)
+    Returns:
+        (left, right, distance) arrays of the pairs (indices of the mapped hashes) within radius found
+    """
+    _init_join(file_name, radius, chunk_size)
+    table, masks = task
+    offsets = _join['tables'][table][2]
+    arrays = _table(table)
+    values, starts, counts = arrays['values'], arrays['starts'], arrays['counts']
+    found = [(numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int32))]
+    for mask in masks.tolist():
+        if mask == 0:
+            # the pairs of a bucket: every hash and the hashes after it in its bucket
+            shared = counts > 1
+            lefts = _expand(starts[shared], counts[shared])
+            ends = numpy.repeat(starts[shared] + counts[shared], counts[shared])
+            right_starts, right_counts = lefts + 1, ends - lefts - 1
+        else:
+            # every pair of buckets once, from the bucket of the lower value
+            partners = values ^ mask
+            joined = numpy.flatnonzero((partners > values) & arrays['present'][partners])
+            partner_starts = offsets[partners[joined]].astype(numpy.int64)
+            partner_counts = offsets[partners[joined] + 1].astype(numpy.int64) - partner_starts
+            lefts = _expand(starts[joined], counts[joined])
+            right_starts = numpy.repeat(partner_starts, counts[joined])
+            right_counts = numpy.repeat(partner_counts, counts[joined])
+        found.extend(_verify(table, lefts, right_starts, right_counts))
+    return tuple(numpy.concatenate(column) for column in zip(*found))
+
+
+def _run_join(file_name: str, radius: int, chunk_size: int, tasks: list, workers: int):
+    """ yield the results of the join tasks, computed by a pool of worker processes (in the order of the tasks) """
+    if workers <= 1:
+        try:
+            for task in tasks:
+                yield _join_task(task, file_name, radius, chunk_size)
+        finally:
+            _join.clear()
+        return
+
+    pool = ProcessPoolExecutor(max_workers=workers)
+    # at most a few tasks ahead of the consumer, so that the pairs waiting to be consumed stay few
+    pending = collections.deque()
+    try:
+        for task in tasks:
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+            pending.append(pool.submit(_join_task, task, file_name, radius, chunk_size))
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # a join closed early does not wait for the tasks not started yet
+        for future in pending:
+            future.cancel()
+        pool.shutdown(wait=True)
+
+
+def iter_duplicate_edges(hashes,
+                         radius: int = 10,
+                         bits: int = None,
+                         substrings: int = None,
+                         workers: int = None,
+                         chunk_size: int = PAIRS_CHUNK_SIZE):
+    """
+    Stream the pairs of near-duplicate hashes of a set, see Similarity.iter_duplicate_edges
+    Params:
+        hashes     - list of hashes, or a numpy.array of uint64 words / uint8 packed hashes (see bit_ops.to_words)
+        radius     - (integer) maximum hamming distance of the pairs
+        bits       - (integer) number of bits of the hashes, by default the bits of the hashes padded to whole words
+        substrings - (integer) number of substrings of the join, see join_substrings for the default
+        workers    - (integer) number of worker processes, defaults to the number of cpus. 0 or 1 joins in this process
+        chunk_size - (integer) number of candidate pairs verified at a time by a task
+    Yields:
+        (left, right, distance) numpy.arrays of the indices in hashes (left < right) and the distances of pairs.
+        Every pair of distinct hashes within radius is yielded once, between the first occurrences of the hashes, and
+        every repeated hash is paired with its first occurrence (distance 0)
+    """
+    words = bit_ops.to_words(hashes)
+    bits = words.shape[1] * 64 if bits is None else bits
+    if substrings is not None and substrings < 1:
+        raise ValueError('substrings: {} must be an integer >= 1'.format(substrings))
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if words.shape[1] == 1:
+        unique, first, inverse = numpy.unique(words[:, 0], return_index=True, return_inverse=True)
+        unique = unique[:, None]
+    else:
+        unique, first, inverse = numpy.unique(words, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    copies = numpy.flatnonzero(first[inverse] != numpy.arange(len(words)))
+    if len(copies):
+        yield first[inverse[copies]], copies, numpy.zeros(len(copies), dtype=numpy.int32)
+    if radius < 1 or len(unique) < 2:
+        return
+
+    substrings = substrings or join_substrings(bits, len(unique), radius)
+    substrings = min(max(substrings, -(-bits // mih.MAX_OFFSETS_BITS)), bits)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_name = os.path.join(tmp_dir, 'join.iwx')
+        mapped_index.write_segment(file_name, bits, words.shape[1],
+                                   [(unique, numpy.arange(len(unique)), numpy.ones(len(unique), dtype=bool))],
+                                   substrings)
+        tasks = []
+        for table, ((_, length), table_radius) in enumerate(
+                zip(mih.table_layout(bits, words.shape[1], substrings), mih.table_radii(substrings, radius))):
+            if table_radius >= 0:
+                masks = mih.neighbourhood(length, table_radius)
+                tasks.extend((table, masks[start:start + MASKS_PER_TASK]) for start in range(0, len(masks), MASKS_PER_TASK))
+        for lefts, rights, distances in _run_join(file_name, radius, chunk_size, tasks, workers):
+            if len(distances):
+                lefts, rights = first[lefts], first[rights]
+                yield numpy.minimum(lefts, rights), numpy.maximum(lefts, rights), distances
+
+
+def _find(parent: numpy.ndarray, nodes: numpy.ndarray) -> numpy.ndarray:
+    """ roots of nodes in the union-find forest parent (parent[root] == root) """
+    roots = parent[nodes]
+    while True:
+        next_roots = parent[roots]
+        if numpy.array_equal(next_roots, roots):
+            return roots
+        roots = next_roots
+
+
+def _union(parent: numpy.ndarray, lefts: numpy.ndarray, rights: numpy.ndarray):
+    """ merge the trees of every pair (left, right) of nodes, the root of a tree is its smallest node """
+    nodes = numpy.concatenate((lefts, rights))
+    # path compression of the nodes joined
+    parent[nodes] = _find(parent, nodes)
+    while len(lefts):
+        lefts, rights = _find(parent, lefts), _find(parent, rights)
+        differ = lefts != rights
+        lefts, rights = lefts[differ], rights[differ]
+        # of the pairs sharing a root, one is merged per pass
+        numpy.minimum.at(parent, numpy.maximum(lefts, rights), numpy.minimum(lefts, rights))
+
+
+def find_duplicates(hashes,
+                    radius: int = 10,
+                    keys: list = None,
+                    bits: int = None,
+                    substrings: int = None,
+                    workers: int = None) -> list:
+    """
+    groups of near-duplicates: the connected components of the pairs of iter_duplicate_edges, merged with a
+    union-find as they are streamed, see Similarity.find_duplicates
+    """
+    words = bit_ops.to_words(hashes)
+    if keys is not None and len(keys) != len(words):
+        raise ValueError('keys must have one key per hash')
+    parent = numpy.arange(len(words))
+    for lefts, rights, _ in iter_duplicate_edges(words, radius, bits, substrings, workers):
+        _union(parent, lefts, rights)
+    roots = _find(parent, numpy.arange(len(words)))
+    grouped = numpy.flatnonzero(numpy.bincount(roots, minlength=len(roots))[roots] > 1)
+    # the root of a group is its first hash, groups sorted by root are sorted by their first hash
+    order = grouped[numpy.argsort(roots[grouped], kind='stable')]
+    groups = numpy.split(order, numpy.flatnonzero(numpy.diff(roots[order])) + 1) if len(order) else []
+    return [group.tolist() if keys is None else [keys[index] for index in group.tolist()] for group in groups]
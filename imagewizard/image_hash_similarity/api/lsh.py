@@ -0,0 +1,266 @@
+import time
+import numpy
+from imagewizard.image_hash_similarity.api import bit_ops
+""" Bit sampling locality sensitive hashing: approximate radius and nearest neighbour search of hashes """
+
+# (tables, bits_per_table) tuned for radius ~10 of 64 bits and ~40 of 256 bits: ~85% of the hashes at exactly that
+# distance are found (more of the nearer ones), with ~1500 (64 bits) and ~70 (256 bits) candidates per 1M hashes
+LSH_PRESETS = {
+    64: {'tables': 24, 'bits_per_table': 14},
+    256: {'tables': 64, 'bits_per_table': 20},
+}
+
+
+def lsh_preset(bits: int) -> dict:
+    """ the LSH_PRESETS parameters for hashes of the given number of bits (the preset of the closest size) """
+    return dict(LSH_PRESETS[min(LSH_PRESETS, key=lambda preset_bits: abs(preset_bits - bits))])
+
+
+class LSHIndex(bit_ops.PendingWords):
+    """
+    Approximate index of hashes (ImageHash, PackedImageHash, hex strings or integers of the same number of bits), for
+    radii too large for an exact index (see MIHIndex) or approximate nearest neighbours.
+    Each of the L tables is keyed by k bits of the hashes sampled at random: two hashes d bits apart share the key
+    of a table with a probability of about (1 - d / bits) ** k, so near hashes collide in at least one table with a
+    high probability while far hashes rarely do. A query only computes the distance of the hashes colliding with it.
+    Recall and latency are traded at query time: fewer tables or more bits per table (up to the bits of the tables)
+    give fewer candidates, faster and with a lower recall, and max_candidates caps the candidates to the hashes
+    colliding in the most tables. See evaluate_recall to measure the recall of a setting against a brute force search.
+    """
+    def __init__(self, tables: int = None, bits_per_table: int = None, seed: int = 0):
+        """
+        Params:
+            tables     - (integer) number of tables L, by default from LSH_PRESETS for the number of bits of the hashes
+            bits_per_table - (integer) number of bits k sampled for every table (at most 64), by default from LSH_PRESETS
+            seed       - (integer) seed of the random sampling of the bits
+        """
+        if tables is not None and tables < 1:
+            raise ValueError('tables: {} must be an integer >= 1'.format(tables))
+        if bits_per_table is not None and not 1 <= bits_per_table <= 64:
+            raise ValueError('bits_per_table: {} must be an integer between 1 and 64'.format(bits_per_table))
+        self.tables = tables
+        self.bits_per_table = bits_per_table
+        self.seed = seed
+        self._words = None
+        self._keys = []
+        # positions of the sampled bits of every table, 0 being the most significant bit of the first word
+        self._sampled_bits = None
+        # (sorted table keys, indices of the hashes in that order) per table
+        self._tables = []
+        # number of hashes in the tables, the hashes added after them are pending
+        self._indexed = 0
+        self._init_pending()
+
+    def __len__(self):
+        """ number of indexed hashes """
+        return len(self._keys)
+
+    def _to_words(self, image_hashes) -> numpy.ndarray:
+        words = bit_ops.to_words(image_hashes, None if self._words is None else self._words.shape[1])
+        if self._words is None:
+            self._words = numpy.zeros((0, words.shape[1]), dtype=numpy.uint64)
+            preset = lsh_preset(words.shape[1] * 64)
+            self.tables = self.tables or preset['tables']
+            self.bits_per_table = self.bits_per_table or preset['bits_per_table']
+            sampled = numpy.random.default_rng(self.seed).random((self.tables, words.shape[1] * 64))
+            self._sampled_bits = numpy.argsort(sampled, axis=1)[:, :self.bits_per_table]
+        return words
+
+    def _table_keys(self, words: numpy.ndarray, chunk_size: int = 8192) -> numpy.ndarray:
+        """
+        keys of every hash (row) in every table, numpy.array of shape (tables, N): the sampled bits of the table,
+        the first sampled bit being the most significant. uint32 for up to 32 bits per table, uint64 otherwise
+        """
+        keys = numpy.empty((self.tables, len(words)), dtype=numpy.uint32 if self.bits_per_table <= 32 else numpy.uint64)
+        for start in range(0, len(words), chunk_size):
+            chunk = words[start:start + chunk_size]
+            bits = numpy.unpackbits(chunk.astype('>u8').view(numpy.uint8), axis=1)[:, self._sampled_bits]
+            # pack the bits of every key to bytes (padded on the right), then to a big endian word padded on the left
+            packed = numpy.packbits(bits, axis=2)
+            padded = numpy.zeros(packed.shape[:2] + (8, ), dtype=numpy.uint8)
+            padded[:, :, 8 - packed.shape[2]:] = packed
+            keys[:, start:start + chunk_size] = (padded.view('>u8')[:, :, 0] >> numpy.uint64(-self.bits_per_table % 8)).T
+        return keys
+
+    def build(self, image_hashes, keys: list = None):
+        """
+        Add many hashes and build the tables of the whole index again
+        Params:
+            image_hashes - list of hashes, or a numpy.array of uint64 words / uint8 packed hashes (see bit_ops.to_words)
+            keys       - list of the keys of the hashes, defaults to their index in the index
+        """
+        words = self._to_words(image_hashes)
+        if keys is None:
+            keys = list(range(len(self._keys), len(self._keys) + len(words)))
+        if len(keys) != len(words):
+            raise ValueError('keys must have one key per hash')
+        self._flush_pending()
+        self._words = numpy.concatenate((self._words, words))
+        self._keys.extend(keys)
+        self._build_tables()
+
+    def add(self, key, image_hash):
+        """
+        Add a hash. It is found by the queries straight away, with a linear scan until bit_ops.MAX_PENDING hashes
+        are added, the tables are then built again
+        """
+        words = self._to_words([image_hash])
+        self._keys.append(key)
+        if self._add_pending(words):
+            self._flush_pending()
+            self._build_tables()
+
+    def _build_tables(self):
+        index_type = numpy.uint32 if len(self._words) < 2**32 else numpy.uint64
+        self._tables = []
+        keys = self._table_keys(self._words)
+        for table_keys in keys:
+            order = numpy.argsort(table_keys)
+            self._tables.append((table_keys[order], order.astype(index_type)))
+        self._indexed = len(self._words)
+
+    def _candidates(self, query_words: numpy.ndarray, tables: int, bits_per_table: int,
+                    max_candidates: int) -> numpy.ndarray:
+        """ indices of the indexed hashes colliding with the query in one of the first 'tables' tables """
+        tables = self.tables if tables is None else min(tables, self.tables)
+        bits_per_table = self.bits_per_table if bits_per_table is None else min(bits_per_table, self.bits_per_table)
+        # with fewer bits, the key is a prefix of the table key: a range of the sorted keys
+        shift = self.bits_per_table - bits_per_table
+        found = []
+        query_keys = self._table_keys(query_words)[:, 0].tolist()
+        for table in range(tables):
+            table_keys, order = self._tables[table]
+            prefix = query_keys[table] >> shift
+            low, high = prefix << shift, (prefix + 1) << shift
+            left = int(numpy.searchsorted(table_keys, table_keys.dtype.type(low)))
+            if high >> self.bits_per_table:
+                right = len(table_keys)
+            else:
+                right = int(numpy.searchsorted(table_keys, table_keys.dtype.type(high)))
+            found.append(order[left:right])
+        if not found:
+            return numpy.zeros(0, dtype=numpy.int64)
+        candidates = numpy.concatenate(found)
+        if max_candidates is not None and len(candidates) > max_candidates:
+            # the hashes colliding in the most tables are the most likely to be near
+            candidates, collisions = numpy.unique(candidates, return_counts=True)
+            candidates = candidates[numpy.argsort(-collisions, kind='stable')[:max_candidates]]
+        return candidates
+
+    def _search(self, image_hash, tables: int, bits_per_table: int, max_candidates: int):
+        """ (indices, distances) of the unique candidates of a query, including the pending hashes """
+        query_words = self._to_words([image_hash])
+        candidates = numpy.zeros(0, dtype=numpy.int64)
+        if self._tables:
+            candidates = self._candidates(query_words, tables, bits_per_table, max_candidates)
+        candidates = numpy.unique(candidates)
+        words = self._words[candidates]
+        if self._pending_words:
+            candidates = numpy.concatenate((candidates, numpy.arange(self._indexed, len(self._keys))))
+            words = numpy.concatenate([words] + self._pending_words)
+        return candidates, bit_ops.row_popcount(words ^ query_words).astype(numpy.int64)
+
+    def _query(self, image_hash, radius: int, tables: int, bits_per_table: int, max_candidates: int):
+        candidates, distances = self._search(image_hash, tables, bits_per_table, max_candidates)
+        matches = numpy.flatnonzero(distances <= radius)
+        matches = matches[numpy.argsort(distances[matches], kind='stable')]
+        return candidates[matches], distances[matches], len(candidates)
+
+    def _nearest(self, image_hash, k: int, tables: int, bits_per_table: int, max_candidates: int):
+        candidates, distances = self._search(image_hash, tables, bits_per_table, max_candidates)
+        nearest = numpy.argsort(distances, kind='stable')[:k]
+        return candidates[nearest], distances[nearest], len(candidates)
+
+    def query(self,
+              image_hash,
+              radius: int = 10,
+              tables: int = None,
+              bits_per_table: int = None,
+              max_candidates: int = None) -> list:
+        """
+        Approximate radius search: the hashes within radius of image_hash found in the tables
+        Params:
+            image_hash - <ImageHash>, <PackedImageHash>, hex string or integer
+            radius     - (integer) maximum hamming distance of the returned hashes
+            tables     - (integer) number of tables looked up, all by default. Fewer is faster, with a lower recall
+            bits_per_table - (integer) number of the sampled bits of every table the hashes must share with the query,
+                         at most (and by default) the bits of the tables. Fewer means more candidates and a higher recall
+            max_candidates - (integer) maximum number of candidates whose distance is computed, the ones colliding
+                         with the query in the most tables
+        Returns:
+            list of (key, distance) closest first, which may miss some of the hashes within radius
+        """
+        if not self._keys:
+            return []
+        indices, distances, _ = self._query(image_hash, radius, tables, bits_per_table, max_candidates)
+        return [(self._keys[index], distance) for index, distance in zip(indices.tolist(), distances.tolist())]
+
+    def nearest(self,
+                image_hash,
+                k: int = 1,
+                tables: int = None,
+                bits_per_table: int = None,
+                max_candidates: int = None) -> list:
+        """
+        Approximate k nearest neighbours, among the hashes colliding with image_hash, see query for the parameters
+        Returns:
+            list of the (key, distance) of at most k hashes, closest first
+        """
+        if not self._keys or k < 1:
+            return []
+        indices, distances, _ = self._nearest(image_hash, k, tables, bits_per_table, max_candidates)
+        return [(self._keys[index], distance) for index, distance in zip(indices.tolist(), distances.tolist())]
+
+    def evaluate_recall(self,
+                        queries,
+                        radius: int = None,
+                        k: int = None,
+                        tables: int = None,
+                        bits_per_table: int = None,
+                        max_candidates: int = None) -> dict:
+        """
+        Measure the recall of the index for a setting, against an exact brute force search of all the hashes
+        Params:
+            queries    - list of hashes to query, e.g. a sample of the indexed hashes with a few bits flipped
+            radius     - (integer) evaluate query(radius), the default
+            k          - (integer) evaluate nearest(k) instead
+            tables, bits_per_table, max_candidates - the query parameters, see query
+        Returns:
+            dict of:
+                recall          - fraction of the exact results found (radius), or of the k nearest distances
+                                  matched (k), over all the queries
+                candidates      - mean number of candidates whose distance is computed per query
+                query_ms        - mean time of a query in milliseconds
+                brute_force_ms  - mean time of the exact search in milliseconds
+        """
+        if k is None and radius is None:
+            radius = 10
+        queries = list(queries)
+        words = numpy.concatenate([self._words] + self._pending_words)
+        found, expected, candidates, query_time, exact_time = 0, 0, 0, 0.0, 0.0
+        for image_hash in queries:
+            start = time.perf_counter()
+            if k is None:
+                _, distances, count = self._query(image_hash, radius, tables, bits_per_table, max_candidates)
+            else:
+                _, distances, count = self._nearest(image_hash, k, tables, bits_per_table, max_candidates)
+            query_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            exact = bit_ops.one_to_many(image_hash, words)
+            exact_time += time.perf_counter() - start
+            if k is None:
+                found, expected = found + len(distances), expected + int(numpy.count_nonzero(exact <= radius))
+            else:
+                exact = numpy.sort(exact)[:k]
+                # a result as near as the exact one of the same rank is a match, whichever of equidistant hashes it is
+                found += int(numpy.count_nonzero(distances <= exact[:len(distances)]))
+                expected += len(exact)
+            candidates += count
+        queries_count = max(len(queries), 1)
+        return {
+            'recall': found / expected if expected else 1.0,
+            'candidates': candidates / queries_count,
+            'query_ms': query_time * 1000 / queries_count,
+            'brute_force_ms': exact_time * 1000 / queries_count,
+        }
@@ -0,0 +1,387 @@
+"""
+Memory mapped on-disk index of hashes: opened in constant time with numpy.memmap, searched directly on the mapping,
+and shared by all the processes opening it through the page cache
+
+Index directory:
+    index.json             - {"version": 1, "generation": g, "next_id": n}, replaced atomically by compact. next_id is
+                             above every id added before the generation, so that default ids are never reused
+    base-<g>.iwx           - base segment (format below), written once by compact and never modified
+    delta-<g>.iwd          - delta segment, the hashes added since: records of the id (int64) and the W words of a hash
+    tombstones-<g>.i64     - the deletions since: records of the id (int64) and the number of delta records at the time
+
+Base segment file format (.iwx), little endian, every section starting on a multiple of 8 bytes:
+    offset  size  field
+    0       8     magic b'IWINDEX' followed by the format version (uint8, 1)
+    8       4     bits per hash (uint32)
+    12      4     words per hash W (uint32), ceil(bits / 64)
+    16      8     count, number of hashes (uint64)
+    24      4     substrings m of the bucket tables (uint32), 0 for no tables
+    28      36    reserved, zeros
+    64      ...   count rows of W uint64 words, the hashes, most significant word first (see bit_ops)
+    ...     ...   count int64, the ids of the hashes
+    ...     ...   per substring (see mih.table_layout): the offsets of every substring value (2 ** bits + 1 integers),
+                  then the indices of the hashes sorted by substring value (count integers), see mih.build_table.
+                  The integers are uint32, or uint64 for 2 ** 32 hashes or more
+"""
+import json
+import os
+import struct
+import numpy
+from imagewizard.image_hash_similarity.api import bit_ops, mih
+
+INDEX_FILE_MAGIC = b'IWINDEX'
+INDEX_FILE_VERSION = 1
+INDEX_FILE_HEADER = struct.Struct('<7sBIIQI36x')
+TOMBSTONE = numpy.dtype([('id', '<i8'), ('position', '<i8')])
+
+
+def _aligned(size: int) -> int:
+    return -(-size // 8) * 8
+
+
+def segment_layout(bits: int, words: int, count: int, substrings: int) -> dict:
+    """
+    byte offsets of the sections of a base segment file
+    Returns:
+        dict of 'hashes' and 'ids' (offsets), 'tables' (list of (start bit, number of bits, offset of the offsets,
+        offset of the order) per substring), 'index_type' (dtype of the tables) and 'size' (of the file)
+    """
+    index_type = numpy.dtype(numpy.uint32 if count < 2**32 else numpy.uint64).newbyteorder('<')
+    layout = {'hashes': INDEX_FILE_HEADER.size, 'ids': INDEX_FILE_HEADER.size + count * words * 8}
+    position = layout['ids'] + count * 8
+    tables = []
+    if substrings:
+        for start, length in mih.table_layout(bits, words, substrings):
+            offsets = position
+            order = _aligned(offsets + ((1 << length) + 1) * index_type.itemsize)
+            tables.append((start, length, offsets, order))
+            position = _aligned(order + count * index_type.itemsize)
+    layout.update({'tables': tables, 'index_type': index_type, 'size': position})
+    return layout
+
+
+def write_segment(file_name: str, bits: int, words: int, parts, substrings: int = 0):
+    """
+    write a base segment file, see the module documentation for the format
+    Params:
+        file_name  - path of the file
+        bits       - (integer) number of bits of the hashes
+        words      - (integer) number of uint64 words per hash
+        parts      - list of (words, ids, mask): arrays of the hashes (N, W) and of their ids (N, ), which may be memory
+                     mapped, and the boolean mask of the rows to write. They are copied a chunk at a time
+        substrings - (integer) number of substrings of the bucket tables, 0 for none. Every substring must be
+                     at most mih.MAX_OFFSETS_BITS
+    """
+    count = sum(int(numpy.count_nonzero(mask)) for _, _, mask in parts)
+    layout = segment_layout(bits, words, count, substrings if count else 0)
+    if any(length > mih.MAX_OFFSETS_BITS for _, length, _, _ in layout['tables']):
+        raise ValueError('substrings of {} bits must be at most {} bits'.format(bits, mih.MAX_OFFSETS_BITS))
+    chunk_size = max(bit_ops.CHUNK_SIZE // words, 1)
+    with open(file_name, 'wb') as segment:
+        segment.write(INDEX_FILE_HEADER.pack(INDEX_FILE_MAGIC, INDEX_FILE_VERSION, bits, words, count,
+                                             len(layout['tables'])))
+        for column in (0, 1):
+            for part in parts:
+                for start in range(0, len(part[2]), chunk_size):
+                    rows = part[column][start:start + chunk_size][part[2][start:start + chunk_size]]
+                    rows.astype('<u8' if column == 0 else '<i8').tofile(segment)
+        segment.truncate(layout['size'])
+
+    if layout['tables']:
+        # the tables are built from the hashes just written, one at a time
+        hashes = numpy.memmap(file_name, dtype='<u8', mode='r', offset=layout['hashes'], shape=(count, words))
+        with open(file_name, 'r+b') as segment:
+            for start, length, offsets, order in layout['tables']:
+                _, _, values, indices = mih.build_table(hashes, start, length)
+                segment.seek(offsets)
+                values.astype(layout['index_type']).tofile(segment)
+                segment.seek(order)
+                indices.astype(layout['index_type']).tofile(segment)
+        del hashes
+    with open(file_name, 'rb+') as segment:
+        os.fsync(segment.fileno())
+
+
+def read_segment(file_name: str) -> tuple:
+    """
+    map a base segment file, in constant time
+    Returns:
+        (header, hashes, ids, tables) where header is a dict of 'bits', 'words', 'count' and 'substrings', hashes and
+        ids are read only memory mapped arrays (count, W) of uint64 and (count, ) of int64 and tables the list of the
+        mapped tables of the substrings, as mih.build_table returns them
+    """
+    with open(file_name, 'rb') as segment:
+        header = segment.read(INDEX_FILE_HEADER.size)
+    if len(header) != INDEX_FILE_HEADER.size:
+        raise ValueError('{} is not an index file'.format(file_name))
+    magic, version, bits, words, count, substrings = INDEX_FILE_HEADER.unpack(header)
+    if magic != INDEX_FILE_MAGIC:
+        raise ValueError('{} is not an index file'.format(file_name))
+    if version != INDEX_FILE_VERSION:
+        raise ValueError('unsupported index file version {}'.format(version))
+    layout = segment_layout(bits, words, count, substrings)
+    if os.path.getsize(file_name) < layout['size']:
+        raise ValueError('{} is truncated'.format(file_name))
+    # a single mapping of the whole file, the sections are views of it
+    mapping = numpy.memmap(file_name, dtype=numpy.uint8, mode='r')
+    hashes = mapping[layout['hashes']:layout['ids']].view('<u8').reshape(count, words)
+    ids = mapping[layout['ids']:layout['ids'] + count * 8].view('<i8')
+    index_type = layout['index_type']
+    tables = [
+        (start, length,
+         mapping[offsets:offsets + ((1 << length) + 1) * index_type.itemsize].view(index_type),
+         mapping[order:order + count * index_type.itemsize].view(index_type))
+        for start, length, offsets, order in layout['tables']
+    ]
+    header = {'bits': bits, 'words': words, 'count': count, 'substrings': substrings}
+    return header, hashes, ids, tables
+
+
+def _scan(words: numpy.ndarray, query_words: numpy.ndarray, radius: int) -> tuple:
+    """ (rows, distances) of the hashes of words within radius of the query, a chunk of rows at a time """
+    rows, distances = [numpy.zeros(0, dtype=numpy.int64)], [numpy.zeros(0, dtype=numpy.int32)]
+    chunk_size = max(bit_ops.CHUNK_SIZE // query_words.shape[1], 1)
+    for start in range(0, len(words), chunk_size):
+        chunk_distances = bit_ops.row_popcount(words[start:start + chunk_size] ^ query_words)
+        matches = numpy.flatnonzero(chunk_distances <= radius)
+        rows.append(matches + start)
+        distances.append(chunk_distances[matches].astype(numpy.int32))
+    return numpy.concatenate(rows), numpy.concatenate(distances)
+
+
+class MappedHashIndex():
+    """
+    On-disk index of hashes (ImageHash, PackedImageHash, hex strings or integers of up to bits bits) with integer ids,
+    e.g. the row ids of a table of the image paths. Opening an index only reads its headers and maps its files
+    (numpy.memmap), so that any number of processes can open the same index at once, sharing its pages in the page
+    cache instead of each holding (or building) a copy in its heap.
+    The hashes are held in a read only base segment, with the bucket tables of multi-index hashing (see MIHIndex) for
+    radius searches that only read the buckets of the query and the hashes found, and in an append only delta segment
+    for the hashes added since, which is scanned. Deletions are appended to a tombstones file. compact merges the
+    delta segment and the deletions into a new base segment, and should be run offline, when the delta has grown
+    (a scan of 1M 64 bit hashes takes ~3 ms): only one process may add, delete or compact at a time,
+    the readers see the changes at their next search.
+    """
+    def __init__(self, path: str, bits: int = None):
+        """
+        Params:
+            path       - directory of the index, created if it does not exist
+            bits       - (integer) number of bits of the hashes of a new index, defaults to 64. An existing index keeps
+                         the bits it was created with
+        """
+        self.path = path
+        self._manifest_file = os.path.join(path, 'index.json')
+        if not os.path.exists(self._manifest_file):
+            os.makedirs(path, exist_ok=True)
+            bits = 64 if bits is None else bits
+            if bits < 1:
+                raise ValueError('bits: {} must be an integer >= 1'.format(bits))
+            self._write_generation(0, bits, -(-bits // 64), [], next_id=0)
+        self._manifest_stat = None
+        self._sync()
+        if bits is not None and bits != self.bits:
+            raise ValueError('the hashes of the index {} are {} bits, not {}'.format(path, self.bits, bits))
+
+    def _file(self, kind: str, generation: int = None) -> str:
+        extension = {'base': 'iwx', 'delta': 'iwd', 'tombstones': 'i64'}[kind]
+        generation = self._generation if generation is None else generation
+        return os.path.join(self.path, '{}-{:06d}.{}'.format(kind, generation, extension))
+
+    def _write_generation(self, generation: int, bits: int, words: int, parts, substrings: int = 0, next_id: int = 0):
+        """ write the segments of a generation and make it the current one, atomically """
+        write_segment(self._file('base', generation), bits, words, parts, substrings)
+        for kind in ('delta', 'tombstones'):
+            open(self._file(kind, generation), 'wb').close()
+        manifest_file = self._manifest_file + '.tmp'
+        with open(manifest_file, 'w') as manifest:
+            json.dump({'version': INDEX_FILE_VERSION, 'generation': generation, 'next_id': next_id}, manifest)
+        os.replace(manifest_file, self._manifest_file)
+
+    def _open_base(self):
+        header, self._hashes, self._ids, self._tables = read_segment(self._file('base'))
+        self.bits, self.words = header['bits'], header['words']
+        self._record = numpy.dtype([('id', '<i8'), ('hash', '<u8', (self.words, ))])
+        self._delta = numpy.zeros(0, dtype=self._record)
+        self._tombstone_ids = numpy.zeros(0, dtype=numpy.int64)
+        self._tombstone_positions = numpy.zeros(0, dtype=numpy.int64)
+        self._tombstones_size = 0
+
+    def _sync(self):
+        """ follow the changes of the index made by this or another process: compaction, additions, deletions """
+        stat = os.stat(self._manifest_file)
+        if (stat.st_ino, stat.st_mtime_ns, stat.st_size) != self._manifest_stat:
+            with open(self._manifest_file) as manifest:
+                manifest = json.load(manifest)
+            self._generation = manifest['generation']
+            self._manifest_stat = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            self._open_base()
+            # the indexes written before next_id was recorded follow their largest id
+            self._next_id = manifest.get('next_id', int(self._ids.max()) + 1 if len(self._ids) else 0)
+
+        # an interrupted append may leave a partial record, which is ignored
+        delta_count = os.path.getsize(self._file('delta')) // self._record.itemsize
+        if delta_count != len(self._delta):
+            added = len(self._delta)
+            self._delta = numpy.memmap(self._file('delta'), dtype=self._record, mode='r', shape=(delta_count, ))
+            if delta_count > added:
+                self._next_id = max(self._next_id, int(self._delta['id'][added:].max()) + 1)
+        tombstones_size = os.path.getsize(self._file('tombstones'))
+        if tombstones_size != self._tombstones_size:
+            tombstones = numpy.fromfile(self._file('tombstones'), dtype=TOMBSTONE,
+                                        count=tombstones_size // TOMBSTONE.itemsize)
+            # the last deletion of every id, by id
+            order = numpy.lexsort((tombstones['position'], tombstones['id']))
+            tombstones = tombstones[order]
+            last = numpy.append(tombstones['id'][1:] != tombstones['id'][:-1], True)
+            self._tombstone_ids = tombstones['id'][last].astype(numpy.int64)
+            self._tombstone_positions = tombstones['position'][last].astype(numpy.int64)
+            self._tombstones_size = tombstones_size
+
+    def _deleted(self, ids: numpy.ndarray, positions) -> numpy.ndarray:
+        """
+        mask of the deleted hashes among ids: a hash of the base segment (position -1) is deleted by any deletion
+        of its id, a hash of the delta segment (position of its record) by the deletions of its id made after it
+        """
+        if not len(self._tombstone_ids) or not len(ids):
+            return numpy.zeros(len(ids), dtype=bool)
+        index = numpy.minimum(numpy.searchsorted(self._tombstone_ids, ids), len(self._tombstone_ids) - 1)
+        return (self._tombstone_ids[index] == ids) & (self._tombstone_positions[index] > positions)
+
+    def __len__(self):
+        """ number of hashes in the index, not counting the deleted ones """
+        self._sync()
+        base_deleted = numpy.count_nonzero(self._deleted(self._ids, -1))
+        delta_deleted = numpy.count_nonzero(self._deleted(self._delta['id'], numpy.arange(len(self._delta))))
+        return len(self._ids) - base_deleted + len(self._delta) - delta_deleted
+
+    def add(self, image_hashes, ids=None):
+        """
+        Append hashes to the delta segment
+        Params:
+            image_hashes - list of hashes, or a numpy.array of uint64 words / uint8 packed hashes (see bit_ops.to_words)
+            ids        - list or array of the (integer) ids of the hashes, defaults to consecutive ids following the
+                         largest id ever added, deleted or not
+        """
+        self._sync()
+        words = bit_ops.to_words(image_hashes, self.words)
+        if ids is None:
+            ids = numpy.arange(self._next_id, self._next_id + len(words))
+        ids = numpy.asarray(ids, dtype=numpy.int64)
+        if ids.shape != (len(words), ):
+            raise ValueError('ids must have one id per hash')
+        if len(ids):
+            self._next_id = max(self._next_id, int(ids.max()) + 1)
+        records = numpy.empty(len(words), dtype=self._record)
+        records['id'], records['hash'] = ids, words
+        with open(self._file('delta'), 'ab') as delta:
+            # drop the partial record an interrupted append may have left
+            delta.truncate(len(self._delta) * self._record.itemsize)
+            records.tofile(delta)
+
+    def delete(self, ids):
+        """
+        Delete the hashes of the given ids (added before the deletion) from the index
+        Params:
+            ids        - list or array of (integer) ids
+        """
+        self._sync()
+        tombstones = numpy.empty(len(ids), dtype=TOMBSTONE)
+        tombstones['id'], tombstones['position'] = numpy.asarray(ids, dtype=numpy.int64), len(self._delta)
+        with open(self._file('tombstones'), 'ab') as tombstones_file:
+            tombstones.tofile(tombstones_file)
+
+    def _query_words(self, image_hash) -> numpy.ndarray:
+        return bit_ops.to_words([image_hash], self.words)
+
+    def query(self, image_hash, radius: int = 10, indexed: bool = True) -> list:
+        """
+        Params:
+            image_hash - <ImageHash>, <PackedImageHash>, hex string or integer
+            radius     - (integer) maximum hamming distance of the returned hashes
+            indexed    - (bool) look the hashes of the base segment up in its bucket tables, if it has any and
+                         they cost less than a scan at that radius, rather than scanning them
+        Returns:
+            list of (id, distance) of the hashes within radius of image_hash, closest first
+        """
+        self._sync()
+        query_words = self._query_words(image_hash)
+        count = len(self._ids)
+        if indexed and self._tables and mih.lookup_cost(self._tables, radius, count) < count:
+            candidates = mih.lookup_candidates(self._tables, query_words, radius)
+            distances = bit_ops.row_popcount(self._hashes[candidates] ^ query_words)
+            matches = numpy.flatnonzero(distances <= radius)
+            _, first = numpy.unique(candidates[matches], return_index=True)
+            rows, distances = candidates[matches[first]], distances[matches[first]].astype(numpy.int32)
+        else:
+            rows, distances = _scan(self._hashes, query_words, radius)
+        ids = self._ids[rows]
+        live = ~self._deleted(ids, -1)
+
+        delta_rows, delta_distances = _scan(self._delta['hash'], query_words, radius)
+        delta_ids = self._delta['id'][delta_rows]
+        delta_live = ~self._deleted(delta_ids, delta_rows)
+
+        ids = numpy.concatenate((ids[live], delta_ids[delta_live]))
+        distances = numpy.concatenate((distances[live], delta_distances[delta_live]))
+        order = numpy.argsort(distances, kind='stable')
+        return list(zip(ids[order].tolist(), distances[order].tolist()))
+
+    def nearest(self, image_hash, k: int = 1) -> list:
+        """
+        Params:
+            image_hash - <ImageHash>, <PackedImageHash>, hex string or integer
+            k          - (integer) number of hashes to return
+        Returns:
+            list of the (id, distance) of the k hashes closest to image_hash, closest first, by a scan of the index
+        """
+        self._sync()
+        if k < 1:
+            return []
+        query_words = self._query_words(image_hash)
+        chunk_size = max(bit_ops.CHUNK_SIZE // self.words, 1)
+        best_ids, best_distances = [numpy.zeros(0, dtype=numpy.int64)], [numpy.zeros(0, dtype=numpy.int32)]
+        for words, ids, delta in ((self._hashes, self._ids, False), (self._delta['hash'], self._delta['id'], True)):
+            for start in range(0, len(ids), chunk_size):
+                chunk_ids = numpy.asarray(ids[start:start + chunk_size])
+                positions = numpy.arange(start, start + len(chunk_ids)) if delta else -1
+                distances = bit_ops.row_popcount(words[start:start + chunk_size] ^ query_words).astype(numpy.int32)
+                rows = numpy.flatnonzero(~self._deleted(chunk_ids, positions))
+                if len(rows) > k:
+                    rows = numpy.sort(rows[numpy.argpartition(distances[rows], k - 1)[:k]])
+                best_ids.append(chunk_ids[rows])
+                best_distances.append(distances[rows])
+        ids, distances = numpy.concatenate(best_ids), numpy.concatenate(best_distances)
+        order = numpy.argsort(distances, kind='stable')[:k]
+        return list(zip(ids[order].tolist(), distances[order].tolist()))
+
+    def compact(self, substrings: int = None, tables: bool = True):
+        """
+        Merge the delta segment into a new base segment, without the deleted hashes, and build its bucket tables.
+        The previous segments are removed, the processes which mapped them keep reading them until their next search
+        Params:
+            substrings - (integer) number of substrings of the bucket tables, by default tuned from the number of
+                         hashes (see mih.auto_substrings). Substrings are at most mih.MAX_OFFSETS_BITS bits
+            tables     - (bool) build the bucket tables, without them the base segment is scanned
+        """
+        self._sync()
+        if substrings is not None and substrings < 1:
+            raise ValueError('substrings: {} must be an integer >= 1'.format(substrings))
+        count = len(self)
+        if tables and count:
+            substrings = substrings or mih.auto_substrings(self.bits, count)
+            substrings = min(max(substrings, -(-self.bits // mih.MAX_OFFSETS_BITS)), self.bits)
+        else:
+            substrings = 0
+        parts = [
+            (self._hashes, self._ids, ~self._deleted(self._ids, -1)),
+            (self._delta['hash'], self._delta['id'], ~self._deleted(self._delta['id'], numpy.arange(len(self._delta)))),
+        ]
+        previous = [self._file(kind) for kind in ('base', 'delta', 'tombstones')]
+        self._write_generation(self._generation + 1, self.bits, self.words, parts, substrings, self._next_id)
+        self._sync()
+        for file_name in previous:
+            try:
+                os.remove(file_name)
+            except OSError:
+                # e.g. a file still mapped by another process on Windows
+                pass
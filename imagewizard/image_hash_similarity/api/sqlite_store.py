@@ -0,0 +1,254 @@
+""" Store of image hashes in a single SQLite file, searched with SQL functions and pre-filtered by substring buckets """
+import sqlite3
+import sys
+import numpy
+from imagewizard.image_hash_similarity.api import bit_ops, mih
+from imagewizard.image_hashing.api.hash_cache import SQLiteConnection
+
+# radius searches looking up more bucket values than this scan the hashes instead
+MAX_QUERY_KEYS = 1 << 16
+# batches of at least this many hashes, and at least as many as the hashes stored, are inserted without the bucket
+# indexes, which are then created again: much faster than updating them row by row
+BULK_INDEX_ROWS = 1 << 17
+# page cache of a connection, in KiB
+CACHE_SIZE = 1 << 16
+# SQLite integers are signed 64 bit integers, the words and buckets are stored in two's complement
+_WORD_MASK = (1 << 64) - 1
+# SQL functions flagged deterministic (python >= 3.8) are evaluated once per statement for constant arguments
+_FUNCTION_FLAGS = {'deterministic': True} if sys.version_info >= (3, 8) else {}
+
+
+def sql_popcount(value):
+    """ popcount(x) SQL function: number of set bits of a (64 bit) integer """
+    return None if value is None else bit_ops.int_popcount(value & _WORD_MASK)
+
+
+def sql_hamming(*words):
+    """
+    hamming(a0, ..., aW-1, b0, ..., bW-1) SQL function: hamming distance of the hashes a and b of W 64 bit words each
+    """
+    half = len(words) // 2
+    return sum(bit_ops.int_popcount((word_a ^ word_b) & _WORD_MASK) for word_a, word_b in zip(words[:half], words[half:]))
+
+
+def default_substrings(bits: int) -> int:
+    """ number of bucket substrings of hashes of the given number of bits: substrings of 16 bits, at least 4 """
+    return min(max(4, -(-bits // 16)), bits)
+
+
+def _signed(values: numpy.ndarray) -> list:
+    """ SQLite integers of an array of uint64 """
+    return numpy.ascontiguousarray(values, dtype=numpy.uint64).view(numpy.int64).tolist()
+
+
+class SQLiteHashStore(SQLiteConnection):
+    """
+    Hashes of images (ImageHash, PackedImageHash, hex strings or integers) keyed by an integer image id, stored in a
+    single transactional SQLite file with the same interface as the in-memory indexes (see MIHIndex): build, add,
+    query and nearest, returning (id, distance) tuples.
+    A row holds the image id, the algorithm, the hash_size, the hash as 64 bit integer columns (h0, h1...) and one
+    indexed bucket column per substring of the hash (b0, b1...), see MIHIndex. A radius query only computes the
+    distance (with the registered hamming SQL function) of the rows sharing a bucket value within the pigeonhole
+    radius of the query's, and scans the rows of the algorithm and hash_size when the radius is too large for that.
+    A file holds the hashes of any algorithms and hash sizes, a store reads and writes those of its algorithm and
+    hash_size. It is opened in WAL mode, so it can be shared by concurrent readers and writers of multiple processes.
+    The number of words and of bucket columns of a file are set by the store creating it: create it with the
+    largest hash_size it will hold.
+    """
+    def __init__(self,
+                 path: str,
+                 algorithm: str = 'phash',
+                 hash_size: int = 8,
+                 substrings: int = None,
+                 timeout: float = 30.0):
+        """
+        Params:
+            path       - file name of the store, created if it does not exist
+            algorithm  - (string) name of the hashing algorithm of the hashes, e.g. 'phash'
+            hash_size  - (integer) hash_size of the hashes, of hash_size * hash_size bits
+            substrings - (integer) number of bucket substrings of the hashes, defaults to substrings of 16 bits (at
+                         least 4), which suit up to a few million hashes per algorithm and hash_size. A new file gets
+                         as many bucket columns, an existing one caps it. The substrings of an algorithm and
+                         hash_size are recorded in the file by the first store opening it, the later ones must
+                         request the same number or none
+            timeout    - (float) seconds to wait for a lock held by another process
+        """
+        if hash_size < 1:
+            raise ValueError('hash_size: {} must be an integer >= 1'.format(hash_size))
+        if substrings is not None and substrings < 1:
+            raise ValueError('substrings: {} must be an integer >= 1'.format(substrings))
+        self.path = path
+        self.algorithm = algorithm
+        self.hash_size = hash_size
+        self.bits = hash_size * hash_size
+        self.substrings = substrings
+        self.timeout = timeout
+        self.words = None
+        self._connect()
+
+    def _setup_connection(self, connection: sqlite3.Connection):
+        """ create the tables of a new file, and read the layout of the hashes of the store """
+        connection.execute('PRAGMA cache_size=-{}'.format(CACHE_SIZE))
+        connection.create_function('popcount', 1, sql_popcount, **_FUNCTION_FLAGS)
+        connection.create_function('hamming', -1, sql_hamming, **_FUNCTION_FLAGS)
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute('CREATE TABLE IF NOT EXISTS store (name TEXT PRIMARY KEY, value INTEGER)')
+            layout = dict(connection.execute('SELECT name, value FROM store').fetchall())
+            if not layout:
+                layout = {
+                    'words': -(-self.bits // 64),
+                    'substrings': self.substrings or default_substrings(self.bits)
+                }
+                connection.executemany('INSERT INTO store VALUES (?, ?)', layout.items())
+                words = ', '.join('h{} INTEGER'.format(word) for word in range(layout['words']))
+                buckets = ', '.join('b{} INTEGER'.format(bucket) for bucket in range(layout['substrings']))
+                connection.execute('CREATE TABLE hashes (id INTEGER, algorithm TEXT, hash_size INTEGER, {}, {}, '
+                                   'UNIQUE (algorithm, hash_size, id))'.format(words, buckets))
+                self._create_indexes(connection, layout['substrings'])
+            error = None
+            # the bucket substrings of the rows of an algorithm and hash_size are set by the first store opening them
+            name = 'substrings {} {}'.format(self.algorithm, self.hash_size)
+            substrings = min(self.substrings or default_substrings(self.bits), layout['substrings'], self.bits)
+            if self.bits > layout['words'] * 64:
+                error = 'hashes of {} bits do not fit in the {} words of the store {}'.format(
+                    self.bits, layout['words'], self.path)
+            elif name not in layout:
+                connection.execute('INSERT INTO store VALUES (?, ?)', (name, substrings))
+            elif self.substrings is not None and substrings != layout[name]:
+                error = 'the {} hashes of hash_size {} of the store {} have {} substrings, not {}'.format(
+                    self.algorithm, self.hash_size, self.path, layout[name], substrings)
+            else:
+                substrings = layout[name]
+        if error:
+            raise ValueError(error)
+        connection.execute('CREATE TEMP TABLE IF NOT EXISTS query_keys (bucket INTEGER, value INTEGER)')
+        self.words = layout['words']
+        self.substrings = substrings
+        self._buckets = layout['substrings']
+        # (start bit, number of bits) of the bucket substrings
+        self._layout = mih.table_layout(self.bits, self.words, self.substrings)
+
+    @staticmethod
+    def _create_indexes(connection: sqlite3.Connection, buckets: int):
+        for bucket in range(buckets):
+            connection.execute('CREATE INDEX IF NOT EXISTS hashes_b{0} ON hashes (algorithm, hash_size, b{0})'.format(
+                bucket))
+
+    def _rows(self, keys, words: numpy.ndarray):
+        """ the table rows of hashes, as tuples. The bucket columns beyond the substrings of the store are NULL """
+        buckets = numpy.stack([mih.substring(words, start, length) for start, length in self._layout], axis=1)
+        unused = (None, ) * (self._buckets - len(self._layout))
+        for key, row_words, row_buckets in zip(keys, _signed(words), _signed(buckets)):
+            yield (int(key), self.algorithm, self.hash_size) + tuple(row_words) + tuple(row_buckets) + unused
+
+    def build(self, image_hashes, keys: list = None):
+        """
+        Add many hashes in a single transaction. The hash of an id already in the store is replaced
+        Params:
+            image_hashes - list of hashes, or a numpy.array of uint64 words / uint8 packed hashes (see bit_ops.to_words)
+            keys       - list of the (integer) image ids of the hashes, defaults to their index in image_hashes
+        """
+        words = bit_ops.to_words(image_hashes, self.words)
+        keys = range(len(words)) if keys is None else keys
+        if len(keys) != len(words):
+            raise ValueError('keys must have one key per hash')
+        connection = self._connect()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            stored = connection.execute('SELECT COUNT(*) FROM hashes').fetchone()[0]
+            reindex = len(words) >= max(BULK_INDEX_ROWS, stored)
+            if reindex:
+                for bucket in range(self._buckets):
+                    connection.execute('DROP INDEX IF EXISTS hashes_b{}'.format(bucket))
+            connection.executemany('INSERT OR REPLACE INTO hashes VALUES ({})'.format(
+                ', '.join('?' * (3 + self.words + self._buckets))), self._rows(keys, words))
+            if reindex:
+                self._create_indexes(connection, self._buckets)
+
+    def add(self, key, image_hash):
+        """
+        Params:
+            key        - (integer) image id of the hash
+            image_hash - <ImageHash>, <PackedImageHash>, hex string or integer
+        """
+        self.build([image_hash], [key])
+
+    def delete(self, keys: list):
+        """ remove the hashes of the given image ids """
+        connection = self._connect()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.executemany('DELETE FROM hashes WHERE algorithm = ? AND hash_size = ? AND id = ?',
+                                   [(self.algorithm, self.hash_size, int(key)) for key in keys])
+
+    def __len__(self):
+        """ number of hashes of the algorithm and hash_size of the store """
+        return self._connect().execute('SELECT COUNT(*) FROM hashes WHERE algorithm = ? AND hash_size = ?',
+                                       (self.algorithm, self.hash_size)).fetchone()[0]
+
+    def _query_params(self, image_hash) -> dict:
+        """ the named parameters of the queries: the words q0, q1... of the hash, algorithm and hash_size """
+        query_words = bit_ops.to_words([image_hash], self.words)
+        params = {'q{}'.format(word): value for word, value in enumerate(_signed(query_words[0]))}
+        params.update({'algorithm': self.algorithm, 'hash_size': self.hash_size, 'words': query_words})
+        return params
+
+    def _distance_sql(self) -> str:
+        words = range(self.words)
+        return 'hamming({}, {})'.format(', '.join('h{}'.format(word) for word in words),
+                                        ', '.join(':q{}'.format(word) for word in words))
+
+    def query(self, image_hash, radius: int = 10) -> list:
+        """
+        Params:
+            image_hash - <ImageHash>, <PackedImageHash>, hex string or integer
+            radius     - (integer) maximum hamming distance of the returned hashes
+        Returns:
+            list of (id, distance) of the stored hashes within radius of image_hash, closest first
+        """
+        params = self._query_params(image_hash)
+        query_words = params.pop('words')
+        params['radius'] = radius
+        radii = mih.table_radii(len(self._layout), radius)
+        keys = [
+            (bucket, mih.substring(query_words, start, length)[0] ^ mih.neighbourhood(length, table_radius))
+            for bucket, ((start, length), table_radius) in enumerate(zip(self._layout, radii)) if table_radius >= 0
+        ]
+        connection = self._connect()
+        if sum(len(values) for _, values in keys) > MAX_QUERY_KEYS:
+            # the lookups would cost more than a scan of the hashes
+            return connection.execute(
+                'SELECT id, {} AS distance FROM hashes WHERE algorithm = :algorithm AND hash_size = :hash_size '
+                'AND distance <= :radius ORDER BY distance, id'.format(self._distance_sql()), params).fetchall()
+
+        # the rows of every bucket value looked up, through the index of the bucket column
+        candidates = ' UNION '.join(
+            'SELECT hashes.rowid FROM query_keys JOIN hashes ON hashes.algorithm = :algorithm '
+            'AND hashes.hash_size = :hash_size AND hashes.b{0} = query_keys.value '
+            'WHERE query_keys.bucket = {0}'.format(bucket) for bucket, _ in keys)
+        with connection:
+            connection.execute('BEGIN')
+            connection.execute('DELETE FROM query_keys')
+            connection.executemany('INSERT INTO query_keys VALUES (?, ?)',
+                                   [(bucket, value) for bucket, values in keys for value in _signed(values)])
+            return connection.execute(
+                'SELECT id, {} AS distance FROM hashes WHERE rowid IN ({}) AND distance <= :radius '
+                'ORDER BY distance, id'.format(self._distance_sql(), candidates), params).fetchall()
+
+    def nearest(self, image_hash, k: int = 1) -> list:
+        """
+        Params:
+            image_hash - <ImageHash>, <PackedImageHash>, hex string or integer
+            k          - (integer) number of hashes to return
+        Returns:
+            list of the (id, distance) of the k stored hashes closest to image_hash, closest first
+        """
+        if k < 1:
+            return []
+        params = self._query_params(image_hash)
+        params.pop('words')
+        params['k'] = k
+        return self._connect().execute(
+            'SELECT id, {} AS distance FROM hashes WHERE algorithm = :algorithm AND hash_size = :hash_size '
+            'ORDER BY distance, id LIMIT :k'.format(self._distance_sql()), params).fetchall()
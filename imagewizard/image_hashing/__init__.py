@@ -1,3 +1,6 @@
 from imagewizard.image_hashing.api.hashing import Hashing
+from imagewizard.image_hashing.api.hash_cache import HashCache
+from imagewizard.image_hashing.api.crop_resistant import CropResistantIndex
+from imagewizard.image_hashing.api.thumbnail_store import ThumbnailStore
 
-__all__ = ['Hashing']
+__all__ = ['Hashing', 'HashCache', 'CropResistantIndex', 'ThumbnailStore']
@@ -0,0 +1,107 @@
+""" Hashing of many images or image files at once, spread across a pool of worker processes """
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from imagewizard.helpers import helpers
+from imagewizard.image_hashing.api.hash_algorithms import HASH_ALGORITHMS, hash_input_size
+
+
+def get_algorithm(algorithm: str):
+    """ return the hashing function for the algorithm name """
+    try:
+        return HASH_ALGORITHMS[algorithm.lower()]
+    except (KeyError, AttributeError):
+        raise ValueError("Invalid value '{}' for argument 'algorithm', must be one of {}".format(
+            algorithm, sorted(HASH_ALGORITHMS)))
+
+
+def load_image(item, order: str = 'rgb', target_size=None):
+    """
+    read the image file if item is a path (decode it if item is an encoded image) and prepare the image for hashing
+    files are read with opencv and hence always in BGR order, straight to grayscale.
+    target_size is the (width, height) the image is going to be downscaled to, or a function returning it given the
+    size of the image (see hash_input_size): JPEG files are then decoded at a reduced resolution, see helpers.imread_scaled
+    """
+    if helpers.is_buffer(item):
+        return helpers.decode_buffer(item, target_size, grayscale=True)
+    if helpers.is_path(item):
+        file_name = helpers.fspath(item)
+        image = helpers.imread_scaled(file_name, target_size, grayscale=True)
+        if image is None:
+            raise ValueError('unable to read image file {}'.format(file_name))
+        return image
+    return helpers.format_image_for_hashing(item, order)
+
+
+def hash_item(item, algorithm: str = 'phash', order: str = 'rgb', **params):
+    """ read (if required) and hash a single image, exceptions are raised """
+    function = get_algorithm(algorithm)
+    target_size = functools.partial(hash_input_size, algorithm.lower(), **params)
+    return function(load_image(item, order, target_size), **params)
+
+
+def _hash_task(task):
+    """
+    worker entry point, task is a tuple of (item, algorithm, order, params)
+    any exception is returned as the result so a bad item never stops the batch
+    """
+    item, algorithm, order, params = task
+    try:
+        return hash_item(item, algorithm, order, **params)
+    except Exception as inst:
+        return inst
+
+
+def hash_many(images_or_paths,
+              algorithm: str = 'phash',
+              workers: int = None,
+              chunksize: int = 8,
+              order: str = 'rgb',
+              cache=None,
+              **params) -> list:
+    """
+    Hash many images in parallel, see Hashing.hash_many
+    cache is an optional HashCache, consulted for (and updated with) the items that are file paths
+    """
+    # validate the algorithm upfront rather than once per item in the workers
+    get_algorithm(algorithm)
+    if chunksize < 1:
+        raise ValueError('chunksize: {} must be an integer >= 1'.format(chunksize))
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    items = list(images_or_paths)
+    results = [None] * len(items)
+    if cache is not None:
+        paths = [(index, item) for index, item in enumerate(items) if helpers.is_path(item)]
+        cached = cache.get_many([helpers.fspath(item) for _, item in paths], algorithm, params)
+        for (index, _), image_hash in zip(paths, cached):
+            results[index] = image_hash
+    pending = [index for index, result in enumerate(results) if result is None]
+    stamps = {}
+    if cache is not None:
+        # the files are stamped before they are read, a file changed while it is hashed is then not cached as valid
+        for index in pending:
+            if helpers.is_path(items[index]):
+                try:
+                    stamps[index] = cache.stamp(helpers.fspath(items[index]))
+                except OSError:
+                    pass
+
+    tasks = ((items[index], algorithm, order, params) for index in pending)
+    if workers <= 1:
+        hashes = [_hash_task(task) for task in tasks]
+    else:
+        # Executor.map keeps the results in input order
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            hashes = list(executor.map(_hash_task, tasks, chunksize=chunksize))
+
+    for index, image_hash in zip(pending, hashes):
+        results[index] = image_hash
+    if cache is not None:
+        computed = [(helpers.fspath(items[index]), results[index], stamps[index]) for index in pending
+                    if index in stamps and not isinstance(results[index], Exception)]
+        if computed:
+            file_names, image_hashes, file_stamps = zip(*computed)
+            cache.put_many(file_names, image_hashes, algorithm, params, file_stamps)
+    return results
@@ -0,0 +1,216 @@
+""" Crop resistant hashing: hashes of overlapping regions of an image, and an index to match them """
+import numpy
+from imagewizard.image_hash_similarity.api import bit_ops, mih
+from imagewizard.image_hashing.api.hash_algorithms import HASH_ALGORITHMS, PackedImageHash, image_size, reduce_image
+
+# default shorter side (pixels) of the downscale the regions are hashed from
+BASE_SIZE = 128
+
+
+def region_boxes(scales=(1, 0.9, 0.8, 0.7, 0.6), stride: float = 0.1) -> list:
+    """
+    Regions of an image as fractional boxes (left, top, right, bottom) in [0, 1].
+    For every scale s, windows of s times the image's width and height slide over the image in steps of stride,
+    so a crop of up to 1 - min(scales) of the image is covered by a region of about the same content.
+    Default: the whole image and 54 windows of 90% down to 60% of it.
+    """
+    boxes = []
+    for scale in scales:
+        if not 0 < scale <= 1:
+            raise ValueError('scales must be in the range (0, 1]')
+        steps = int(round((1 - scale) / stride)) + 1 if scale < 1 else 1
+        for row in range(steps):
+            for col in range(steps):
+                left, top = min(col * stride, 1 - scale), min(row * stride, 1 - scale)
+                boxes.append((left, top, left + scale, top + scale))
+    return boxes
+
+
+class MultiHash(object):
+    """
+    Hashes of the regions of an image, see crop_resistant_hash.
+    str() gives the comma separated hex hashes of the regions, MultiHash.from_string reverses it.
+    """
+    def __init__(self, region_hashes: list, boxes: list = None):
+        """
+        Params:
+            region_hashes - list of <ImageHash> or <PackedImageHash> objects, one per region
+            boxes      - fractional boxes of the regions, see region_boxes
+        """
+        self.region_hashes = [
+            image_hash if isinstance(image_hash, PackedImageHash) else image_hash.pack()
+            for image_hash in region_hashes
+        ]
+        self.boxes = boxes
+
+    @classmethod
+    def from_string(cls, value: str, shape=None):
+        """ create from a stored str(MultiHash), see PackedImageHash.from_hex for shape """
+        return cls([PackedImageHash.from_hex(hexstr, shape) for hexstr in value.split(',')])
+
+    def __str__(self):
+        return ','.join(str(image_hash) for image_hash in self.region_hashes)
+
+    def __repr__(self):
+        return 'MultiHash({!r})'.format(str(self))
+
+    def __len__(self):
+        return len(self.region_hashes)
+
+    def matches(self, other, max_distance: int = 8) -> int:
+        """ number of regions of this hash within max_distance bits of some region of the other hash """
+        return sum(
+            1 for image_hash in self.region_hashes
+            if any(image_hash - other_hash <= max_distance for other_hash in other.region_hashes))
+
+
+def crop_resistant_hash(image,
+                        hash_size=8,
+                        scales=(1, 0.9, 0.8, 0.7, 0.6),
+                        stride: float = 0.1,
+                        hash_func: str = 'ahash',
+                        base_size: int = BASE_SIZE) -> MultiHash:
+    """
+    Crop resistant hash: the hashes of overlapping regions of the image at several scales.
+    The image is converted to grayscale and downscaled once, every region is hashed from that downscale.
+    Params:
+        image      - must be a PIL instance image or a grayscale numpy array
+        hash_size  - an integer specifying the hash size of the regions
+        scales, stride - regions to hash, see region_boxes
+        hash_func  - (string) hashing algorithm of the regions: 'ahash', 'dhash', 'phash'... ahash, which only keeps
+                     the lowest frequencies, is the most tolerant of regions that are slightly misaligned
+        base_size  - (integer) the shorter side of the shared downscale, in pixels
+    Returns:
+        <MultiHash> object
+    """
+    function = HASH_ALGORITHMS[hash_func]
+    width, height = image_size(image)
+    ratio = base_size / min(width, height)
+    # never upscale
+    if ratio < 1:
+        width, height = max(int(round(width * ratio)), 1), max(int(round(height * ratio)), 1)
+    pixels = reduce_image(image, (width, height))
+
+    boxes = region_boxes(scales, stride)
+    region_hashes = []
+    for left, top, right, bottom in boxes:
+        region = pixels[int(round(top * height)):int(round(bottom * height)),
+                        int(round(left * width)):int(round(right * width))]
+        region_hashes.append(function(numpy.ascontiguousarray(region), hash_size))
+    return MultiHash(region_hashes, boxes)
+
+
+class CropResistantIndex(bit_ops.PendingWords):
+    """
+    Index of the region hashes of many images, to find the images sharing regions with a query image.
+    The region hashes are held in a numpy array of words indexed by the bucket tables of multi-index hashing
+    (see MIHIndex): every hash is split into a few substrings of about log2(regions) bits, and a query region only
+    computes the distance of the regions found in the buckets within the pigeonhole radius of its substrings, instead
+    of every region of every image. The regions added since the tables were built are scanned, the tables are built
+    again once there are as many of them as indexed regions, so that adding regions costs O(log N) amortized.
+    """
+    def __init__(self, max_distance: int = 8):
+        """
+        Params:
+            max_distance - (integer) maximum hamming distance of two matching regions
+        """
+        if max_distance < 0:
+            raise ValueError('max_distance: {} must be an integer >= 0'.format(max_distance))
+        self.max_distance = max_distance
+        self._bits = None
+        # words of the region hashes, the first self._indexed of them are in the tables
+        self._words = None
+        self._init_pending()
+        self._tables = []
+        self._indexed = 0
+        # image id of every region, and the set of the image ids
+        self._region_images = []
+        self._image_ids = set()
+
+    def __len__(self):
+        """ number of indexed images """
+        return len(self._image_ids)
+
+    def add(self, image_id, multi_hash: MultiHash):
+        """ index the regions of an image """
+        if self._bits is None:
+            self._bits = multi_hash.region_hashes[0].size
+            self._words = numpy.zeros((0, -(-self._bits // 64)), dtype=numpy.uint64)
+        if any(image_hash.size != self._bits for image_hash in multi_hash.region_hashes):
+            raise TypeError('region hashes must all have {} bits'.format(self._bits))
+        rebuild = self._add_pending(bit_ops.to_words(multi_hash.region_hashes, self._words.shape[1]))
+        self._region_images.extend([image_id] * len(multi_hash))
+        self._image_ids.add(image_id)
+        if rebuild:
+            self._build_tables()
+
+    def _pending_limit(self) -> int:
+        """ the tables are built again once there are as many pending regions as indexed ones """
+        return max(self._indexed, bit_ops.MAX_PENDING)
+
+    def _build_tables(self):
+        self._flush_pending()
+        count, words = self._words.shape
+        substrings = max(mih.auto_substrings(self._bits, count), -(-self._bits // 64))
+        self._tables = [
+            mih.build_table(self._words, start, length)
+            for start, length in mih.table_layout(self._bits, words, substrings)
+        ]
+        self._indexed = count
+
+    def _matches(self, query_words: numpy.ndarray) -> tuple:
+        """ (query regions, regions, distances) of the pairs of regions within max_distance, possibly repeated """
+        query_regions, regions, distances = [], [], []
+        if self._tables and mih.lookup_cost(self._tables, self.max_distance, self._indexed) < self._indexed:
+            for query_region in range(len(query_words)):
+                row = query_words[query_region:query_region + 1]
+                candidates = mih.lookup_candidates(self._tables, row, self.max_distance)
+                candidate_distances = bit_ops.row_popcount(self._words[candidates] ^ row)
+                matches = candidate_distances <= self.max_distance
+                query_regions.append(numpy.full(numpy.count_nonzero(matches), query_region))
+                regions.append(candidates[matches])
+                distances.append(candidate_distances[matches])
+        elif self._indexed:
+            pair_distances = bit_ops.many_to_many(query_words, self._words)
+            query_regions_found, regions_found = numpy.nonzero(pair_distances <= self.max_distance)
+            query_regions.append(query_regions_found)
+            regions.append(regions_found)
+            distances.append(pair_distances[query_regions_found, regions_found])
+        if self._pending_words:
+            # the regions added since the tables were built are all candidates
+            pair_distances = bit_ops.many_to_many(query_words, numpy.concatenate(self._pending_words))
+            query_regions_found, regions_found = numpy.nonzero(pair_distances <= self.max_distance)
+            query_regions.append(query_regions_found)
+            regions.append(regions_found + self._indexed)
+            distances.append(pair_distances[query_regions_found, regions_found])
+        if not regions:
+            return (numpy.zeros(0, dtype=numpy.int64), ) * 3
+        return tuple(numpy.concatenate(found).astype(numpy.int64) for found in (query_regions, regions, distances))
+
+    def query(self, multi_hash: MultiHash, min_regions: int = 1) -> list:
+        """
+        Params:
+            multi_hash - <MultiHash> of the query image
+            min_regions- (integer) minimum number of regions of the query that must match an image
+        Returns:
+            list of (image_id, matched_regions, distance) sorted by most matched regions first, then by smallest distance.
+            matched_regions is the number of query regions matching a region of the image and
+            distance the sum of their (smallest) hamming distances
+        """
+        if self._bits is None:
+            return []
+        if any(image_hash.size != self._bits for image_hash in multi_hash.region_hashes):
+            raise TypeError('region hashes must all have {} bits'.format(self._bits))
+        query_words = bit_ops.to_words(multi_hash.region_hashes, self._words.shape[1])
+        best = {}
+        for query_region, region, distance in zip(*(found.tolist() for found in self._matches(query_words))):
+            key = (self._region_images[region], query_region)
+            best[key] = min(distance, best.get(key, distance))
+
+        scores = {}
+        for (image_id, _), distance in best.items():
+            matched, total = scores.get(image_id, (0, 0))
+            scores[image_id] = (matched + 1, total + distance)
+        results = [(image_id, matched, total) for image_id, (matched, total) in scores.items()
+                   if matched >= min_regions]
+        return sorted(results, key=lambda result: (-result[1], result[2]))
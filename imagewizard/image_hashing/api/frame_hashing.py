@@ -0,0 +1,143 @@
+""" Fingerprinting of videos and multi-frame images (animated GIF, multi-page TIFF...) as sequences of frame hashes """
+import cv2 as cv
+import numpy
+from PIL import Image
+from imagewizard.image_hashing.api.batch_hashing import get_algorithm
+from imagewizard.image_hashing.api.hash_algorithms import PackedImageHash, dhash
+
+# videos sampled every this many frames or more seek to the next sample rather than grabbing every frame:
+# a seek decodes from the previous key frame, which costs less than decoding all the frames in between
+MIN_SEEK_FRAMES = 25
+
+
+class FrameSignature(object):
+    """
+    Sequence signature of a video: the packed hashes of its sampled frames and their timestamps (seconds).
+    str() gives 'timestamp:hex' items separated by ';', FrameSignature.from_string reverses it.
+    """
+    def __init__(self, timestamps: list, hashes: list):
+        """
+        Params:
+            timestamps - list of the timestamps of the frames, in seconds
+            hashes     - list of <ImageHash> or <PackedImageHash> objects, one per frame
+        """
+        self.timestamps = list(timestamps)
+        self.hashes = [
+            image_hash if isinstance(image_hash, PackedImageHash) else image_hash.pack()
+            for image_hash in hashes
+        ]
+
+    @classmethod
+    def from_string(cls, value: str, shape=None):
+        """ create from a stored str(FrameSignature), see PackedImageHash.from_hex for shape """
+        timestamps, hashes = [], []
+        for item in filter(None, value.split(';')):
+            timestamp, hexstr = item.split(':')
+            timestamps.append(float(timestamp))
+            hashes.append(PackedImageHash.from_hex(hexstr, shape))
+        return cls(timestamps, hashes)
+
+    def __str__(self):
+        return ';'.join('{:.3f}:{}'.format(timestamp, image_hash)
+                        for timestamp, image_hash in zip(self.timestamps, self.hashes))
+
+    def __repr__(self):
+        return 'FrameSignature({!r})'.format(str(self))
+
+    def __len__(self):
+        return len(self.hashes)
+
+
+def _iter_video_frames(file_name: str, interval: float):
+    """
+    yield (timestamp, BGR frame) every interval seconds of a video read with opencv.
+    Grabbing a frame still decodes it with most backends (FFmpeg): at MIN_SEEK_FRAMES frames or more between two
+    samples, the video seeks to the next sample instead, the frames in between are only grabbed, not retrieved and
+    converted, otherwise or when the video can not seek
+    """
+    capture = cv.VideoCapture(file_name)
+    if not capture.isOpened():
+        raise ValueError('unable to read video file {}'.format(file_name))
+    try:
+        fps = capture.get(cv.CAP_PROP_FPS) or 25.0
+        step = max(int(round(interval * fps)), 1)
+        seek = step >= MIN_SEEK_FRAMES
+        index = 0
+        while capture.grab():
+            if index % step == 0:
+                retrieved, frame = capture.retrieve()
+                if retrieved:
+                    yield index / fps, frame
+                if seek and capture.set(cv.CAP_PROP_POS_FRAMES, index + step):
+                    index += step
+                    continue
+                seek = False
+            index += 1
+    finally:
+        capture.release()
+
+
+def _iter_image_frames(image, interval: float):
+    """ yield (timestamp, grayscale frame) every interval seconds of a multi-frame PIL image """
+    timestamp, next_sample = 0.0, 0.0
+    for index in range(getattr(image, 'n_frames', 1)):
+        image.seek(index)
+        if timestamp >= next_sample:
+            yield timestamp, numpy.asarray(image.convert('L'))
+            next_sample = timestamp + interval
+        # frame duration in milliseconds, GIFs without one are commonly shown at 10 frames per second
+        timestamp += (image.info.get('duration') or 100) / 1000
+
+
+def iter_frames(file_name: str, interval: float = 1.0):
+    """
+    Sample the frames of a video (read with opencv) or of a multi-frame image (read with PIL: GIF, TIFF, WebP...)
+    Params:
+        file_name  - path of the video or image file
+        interval   - (float) seconds between two sampled frames, 0 for every frame
+    Yields:
+        (timestamp, frame) where timestamp is in seconds and frame is a BGR (video) or grayscale (image) numpy array
+    """
+    try:
+        image = Image.open(file_name)
+    except (IOError, SyntaxError):
+        # not an image PIL can read, try it as a video
+        image = None
+    if image is None:
+        yield from _iter_video_frames(file_name, interval)
+    else:
+        with image:
+            yield from _iter_image_frames(image, interval)
+
+
+def hash_frames(file_name: str,
+                interval: float = 1.0,
+                algorithm: str = 'phash',
+                min_change: int = 4,
+                hash_size: int = 8) -> FrameSignature:
+    """
+    Fingerprint a video or multi-frame image as the sequence of hashes of its sampled frames.
+    A sampled frame is skipped when its dhash is within min_change bits of the last kept frame,
+    so that static scenes are stored once.
+    Params:
+        file_name  - path of the video or image file
+        interval   - (float) seconds between two sampled frames, 0 for every frame
+        algorithm  - (string) hash of the kept frames, see HASH_ALGORITHMS
+        min_change - (integer) minimum dhash distance (bits) of a frame to the last kept frame to keep it, 0 keeps every frame
+        hash_size  - (integer) hash size of the frame hashes
+    Returns:
+        <FrameSignature> object
+    """
+    function = get_algorithm(algorithm)
+    algorithm = algorithm.lower()
+    timestamps, hashes, last_change_hash = [], [], None
+    for timestamp, frame in iter_frames(file_name, interval):
+        if frame.ndim == 3:
+            frame = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+        change_hash = dhash(frame)
+        if last_change_hash is not None and change_hash - last_change_hash < min_change:
+            continue
+        last_change_hash = change_hash
+        timestamps.append(timestamp)
+        hashes.append(change_hash if algorithm == 'dhash' and hash_size == 8 else function(frame, hash_size))
+    return FrameSignature(timestamps, hashes)
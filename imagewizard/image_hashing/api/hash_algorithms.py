@@ -1,16 +1,29 @@
+import functools
+import operator
 import numpy
 from PIL import Image
+import cv2 as cv
 import scipy.fftpack
 import pywt
 """ Perceptual hashing algorithms in python borrowed from https://github.com/JohannesBuchner/imagehash """
 
+# Every hashing function accepts either a PIL image or a grayscale (2 dimensional) numpy array.
+# Both are resized with PIL's ANTIALIAS (LANCZOS) filter, a numpy array as a single channel image, and color numpy
+# arrays are converted to grayscale by PIL (see helpers.format_image_to_gray_array), so that an array and the PIL
+# image of the same pixels have exactly the same hashes.
+
 def _binary_array_to_hex(arr):
     """
 	internal function to make a hex string out of a binary array.
 	"""
-    bit_string = ''.join(str(b) for b in 1 * arr.flatten())
-    width = int(numpy.ceil(len(bit_string) / 4))
-    return '{:0>{width}x}'.format(int(bit_string, 2), width=width)
+    flat = numpy.asarray(arr, dtype=bool).ravel()
+    # pad on the left to whole bytes, the padding only adds leading zero digits which are cut
+    padding = -flat.size % 8
+    if padding:
+        flat = numpy.concatenate((numpy.zeros(padding, dtype=bool), flat))
+    width = (flat.size - padding + 3) // 4
+    hexstr = numpy.packbits(flat).tobytes().hex()
+    return hexstr[len(hexstr) - width:]
 
 
 class ImageHash(object):
@@ -29,6 +42,8 @@ class ImageHash(object):
     def __sub__(self, other):
         if other is None:
             raise TypeError('Other hash must not be None.')
+        if isinstance(other, PackedImageHash):
+            return other - self
         if self.hash.size != other.hash.size:
             raise TypeError('ImageHashes must be of the same shape.',
                             self.hash.shape, other.hash.shape)
@@ -37,17 +52,185 @@ class ImageHash(object):
     def __eq__(self, other):
         if other is None:
             return False
+        if isinstance(other, PackedImageHash):
+            return other == self
+        if not isinstance(other, ImageHash):
+            return NotImplemented
         return numpy.array_equal(self.hash.flatten(), other.hash.flatten())
 
     def __ne__(self, other):
         if other is None:
             return False
-        return not numpy.array_equal(self.hash.flatten(), other.hash.flatten())
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
 
     def __hash__(self):
-        # this returns a 8 bit integer, intentionally shortening the information
-        return sum(
-            [2**(i % 8) for i, v in enumerate(self.hash.flatten()) if v])
+        # the hash of the packed integer, so that an ImageHash and the equal PackedImageHash are the same dict key
+        return hash(self.pack().value)
+
+    def pack(self):
+        """ return the compact PackedImageHash of this hash """
+        return PackedImageHash.from_array(self.hash)
+
+
+class PackedImageHash(object):
+    """
+    Compact hash encapsulation. The bits are packed into a single python integer,
+    the first bit of the flattened hash being the most significant one.
+    Behaves like ImageHash: str() returns the hex string, subtraction the hamming distance
+    and it can be used for dictionary keys and comparisons.
+    """
+    __slots__ = ('value', 'shape')
+
+    def __init__(self, value: int, shape):
+        self.value = value
+        self.shape = tuple(shape)
+
+    @property
+    def size(self) -> int:
+        """ number of bits of the hash """
+        # a python product, numpy.prod costs more than the bit operations of the hash
+        return functools.reduce(operator.mul, self.shape, 1)
+
+    @classmethod
+    def from_array(cls, binary_array):
+        """ pack a boolean array (ImageHash.hash) """
+        bits = numpy.asarray(binary_array, dtype=bool)
+        flat = bits.ravel()
+        # packbits pads the last byte on the right, pad on the left to keep the integer value
+        padding = -flat.size % 8
+        if padding:
+            flat = numpy.concatenate((numpy.zeros(padding, dtype=bool), flat))
+        return cls(int.from_bytes(numpy.packbits(flat).tobytes(), 'big'), bits.shape)
+
+    @classmethod
+    def from_hex(cls, hexstr: str, shape=None):
+        """
+        create from a stored hex string (str(ImageHash) or str(PackedImageHash))
+        shape defaults to a square hash_size * hash_size, like hex_to_hash
+        """
+        if shape is None:
+            hash_size = int(numpy.sqrt(len(hexstr) * 4))
+            shape = (hash_size, hash_size)
+        return cls(int(hexstr, 16), shape)
+
+    def to_array(self) -> numpy.ndarray:
+        """ unpack to a boolean array of the hash's shape """
+        size = self.size
+        packed = numpy.frombuffer(self.value.to_bytes((size + 7) // 8, 'big'), dtype=numpy.uint8)
+        return numpy.unpackbits(packed)[-size:].astype(bool).reshape(self.shape)
+
+    def to_image_hash(self):
+        """ unpack to an ImageHash """
+        return ImageHash(self.to_array())
+
+    def __str__(self):
+        return '{:0>{width}x}'.format(self.value, width=(self.size + 3) // 4)
+
+    def __repr__(self):
+        return 'PackedImageHash({!r}, {})'.format(str(self), self.shape)
+
+    def __sub__(self, other):
+        if other is None:
+            raise TypeError('Other hash must not be None.')
+        if isinstance(other, ImageHash):
+            other = other.pack()
+        if self.size != other.size:
+            raise TypeError('ImageHashes must be of the same shape.',
+                            self.shape, other.shape)
+        return _popcount(self.value ^ other.value)
+
+    def __eq__(self, other):
+        if isinstance(other, ImageHash):
+            other = other.pack()
+        if not isinstance(other, PackedImageHash):
+            return NotImplemented
+        return self.value == other.value and self.size == other.size
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self):
+        return hash(self.value)
+
+
+def _popcount(value: int) -> int:
+    """ number of set bits of an integer """
+    return bin(value).count('1')
+
+
+# int.bit_count (python >= 3.10) is considerably faster than counting the binary string
+if hasattr(int, 'bit_count'):
+    _popcount = int.bit_count
+
+
+def image_size(image) -> (int, int):
+    """ (width, height) of a PIL image or a numpy array """
+    if isinstance(image, numpy.ndarray):
+        return image.shape[1], image.shape[0]
+    return image.size
+
+
+def reduce_image(image, size) -> numpy.ndarray:
+    """
+    Convert an image to grayscale and resize it to size (width, height)
+    Params:
+        image      - PIL image or grayscale numpy array
+        size       - (width, height) of the result
+    Returns:
+        numpy.array of the grayscale pixels with shape (height, width)
+    """
+    if isinstance(image, numpy.ndarray):
+        if image.ndim != 2:
+            raise ValueError('numpy array images must be grayscale (2 dimensional) for hashing')
+        if image.dtype != numpy.uint8:
+            # only 8 bit images have a PIL counterpart, the other types are resized by opencv
+            return cv.resize(image, size, interpolation=cv.INTER_AREA)
+        image = Image.fromarray(image)
+    else:
+        image = image.convert("L")
+    # Image.LANCZOS is Image.ANTIALIAS, which recent PIL versions deprecate
+    return numpy.asarray(image.resize(size, Image.LANCZOS))
+
+
+def hash_input_size(algorithms,
+                    size,
+                    hash_size=8,
+                    highfreq_factor=4,
+                    image_scale=None,
+                    max_scale_factor=None,
+                    **params) -> (int, int):
+    """
+    (width, height) an image of the given size is resized to by the hashing algorithms, i.e. the least resolution
+    they need. An image file can be decoded at that resolution rather than in full, see helpers.imread_scaled
+    Params:
+        algorithms - name or list of names of algorithms, see HASH_ALGORITHMS
+        size       - (width, height) of the image
+        hash_size, highfreq_factor, image_scale - see the hashing functions
+        max_scale_factor - cap of the default image_scale of whash, see whash_fast
+        params     - other parameters of the algorithms, ignored
+    Returns:
+        (width, height), the largest size needed by the algorithms
+    """
+    if isinstance(algorithms, str):
+        algorithms = [algorithms]
+    if image_scale is None:
+        image_scale = max(2**int(numpy.log2(min(size))), hash_size)
+        if max_scale_factor is not None:
+            image_scale = min(image_scale, max(hash_size * max_scale_factor, hash_size))
+    img_size = hash_size * highfreq_factor
+    sizes = {
+        'ahash': (hash_size, hash_size),
+        'dhash': (hash_size + 1, hash_size),
+        'dhash_vertical': (hash_size, hash_size + 1),
+        'phash': (img_size, img_size),
+        'phash_simple': (img_size, img_size),
+        'phash_canonical': (img_size, img_size),
+        'whash': (image_scale, image_scale),
+    }
+    return (max(sizes[algorithm][0] for algorithm in algorithms),
+            max(sizes[algorithm][1] for algorithm in algorithms))
 
 
 def ahash(image, hash_size=8) -> ImageHash:
@@ -58,7 +241,7 @@ def ahash(image, hash_size=8) -> ImageHash:
     Step by step explanation:
     https://www.safaribooksonline.com/blog/2013/11/26/image-hashing-with-python/
     Params:
-        image      - must be a PIL instance image or numpy array in RGB or opencv image in BGR
+        image      - must be a PIL instance image or a grayscale numpy array
         hash_size  - an integer specifying the hash size, default 8 
     Returns:
         <ImageHash> object. To get the hash value simply use - str(<ImageHash>)
@@ -67,10 +250,8 @@ def ahash(image, hash_size=8) -> ImageHash:
         raise ValueError("Hash size must be greater than or equal to 2")
 
     # reduce size and complexity, then covert to grayscale
-    image = image.convert("L").resize((hash_size, hash_size), Image.ANTIALIAS)
-
     # find average pixel value; 'pixels' is an array of the pixel values, ranging from 0 (black) to 255 (white)
-    pixels = numpy.asarray(image)
+    pixels = reduce_image(image, (hash_size, hash_size))
     avg = pixels.mean()
 
     # create string of bits
@@ -85,7 +266,7 @@ def dhash(image, hash_size=8):
 	following http://www.hackerfactor.com/blog/index.php?/archives/529-Kind-of-Like-That.html
 	computes differences horizontally
 	Params:
-        image      - must be a PIL instance image or numpy array in RGB or opencv image in BGR
+        image      - must be a PIL instance image or a grayscale numpy array
         hash_size  - an integer specifying the hash size, default 8
     Returns:
         <ImageHash> object. To get the hash value simply use - str(<ImageHash>)
@@ -94,9 +275,7 @@ def dhash(image, hash_size=8):
     if hash_size < 2:
         raise ValueError("Hash size must be greater than or equal to 2")
 
-    image = image.convert("L").resize((hash_size + 1, hash_size),
-                                      Image.ANTIALIAS)
-    pixels = numpy.asarray(image)
+    pixels = reduce_image(image, (hash_size + 1, hash_size))
     # compute differences between columns
     diff = pixels[:, 1:] > pixels[:, :-1]
     return ImageHash(diff)
@@ -108,15 +287,13 @@ def dhash_vertical(image, hash_size=8):
 	following http://www.hackerfactor.com/blog/index.php?/archives/529-Kind-of-Like-That.html
 	computes differences vertically
 	Params:
-        image      - must be a PIL instance image or numpy array in RGB or opencv image in BGR
+        image      - must be a PIL instance image or a grayscale numpy array
         hash_size  - an integer specifying the hash size, default 8 for 64 bit hash
     Returns:
         <ImageHash> object. To get the hash value simply use - str(<ImageHash>)
 	"""
     # resize(w, h), but numpy.array((h, w))
-    image = image.convert("L").resize((hash_size, hash_size + 1),
-                                      Image.ANTIALIAS)
-    pixels = numpy.asarray(image)
+    pixels = reduce_image(image, (hash_size, hash_size + 1))
     # compute differences between rows
     diff = pixels[1:, :] > pixels[:-1, :]
     return ImageHash(diff)
@@ -127,7 +304,7 @@ def phash(image, hash_size=8, highfreq_factor=4):
 	Perceptual Hash computation.
 	Implementation follows http://www.hackerfactor.com/blog/index.php?/archives/432-Looks-Like-It.html
 	Params:
-        image      - must be a PIL instance image or numpy array in RGB or opencv image in BGR
+        image      - must be a PIL instance image or a grayscale numpy array
         hash_size  - an integer specifying the hash size (hash_size * highfreq_factor should be less than number of rows or columns of the gray_image)
         highfreq_factor - an integer specyfing the highfrequency factor
     Returns:
@@ -137,8 +314,7 @@ def phash(image, hash_size=8, highfreq_factor=4):
         raise ValueError("Hash size must be greater than or equal to 2")
 
     img_size = hash_size * highfreq_factor
-    image = image.convert("L").resize((img_size, img_size), Image.ANTIALIAS)
-    pixels = numpy.asarray(image)
+    pixels = reduce_image(image, (img_size, img_size))
     dct = scipy.fftpack.dct(scipy.fftpack.dct(pixels, axis=0), axis=1)
     dctlowfreq = dct[:hash_size, :hash_size]
     med = numpy.median(dctlowfreq)
@@ -146,20 +322,102 @@ def phash(image, hash_size=8, highfreq_factor=4):
     return ImageHash(diff)
 
 
+# orientations of the dihedral group (mirroring and rotations by multiples of 90 degrees anti-clockwise),
+# in the order of the hashes returned by phash_dihedral
+DIHEDRAL_ORIENTATIONS = ('identity', 'flip_vertical', 'flip_horizontal', 'rotate_180',
+                         'transpose', 'rotate_90', 'rotate_270', 'transverse')
+
+
+def dihedral_coefficients(dct) -> list:
+    """
+    DCT coefficients of the 8 orientations of an image, derived from the (square) DCT of the image itself.
+    Flipping the image along an axis multiplies the k-th coefficient along that axis by (-1)^k,
+    transposing the image transposes its coefficients; rotations are a transpose followed by a flip.
+    Params:
+        dct        - square numpy.array of the (low frequency) 2D DCT coefficients of the image
+    Returns:
+        list of 8 numpy.arrays, in the order of DIHEDRAL_ORIENTATIONS
+    """
+    signs = (-1.0)**numpy.arange(dct.shape[0])
+    rows, cols = signs[:, None], signs[None, :]
+    return [
+        dct, dct * rows, dct * cols, dct * rows * cols,
+        dct.T, dct.T * rows, dct.T * cols, dct.T * rows * cols
+    ]
+
+
+def phash_dihedral(image, hash_size=8, highfreq_factor=4) -> list:
+    """
+    Perceptual Hashes of the 8 orientations (mirrored, rotated by 90/180/270 degrees) of an image,
+    computed from a single DCT of the image, see dihedral_coefficients.
+    Params:
+        image      - must be a PIL instance image or a grayscale numpy array
+        hash_size  - an integer specifying the hash size (hash_size * highfreq_factor should be less than number of rows or columns of the gray_image)
+        highfreq_factor - an integer specyfing the highfrequency factor
+    Returns:
+        list of 8 <ImageHash> objects, in the order of DIHEDRAL_ORIENTATIONS. The first one is the phash of the image
+    """
+    if hash_size < 2:
+        raise ValueError("Hash size must be greater than or equal to 2")
+
+    img_size = hash_size * highfreq_factor
+    pixels = reduce_image(image, (img_size, img_size))
+    dct = scipy.fftpack.dct(scipy.fftpack.dct(pixels, axis=0), axis=1)
+    hashes = []
+    for dctlowfreq in dihedral_coefficients(dct[:hash_size, :hash_size]):
+        hashes.append(ImageHash(dctlowfreq > numpy.median(dctlowfreq)))
+    return hashes
+
+
+def phash_canonical(image, hash_size=8, highfreq_factor=4) -> ImageHash:
+    """
+    Orientation invariant Perceptual Hash: the smallest (as a number) of the 8 hashes of phash_dihedral.
+    A mirrored or rotated (by multiples of 90 degrees) copy of an image has the same canonical hash.
+    Params:
+        see phash_dihedral
+    Returns:
+        <ImageHash> object. To get the hash value simply use - str(<ImageHash>)
+    """
+    return min(phash_dihedral(image, hash_size, highfreq_factor), key=str)
+
+
+def phash_stack(pixels, hash_size=8) -> numpy.ndarray:
+    """
+    Perceptual Hash computation of a stack of images at once.
+    The 2D DCT of the whole stack is computed by scipy.fftpack along the axes of the images, as phash computes it,
+    and the median threshold is applied along the stack, giving the same bits as phash.
+    Params:
+        pixels     - numpy.array of shape (N, S, S), N grayscale images already reduced to
+                     S = hash_size * highfreq_factor pixels (see reduce_image)
+        hash_size  - an integer specifying the hash size
+    Returns:
+        numpy.array of booleans of shape (N, hash_size, hash_size), the bits of the N hashes
+    """
+    if hash_size < 2:
+        raise ValueError("Hash size must be greater than or equal to 2")
+    pixels = numpy.asarray(pixels, dtype=numpy.float64)
+    if pixels.ndim != 3 or pixels.shape[1] != pixels.shape[2]:
+        raise ValueError('pixels must be a stack of square images of shape (N, S, S)')
+
+    dct = scipy.fftpack.dct(scipy.fftpack.dct(pixels, axis=1), axis=2)
+    dctlowfreq = dct[:, :hash_size, :hash_size]
+    med = numpy.median(dctlowfreq.reshape(len(dctlowfreq), -1), axis=1)
+    return dctlowfreq > med[:, None, None]
+
+
 def phash_simple(image, hash_size=8, highfreq_factor=4):
     """
 	Perceptual Hash computation.
 	Implementation follows http://www.hackerfactor.com/blog/index.php?/archives/432-Looks-Like-It.html
 	Params:
-        image      - must be a PIL instance image or numpy array in RGB or opencv image in BGR
+        image      - must be a PIL instance image or a grayscale numpy array
         hash_size  - an integer specifying the hash size (hash_size * highfreq_factor should be less than number of rows or columns of the gray_image)
         highfreq_factor - an integer specyfing the highfrequency factor
     Returns:
         <ImageHash> object. To get the hash value simply use - str(<ImageHash>)
 	"""
     img_size = hash_size * highfreq_factor
-    image = image.convert("L").resize((img_size, img_size), Image.ANTIALIAS)
-    pixels = numpy.asarray(image)
+    pixels = reduce_image(image, (img_size, img_size))
     dct = scipy.fftpack.dct(pixels)
     dctlowfreq = dct[:hash_size, 1:hash_size + 1]
     avg = dctlowfreq.mean()
@@ -176,7 +434,7 @@ def whash(image,
 	Wavelet Hash computation.
 	based on https://www.kaggle.com/c/avito-duplicate-ads-detection/
     Params:
-        image      - must be a PIL instance image or numpy array in RGB or opencv image in BGR
+        image      - must be a PIL instance image or a grayscale numpy array
         hash_size  - must be a power of 2 and less than 'image_scale'
         image_scale- must be power of 2 and less than image size. By default is equal to max power of 2 for an input image.
         mode (see modes in pywt library):
@@ -190,7 +448,7 @@ def whash(image,
         assert image_scale & (image_scale -
                               1) == 0, "image_scale is not power of 2"
     else:
-        image_natural_scale = 2**int(numpy.log2(min(image.size)))
+        image_natural_scale = 2**int(numpy.log2(min(image_size(image))))
         image_scale = max(image_natural_scale, hash_size)
 
     ll_max_level = int(numpy.log2(image_scale))
@@ -200,9 +458,7 @@ def whash(image,
     assert level <= ll_max_level, "hash_size in a wrong range"
     dwt_level = ll_max_level - level
 
-    image = image.convert("L").resize((image_scale, image_scale),
-                                      Image.ANTIALIAS)
-    pixels = numpy.asarray(image) / 255
+    pixels = reduce_image(image, (image_scale, image_scale)) / 255
 
     # Remove low level frequency LL(max_ll) if @remove_max_haar_ll using haar filter
     if remove_max_haar_ll:
@@ -221,6 +477,199 @@ def whash(image,
     return ImageHash(diff)
 
 
+def whash_stack(pixels, hash_size=8, mode='haar') -> numpy.ndarray:
+    """
+    Wavelet Hash computation of a stack of images at once, without the decompose/recompose round trip of whash.
+    Removing the lowest LL frequency (the DC component) of the Haar decomposition subtracts the image mean,
+    which shifts every LL coefficient by the same amount and leaves the median threshold unchanged, so it is skipped.
+    For 'haar' the LL(K) band is the scaled sum of 2^K x 2^K pixel blocks and is computed with integer sums,
+    other modes run a single batched pywt.wavedec2.
+    Tied coefficients (e.g. flat padding) are resolved consistently here, whereas whash splits them by
+    floating point noise, so hashes of images with exactly tied blocks may differ from whash in those bits.
+    Params:
+        pixels     - numpy.array of shape (N, S, S), N grayscale images already reduced to S = image_scale
+        hash_size  - must be a power of 2 and less than or equal to S
+        mode       - see modes in pywt library, 'haar' by default
+    Returns:
+        numpy.array of booleans of shape (N, hash_size, hash_size) for 'haar', the bits of the N hashes
+    """
+    pixels = numpy.asarray(pixels)
+    if pixels.ndim != 3 or pixels.shape[1] != pixels.shape[2]:
+        raise ValueError('pixels must be a stack of square images of shape (N, S, S)')
+    image_scale = pixels.shape[1]
+    assert image_scale & (image_scale - 1) == 0, "image_scale is not power of 2"
+    assert hash_size & (hash_size - 1) == 0, "hash_size is not power of 2"
+    assert hash_size <= image_scale, "hash_size in a wrong range"
+
+    if mode == 'haar':
+        block = image_scale // hash_size
+        dwt_low = pixels.reshape(len(pixels), hash_size, block, hash_size,
+                                 block).sum(axis=(2, 4), dtype=numpy.int64)
+    else:
+        dwt_level = int(numpy.log2(image_scale)) - int(numpy.log2(hash_size))
+        dwt_low = pywt.wavedec2(pixels / 255, mode, level=dwt_level, axes=(-2, -1))[0]
+
+    med = numpy.median(dwt_low.reshape(len(dwt_low), -1), axis=1)
+    return dwt_low > med[:, None, None]
+
+
+def whash_fast(image,
+               hash_size=8,
+               image_scale=None,
+               mode='haar',
+               max_scale_factor=16) -> ImageHash:
+    """
+    Fast Wavelet Hash computation, see whash_stack.
+    Params:
+        image      - must be a PIL instance image or a grayscale numpy array
+        hash_size  - must be a power of 2 and less than 'image_scale'
+        image_scale- must be power of 2 and less than image size. By default is equal to max power of 2 for an input image,
+                     capped at hash_size * max_scale_factor.
+        mode (see modes in pywt library):
+            'haar'  - Haar wavelets, by default
+            'db4'   - Daubechies wavelets
+        max_scale_factor - cap of the default image_scale relative to hash_size. For 'haar' the cap changes well
+                     under a bit per hash on average, for other modes the scale sets the filter support and
+                     the hash changes. None disables the cap, which gives the bits of whash.
+    Returns:
+        <ImageHash> object. To get the hash value simply use - str(<ImageHash>)
+    """
+    if image_scale is None:
+        image_scale = hash_input_size('whash', image_size(image), hash_size, max_scale_factor=max_scale_factor)[0]
+    pixels = reduce_image(image, (image_scale, image_scale))
+    return ImageHash(whash_stack(pixels[None], hash_size, mode)[0])
+
+
+# hashing functions by name, used to dispatch an algorithm given as a string
+HASH_ALGORITHMS = {
+    'ahash': ahash,
+    'dhash': dhash,
+    'dhash_vertical': dhash_vertical,
+    'phash': phash,
+    'phash_simple': phash_simple,
+    'phash_canonical': phash_canonical,
+    'whash': whash,
+}
+
+
+# a pyramid level is used for a hash when it is at least this many times the hash's working size,
+# so that the final ANTIALIAS resize still sees enough pixels to match hashing the full image
+PYRAMID_MARGIN = 4
+
+
+def gray_pyramid(image, min_size) -> list:
+    """
+    Convert an image to grayscale once and successively halve it (box filter)
+    Params:
+        image      - PIL image or grayscale numpy array
+        min_size   - (width, height) the smallest level must not go below
+    Returns:
+        list of grayscale images (of the input's type), the full resolution image first
+    """
+    is_array = isinstance(image, numpy.ndarray)
+    levels = [image if is_array else image.convert("L")]
+    while True:
+        width, height = image_size(levels[-1])
+        if width // 2 < min_size[0] or height // 2 < min_size[1]:
+            return levels
+        if is_array:
+            levels.append(cv.resize(levels[-1], (width // 2, height // 2), interpolation=cv.INTER_AREA))
+        else:
+            levels.append(levels[-1].resize((width // 2, height // 2), Image.BOX))
+
+
+def pyramid_level(levels, size):
+    """ return the smallest pyramid level of at least PYRAMID_MARGIN times size (width, height) """
+    for level in reversed(levels):
+        width, height = image_size(level)
+        if width >= size[0] * PYRAMID_MARGIN and height >= size[1] * PYRAMID_MARGIN:
+            return level
+    return levels[0]
+
+
+# hashes fingerprint computes, by name: the hashing algorithms and whash_fast
+FINGERPRINT_ALGORITHMS = tuple(HASH_ALGORITHMS) + ('whash_fast', )
+
+
+def fingerprint_input_size(algorithms,
+                           size,
+                           hash_size=8,
+                           highfreq_factor=4,
+                           image_scale=None,
+                           max_scale_factor=16,
+                           **params) -> (int, int):
+    """
+    (width, height) an image of the given size is resized to by the hashes of fingerprint, see hash_input_size
+    Params:
+        algorithms - name or list of names of the hashes, see FINGERPRINT_ALGORITHMS
+        size       - (width, height) of the image
+        hash_size, highfreq_factor, image_scale, max_scale_factor - see fingerprint
+        params     - other parameters of the hashes, ignored
+    Returns:
+        (width, height), the largest size needed by the hashes
+    """
+    if isinstance(algorithms, str):
+        algorithms = [algorithms]
+    sizes = [
+        hash_input_size('whash', size, hash_size, image_scale=image_scale, max_scale_factor=max_scale_factor)
+        if algorithm == 'whash_fast' else hash_input_size(algorithm, size, hash_size, highfreq_factor, image_scale)
+        for algorithm in algorithms
+    ]
+    return max(width for width, _ in sizes), max(height for _, height in sizes)
+
+
+def fingerprint(image,
+                algorithms=('ahash', 'dhash', 'dhash_vertical', 'phash', 'whash_fast'),
+                hash_size=8,
+                highfreq_factor=4,
+                image_scale=None,
+                mode='haar',
+                remove_max_haar_ll=True,
+                max_scale_factor=16) -> dict:
+    """
+    Compute several hashes of an image in a single pass.
+    The image is converted to grayscale once and downscaled into a pyramid of halved images,
+    every hash is then derived from the smallest pyramid level large enough for it.
+    Since the hashes are not computed from the full resolution image, a hash may differ from
+    the one computed by its own function by a bit or two.
+    Params:
+        image      - must be a PIL instance image or a grayscale numpy array
+        algorithms - names of the hashes to compute, see FINGERPRINT_ALGORITHMS
+        hash_size, highfreq_factor, image_scale, mode, remove_max_haar_ll, max_scale_factor - see the individual
+                     hashing functions: 'whash' is computed with whash, 'whash_fast' with whash_fast
+    Returns:
+        dict of algorithm name -> <ImageHash> object
+    """
+    if hash_size < 2:
+        raise ValueError("Hash size must be greater than or equal to 2")
+    for algorithm in algorithms:
+        if algorithm not in FINGERPRINT_ALGORITHMS:
+            raise ValueError("Invalid value '{}' for argument 'algorithms'".format(algorithm))
+
+    # (width, height) each hash resizes its grayscale image to. The scale of the wavelet hashes must come from the
+    # original image, not from a pyramid level
+    sizes = {
+        algorithm: fingerprint_input_size(algorithm, image_size(image), hash_size, highfreq_factor, image_scale,
+                                          max_scale_factor)
+        for algorithm in algorithms
+    }
+    smallest = min(min(sizes[algorithm]) for algorithm in algorithms)
+    levels = gray_pyramid(image, (smallest * PYRAMID_MARGIN, smallest * PYRAMID_MARGIN))
+
+    hashes = {}
+    for algorithm in algorithms:
+        level = pyramid_level(levels, sizes[algorithm])
+        if algorithm in ('phash', 'phash_simple', 'phash_canonical'):
+            hashes[algorithm] = HASH_ALGORITHMS[algorithm](level, hash_size, highfreq_factor)
+        elif algorithm == 'whash':
+            hashes[algorithm] = whash(level, hash_size, sizes[algorithm][0], mode, remove_max_haar_ll)
+        elif algorithm == 'whash_fast':
+            hashes[algorithm] = whash_fast(level, hash_size, sizes[algorithm][0], mode)
+        else:
+            hashes[algorithm] = HASH_ALGORITHMS[algorithm](level, hash_size)
+    return hashes
+
+
 # LEGACY CODE
 def hex_to_hash(hexstr):
     """
@@ -232,6 +681,11 @@ def hex_to_hash(hexstr):
 	2. This algorithm does not work for hash_size < 2.
 	"""
     hash_size = int(numpy.sqrt(len(hexstr) * 4))
+    if hash_size * hash_size == len(hexstr) * 4:
+        # unpack the bytes of the hex string at once rather than digit by digit
+        packed = numpy.frombuffer(bytes.fromhex(hexstr.rjust(len(hexstr) + len(hexstr) % 2, '0')), dtype=numpy.uint8)
+        bits = numpy.unpackbits(packed)[-hash_size * hash_size:]
+        return ImageHash(bits.astype(bool).reshape(hash_size, hash_size))
     binary_array = '{:0>{width}b}'.format(int(hexstr, 16),
                                           width=hash_size * hash_size)
     bit_rows = [
@@ -0,0 +1,184 @@
+""" Persistent on-disk cache of the hashes of image files """
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import time
+from imagewizard.image_hashing.api.hash_algorithms import HASH_ALGORITHMS, PackedImageHash
+
+
+def file_digest(file_name: str, chunk_size: int = 1 << 20) -> str:
+    """ fast content digest (blake2b, 128 bit, or md5 before python 3.6) of a file """
+    digest = hashlib.blake2b(digest_size=16) if hasattr(hashlib, 'blake2b') else hashlib.md5()
+    with open(file_name, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def canonical_params(algorithm: str, params: dict) -> str:
+    """
+    the complete set of parameters of an algorithm, defaults included, as a string
+    so that e.g. ahash() and ahash(hash_size=8) share their cache entries
+    """
+    bound = inspect.signature(HASH_ALGORITHMS[algorithm]).bind(None, **params)
+    bound.apply_defaults()
+    arguments = dict(bound.arguments)
+    arguments.pop('image')
+    return json.dumps(arguments, sort_keys=True)
+
+
+class SQLiteConnection():
+    """
+    Mixin of the classes stored in a sqlite file (self.path, opened with self.timeout) in WAL mode: every process opens
+    its own connection, which is not pickled. _setup_connection prepares a new connection, e.g. creates the tables
+    """
+    _connection = None
+    _pid = None
+
+    def __getstate__(self):
+        # the sqlite connection can not be shared with other processes, they open their own
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        state['_pid'] = None
+        return state
+
+    def _setup_connection(self, connection: sqlite3.Connection):
+        pass
+
+    def _connect(self) -> sqlite3.Connection:
+        """ sqlite connection of the current process """
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            try:
+                connection.execute('PRAGMA journal_mode=WAL')
+                connection.execute('PRAGMA synchronous=NORMAL')
+                self._setup_connection(connection)
+            except BaseException:
+                connection.close()
+                raise
+            self._connection, self._pid = connection, os.getpid()
+        return self._connection
+
+    def close(self):
+        """ close the connection of the current process """
+        if self._connection is not None and self._pid == os.getpid():
+            self._connection.close()
+        self._connection = None
+
+
+class HashCache(SQLiteConnection):
+    """
+    Cache of image file hashes, stored in a single sqlite file.
+    An entry is keyed by the file path, the algorithm and its parameters (hash_size, highfreq_factor, mode...)
+    and is valid as long as the file's size and modification time are unchanged. With verify_digest,
+    the file's content digest must match as well, which catches content changes that preserve size and mtime.
+    The least recently used entries are evicted once the cache holds more than max_entries.
+    The file is opened in WAL mode, so it can be shared by concurrent readers and writers of multiple processes.
+    """
+    def __init__(self,
+                 path: str,
+                 max_entries: int = None,
+                 verify_digest: bool = False,
+                 timeout: float = 30.0):
+        """
+        Params:
+            path       - file name of the cache, created if it does not exist
+            max_entries- (integer) maximum number of cached hashes, unlimited by default
+            verify_digest - (bool) also key the entries by a digest of the file's content
+            timeout    - (float) seconds to wait for a lock held by another process
+        """
+        if max_entries is not None and max_entries < 1:
+            raise ValueError('max_entries: {} must be an integer >= 1'.format(max_entries))
+        self.path = path
+        self.max_entries = max_entries
+        self.verify_digest = verify_digest
+        self.timeout = timeout
+
+    def _setup_connection(self, connection: sqlite3.Connection):
+        connection.execute('CREATE TABLE IF NOT EXISTS hashes ('
+                           'key TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT, '
+                           'hash TEXT, shape TEXT, last_access REAL)')
+        connection.execute('CREATE INDEX IF NOT EXISTS hashes_last_access ON hashes (last_access)')
+
+    def _key(self, file_name: str, algorithm: str, params: dict) -> str:
+        return json.dumps([os.path.abspath(file_name), algorithm, canonical_params(algorithm, params)])
+
+    def stamp(self, file_name: str) -> tuple:
+        """
+        (size, mtime_ns, digest) identifying the current content of a file, digest is None without verify_digest.
+        Take it before reading the file to hash it, so that a file changed while it is hashed is not cached as valid
+        """
+        stat = os.stat(file_name)
+        digest = file_digest(file_name) if self.verify_digest else None
+        return stat.st_size, stat.st_mtime_ns, digest
+
+    def get_many(self, file_names: [str], algorithm: str, params: dict = None) -> list:
+        """
+        Params:
+            file_names - list of image file paths
+            algorithm  - hashing algorithm name, see HASH_ALGORITHMS
+            params     - dict of keyword arguments of the algorithm
+        Returns:
+            list of the cached <ImageHash> objects, None for files not cached (or changed since)
+        """
+        params = params or {}
+        connection = self._connect()
+        results, hits, now = [], [], time.time()
+        for file_name in file_names:
+            key = self._key(file_name, algorithm, params)
+            row = connection.execute('SELECT size, mtime_ns, digest, hash, shape FROM hashes WHERE key = ?',
+                                     (key, )).fetchone()
+            try:
+                current = self.stamp(file_name) if row is not None else None
+            except OSError:
+                current = None
+            if current is None or tuple(row[:2]) != current[:2] or (self.verify_digest and row[2] != current[2]):
+                results.append(None)
+                continue
+            shape = tuple(int(dim) for dim in row[4].split(','))
+            results.append(PackedImageHash.from_hex(row[3], shape).to_image_hash())
+            hits.append((now, key))
+        if hits:
+            connection.executemany('UPDATE hashes SET last_access = ? WHERE key = ?', hits)
+        return results
+
+    def put_many(self, file_names: [str], image_hashes: list, algorithm: str, params: dict = None, stamps: list = None):
+        """
+        store the hashes of image files, see get_many
+        stamps is the list of the stamps of the files (see stamp) taken before they were read, by default they are
+        taken now
+        """
+        params = params or {}
+        if stamps is None:
+            stamps = [self.stamp(file_name) for file_name in file_names]
+        rows, now = [], time.time()
+        for file_name, image_hash, (size, mtime_ns, digest) in zip(file_names, image_hashes, stamps):
+            shape = ','.join(str(dim) for dim in image_hash.hash.shape)
+            rows.append((self._key(file_name, algorithm, params), size, mtime_ns, digest,
+                         str(image_hash), shape, now))
+        connection = self._connect()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.executemany('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            if self.max_entries is not None:
+                # evict the least recently used entries
+                connection.execute(
+                    'DELETE FROM hashes WHERE key IN (SELECT key FROM hashes ORDER BY last_access DESC '
+                    'LIMIT -1 OFFSET ?)', (self.max_entries, ))
+
+    def get(self, file_name: str, algorithm: str, params: dict = None):
+        """ cached <ImageHash> of an image file or None """
+        return self.get_many([file_name], algorithm, params)[0]
+
+    def put(self, file_name: str, image_hash, algorithm: str, params: dict = None, stamp: tuple = None):
+        """ store the hash of an image file, see put_many """
+        self.put_many([file_name], [image_hash], algorithm, params, None if stamp is None else [stamp])
+
+    def clear(self):
+        """ remove all the cached hashes """
+        self._connect().execute('DELETE FROM hashes')
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM hashes').fetchone()[0]
@@ -0,0 +1,198 @@
+"""
+Bulk conversions of hashes between hex strings, ImageHash objects and packed numpy arrays, and a binary hash file format
+
+A set of N hashes of B bits is packed as a uint8 array of shape (N, ceil(B / 8)): every row holds the bytes of the
+hash's integer value (PackedImageHash.value), most significant byte first, so that the first bit of the hash is the
+most significant one and the row's hex is str(ImageHash) (zero padded to whole bytes).
+The same rows can be viewed as (N, ceil(B / 64)) uint64 words, most significant word first, see packed_to_uint64.
+
+Binary hash file format (.iwh), little endian:
+    offset  size  field
+    0       8     magic b'IWHASH' followed by the format version (uint16, 1)
+    8       16    algorithm name, ascii, zero padded (e.g. b'phash')
+    24      4     hash_size (uint32)
+    28      4     bits per hash (uint32), hash_size * hash_size for square hashes
+    32      8     count, number of hashes (uint64)
+    40      24    reserved, zeros
+    64      ...   count rows of ceil(bits / 8) bytes, the packed hashes as above
+The hashes of a file are hence numpy.fromfile(file, dtype=uint8, offset=64).reshape(count, -1), see load_hashes.
+"""
+import struct
+import numpy
+from imagewizard.image_hashing.api.hash_algorithms import ImageHash, PackedImageHash
+
+HASH_FILE_MAGIC = b'IWHASH'
+HASH_FILE_VERSION = 1
+HASH_FILE_HEADER = struct.Struct('<6sH16sIIQ24x')
+
+
+def row_bytes(bits: int) -> int:
+    """ number of bytes of a packed hash of the given number of bits """
+    return (bits + 7) // 8
+
+
+def hex_to_packed(hex_strings, bits: int = None) -> numpy.ndarray:
+    """
+    Params:
+        hex_strings- list or array of hex strings of equal length (str(ImageHash))
+        bits       - (integer) number of bits of the hashes, defaults to 4 bits per hex digit
+    Returns:
+        numpy.array of uint8 of shape (N, ceil(bits / 8)), see the module documentation
+    """
+    hex_strings = [str(hexstr) for hexstr in hex_strings]
+    if not hex_strings:
+        return numpy.zeros((0, row_bytes(bits or 0)), dtype=numpy.uint8)
+    digits = len(hex_strings[0])
+    if any(len(hexstr) != digits for hexstr in hex_strings):
+        raise ValueError('hex strings must all have the same length')
+    bits = digits * 4 if bits is None else bits
+    width = row_bytes(bits) * 2
+    if width < digits:
+        raise ValueError('{} hex digits do not fit in {} bits'.format(digits, bits))
+    if width > digits:
+        hex_strings = [hexstr.rjust(width, '0') for hexstr in hex_strings]
+    # a single C level conversion of the whole set
+    packed = numpy.frombuffer(bytes.fromhex(''.join(hex_strings)), dtype=numpy.uint8)
+    return packed.reshape(len(hex_strings), width // 2)
+
+
+def packed_to_hex(packed: numpy.ndarray, bits: int = None) -> list:
+    """
+    Params:
+        packed     - numpy.array of uint8 of shape (N, ceil(bits / 8))
+        bits       - (integer) number of bits of the hashes, defaults to 8 bits per byte
+    Returns:
+        list of the N hex strings, as str(ImageHash) gives them
+    """
+    packed = numpy.ascontiguousarray(packed, dtype=numpy.uint8)
+    row_digits = packed.shape[1] * 2
+    bits = packed.shape[1] * 8 if bits is None else bits
+    skip = row_digits - (bits + 3) // 4
+    hexstr = packed.tobytes().hex()
+    return [hexstr[start + skip:start + row_digits] for start in range(0, len(hexstr), row_digits)]
+
+
+def hashes_to_packed(hashes) -> numpy.ndarray:
+    """
+    Params:
+        hashes     - list of <ImageHash> or <PackedImageHash> objects of the same size
+    Returns:
+        numpy.array of uint8 of shape (N, ceil(bits / 8)), see the module documentation
+    """
+    hashes = list(hashes)
+    if not hashes:
+        return numpy.zeros((0, 0), dtype=numpy.uint8)
+    if all(isinstance(image_hash, ImageHash) for image_hash in hashes):
+        bits = numpy.stack([numpy.asarray(image_hash.hash, dtype=bool).ravel() for image_hash in hashes])
+        # pad on the left to whole bytes, like the integer value of the hash
+        padding = -bits.shape[1] % 8
+        if padding:
+            bits = numpy.concatenate((numpy.zeros((len(bits), padding), dtype=bool), bits), axis=1)
+        return numpy.packbits(bits, axis=1)
+    packed = [image_hash if isinstance(image_hash, PackedImageHash) else image_hash.pack() for image_hash in hashes]
+    size = packed[0].size
+    if any(image_hash.size != size for image_hash in packed):
+        raise TypeError('hashes must all have the same size')
+    buffer = b''.join(image_hash.value.to_bytes(row_bytes(size), 'big') for image_hash in packed)
+    return numpy.frombuffer(buffer, dtype=numpy.uint8).reshape(len(packed), row_bytes(size))
+
+
+def packed_to_hashes(packed: numpy.ndarray, shape) -> list:
+    """
+    Params:
+        packed     - numpy.array of uint8 of shape (N, ceil(bits / 8))
+        shape      - shape of the hashes, e.g. (8, 8)
+    Returns:
+        list of the N <ImageHash> objects
+    """
+    bits = int(numpy.prod(shape))
+    unpacked = numpy.unpackbits(numpy.asarray(packed, dtype=numpy.uint8), axis=1)[:, -bits:].astype(bool)
+    return [ImageHash(row.reshape(shape)) for row in unpacked]
+
+
+def packed_to_uint64(packed: numpy.ndarray) -> numpy.ndarray:
+    """
+    view packed hashes as 64 bit words (native byte order), most significant word first
+    Returns:
+        numpy.array of uint64 of shape (N, ceil(bits / 64)). For 64 bit hashes, column 0 holds the hash values
+    """
+    packed = numpy.asarray(packed, dtype=numpy.uint8)
+    padding = -packed.shape[1] % 8
+    if padding:
+        packed = numpy.concatenate((numpy.zeros((len(packed), padding), dtype=numpy.uint8), packed), axis=1)
+    return numpy.ascontiguousarray(packed).view('>u8').astype(numpy.uint64)
+
+
+def uint64_to_packed(words: numpy.ndarray, bits: int = None) -> numpy.ndarray:
+    """
+    reverse of packed_to_uint64, words is an array of shape (N, W) or (N, ) for 64 bit hashes
+    """
+    words = numpy.asarray(words, dtype=numpy.uint64)
+    if words.ndim == 1:
+        words = words[:, None]
+    packed = words.astype('>u8').view(numpy.uint8).reshape(len(words), -1)
+    bits = packed.shape[1] * 8 if bits is None else bits
+    return packed[:, packed.shape[1] - row_bytes(bits):]
+
+
+def save_hashes(file_name: str, packed: numpy.ndarray, algorithm: str, hash_size: int, bits: int = None):
+    """
+    write packed hashes to a binary hash file, see the module documentation for the format
+    Params:
+        file_name  - path of the file
+        packed     - numpy.array of uint8 of shape (N, ceil(bits / 8)), e.g. from hashes_to_packed or hex_to_packed
+        algorithm  - (string) name of the hashing algorithm, e.g. 'phash'
+        hash_size  - (integer) hash_size the hashes were computed with
+        bits       - (integer) number of bits per hash, defaults to hash_size * hash_size
+    """
+    packed = numpy.ascontiguousarray(packed, dtype=numpy.uint8)
+    bits = hash_size * hash_size if bits is None else bits
+    if packed.ndim != 2 or packed.shape[1] != row_bytes(bits):
+        raise ValueError('packed must be of shape (N, {}) for {} bit hashes'.format(row_bytes(bits), bits))
+    name = algorithm.encode('ascii')
+    if len(name) > 16:
+        raise ValueError('algorithm name must be at most 16 characters')
+    with open(file_name, 'wb') as hash_file:
+        hash_file.write(HASH_FILE_HEADER.pack(HASH_FILE_MAGIC, HASH_FILE_VERSION, name, hash_size, bits, len(packed)))
+        packed.tofile(hash_file)
+
+
+def read_hash_header(file_name: str) -> dict:
+    """
+    read the header of a binary hash file
+    Returns:
+        dict with the keys 'algorithm', 'hash_size', 'bits' and 'count'
+    """
+    with open(file_name, 'rb') as hash_file:
+        header = hash_file.read(HASH_FILE_HEADER.size)
+    if len(header) != HASH_FILE_HEADER.size:
+        raise ValueError('{} is not a hash file'.format(file_name))
+    magic, version, name, hash_size, bits, count = HASH_FILE_HEADER.unpack(header)
+    if magic != HASH_FILE_MAGIC:
+        raise ValueError('{} is not a hash file'.format(file_name))
+    if version != HASH_FILE_VERSION:
+        raise ValueError('unsupported hash file version {}'.format(version))
+    return {'algorithm': name.rstrip(b'\0').decode('ascii'), 'hash_size': hash_size, 'bits': bits, 'count': count}
+
+
+def load_hashes(file_name: str, mmap: bool = False):
+    """
+    read a binary hash file
+    Params:
+        file_name  - path of the file
+        mmap       - (bool) memory map the hashes (read only) rather than reading them into memory
+    Returns:
+        (header, packed) where header is the dict of read_hash_header and packed the numpy.array of uint8
+        of shape (count, ceil(bits / 8))
+    """
+    header = read_hash_header(file_name)
+    shape = (header['count'], row_bytes(header['bits']))
+    if mmap:
+        if header['count'] == 0:
+            return header, numpy.zeros(shape, dtype=numpy.uint8)
+        return header, numpy.memmap(file_name, dtype=numpy.uint8, mode='r', offset=HASH_FILE_HEADER.size,
+                                    shape=shape)
+    packed = numpy.fromfile(file_name, dtype=numpy.uint8, offset=HASH_FILE_HEADER.size)
+    if packed.size != shape[0] * shape[1]:
+        raise ValueError('{} is truncated'.format(file_name))
+    return header, packed.reshape(shape)
@@ -1,62 +1,136 @@
 import os.path
-from imagewizard.image_hashing.api.hash_algorithms import ahash, dhash_vertical, dhash, phash, phash_simple, whash
+from functools import partial
+from imagewizard.image_hashing.api.hash_algorithms import ahash, dhash_vertical, dhash, phash, phash_simple, whash, fingerprint, phash_stack, reduce_image, ImageHash, whash_fast, whash_stack, image_size, phash_dihedral, phash_canonical, hash_input_size, fingerprint_input_size
+import numpy as np
+from imagewizard.image_hashing.api import batch_hashing as bh
+from imagewizard.image_hashing.api import stream_hashing as sh
+from imagewizard.image_hashing.api import hash_io
+from imagewizard.image_hashing.api.crop_resistant import crop_resistant_hash, BASE_SIZE as CROP_RESISTANT_BASE_SIZE
+from imagewizard.image_hashing.api.frame_hashing import hash_frames
 from imagewizard.helpers import helpers
 """ Class containing method to perform various hashing on image """
 
 
 class Hashing():
+    """
+    numpy arrays and opencv images are converted to grayscale and resized as single channel images, and have exactly
+    the hashes of the PIL image of the same pixels, see hash_algorithms.
+    Image file paths and encoded images (bytes, bytearray or memoryview of an image file, decoded without a copy)
+    are read with opencv straight to grayscale, JPEG images at the least resolution the hash needs
+    (1/2, 1/4 or 1/8 of their size, see helpers.imread_scaled), which is several times faster than a full decode.
+    """
+    def __init__(self, cache=None):
+        """
+        Params:
+            cache      - optional HashCache, the hashes of image files computed by the batch methods (hash_many)
+                         are looked up in and stored to it, see image_hashing.api.hash_cache
+        """
+        self.cache = cache
+
     def ahash(self, image, hash_size: int = 8, order: str = 'rgb'):
         """
         Average Hash computation
         Params:
-            image      - must be a PIL instance image or numpy array in RGB or opencv image in BGR
+            image      - must be a PIL instance image or numpy array in RGB or opencv image in BGR, an image file path or encoded image bytes
             hash_size  - (integer) default 8 for 64 bit hash
             order      - (string) RGB, BGR: input order of the colors BGR/RGB. Deafult order: RGB
         Returns:
             <ImageHash> object. To get the hash value simply use - str(<ImageHash>)
         """
-        image = helpers.format_image_to_PIL(image, order)
+        image = bh.load_image(image, order, partial(hash_input_size, 'ahash', hash_size=hash_size))
         return ahash(image, hash_size)
 
     def dhash(self, image, hash_size=8, order: str = 'rgb'):
         """
         Difference Hash computation.
         Params:
-            image      - must be a PIL instance image or numpy array in RGB or opencv image in BGR
+            image      - must be a PIL instance image or numpy array in RGB or opencv image in BGR, an image file path or encoded image bytes
             hash_size  - (integer) default 8 for 64 bit hash
             order      - (string) RGB, BGR: input order of the colors BGR/RGB. Deafult order: RGB
         Returns:
             <ImageHash> object. To get the hash value simply use - str(<ImageHash>)
         """
-        image = helpers.format_image_to_PIL(image, order)
+        image = bh.load_image(image, order, partial(hash_input_size, 'dhash', hash_size=hash_size))
         return dhash(image, hash_size)
 
     def dhash_vertical(self, image, hash_size=8, order: str = 'rgb'):
         """
         Difference Hash computation.
         Params:
-            image      - must be a PIL instance image or numpy array in RGB or opencv image in BGR
+            image      - must be a PIL instance image or numpy array in RGB or opencv image in BGR, an image file path or encoded image bytes
             hash_size  - (integer) default 8 for 64 bit hash
             order      - (string) RGB, BGR: input order of the colors BGR/RGB. Deafult order: RGB
         Returns:
             <ImageHash> object. To get the hash value simply use - str(<ImageHash>)
         """
-        image = helpers.format_image_to_PIL(image, order)
+        image = bh.load_image(image, order, partial(hash_input_size, 'dhash_vertical', hash_size=hash_size))
         return dhash_vertical(image, hash_size)
 
     def phash(self, image, hash_size=8, highfreq_factor=4, order: str = 'rgb'):
         """
         Perceptual Hash computation.
         Params:
-            image      - must be a PIL instance image or numpy array in RGB or opencv image in BGR
+            image      - must be a PIL instance image or numpy array in RGB or opencv image in BGR, an image file path or encoded image bytes
             hash_size  - an integer specifying the hash size (hash_size * highfreq_factor should be less than number of rows or columns of the gray_image)
             highfreq_factor - an integer specyfing the highfrequency factor
         Returns:
             <ImageHash> object. To get the hash value simply use - str(<ImageHash>)
         """
-        image = helpers.format_image_to_PIL(image, order)
+        target_size = partial(hash_input_size, 'phash', hash_size=hash_size, highfreq_factor=highfreq_factor)
+        image = bh.load_image(image, order, target_size)
         return phash(image, hash_size, highfreq_factor)
 
+    def phash_dihedral(self, image, hash_size=8, highfreq_factor=4, order: str = 'rgb'):
+        """
+        Perceptual Hashes of the 8 orientations of an image (as is, mirrored vertically, mirrored horizontally, rotated by
+        180 degrees, transposed, rotated by 90 degrees, rotated by 270 degrees, transversed), computed from a single DCT.
+        Use with Similarity.similarity_dihedral to match mirrored or rotated copies of an image.
+        Params:
+            image      - must be a PIL instance image or numpy array in RGB or opencv image in BGR, an image file path or encoded image bytes
+            hash_size  - an integer specifying the hash size (hash_size * highfreq_factor should be less than number of rows or columns of the gray_image)
+            highfreq_factor - an integer specyfing the highfrequency factor
+            order      - (string) RGB, BGR: input order of the colors BGR/RGB. Deafult order: RGB
+        Returns:
+            list of 8 <ImageHash> objects, the first one being the phash of the image
+        """
+        target_size = partial(hash_input_size, 'phash', hash_size=hash_size, highfreq_factor=highfreq_factor)
+        image = bh.load_image(image, order, target_size)
+        return phash_dihedral(image, hash_size, highfreq_factor)
+
+    def phash_canonical(self, image, hash_size=8, highfreq_factor=4, order: str = 'rgb'):
+        """
+        Orientation invariant Perceptual Hash, the smallest of the 8 hashes of phash_dihedral.
+        Mirrored or rotated (by multiples of 90 degrees) copies of an image have the same canonical hash.
+        Params:
+            see phash_dihedral
+        Returns:
+            <ImageHash> object. To get the hash value simply use - str(<ImageHash>)
+        """
+        target_size = partial(hash_input_size, 'phash', hash_size=hash_size, highfreq_factor=highfreq_factor)
+        image = bh.load_image(image, order, target_size)
+        return phash_canonical(image, hash_size, highfreq_factor)
+
+    def phash_batch(self, images, hash_size=8, highfreq_factor=4, order: str = 'rgb'):
+        """
+        Perceptual Hash computation of many images at once. The DCT of all the images is computed as matrix products
+        over the whole batch, avoiding the per image overhead of phash. The hashes are equal to those of phash.
+        Params:
+            images     - list of PIL instance images or numpy arrays in RGB or opencv images in BGR, image file paths or encoded images (bytes)
+            hash_size  - an integer specifying the hash size (hash_size * highfreq_factor should be less than number of rows or columns of the gray_image)
+            highfreq_factor - an integer specyfing the highfrequency factor
+            order      - (string) RGB, BGR: input order of the colors BGR/RGB. Deafult order: RGB
+        Returns:
+            list of <ImageHash> objects, in the order of images
+        """
+        img_size = hash_size * highfreq_factor
+        pixels = [
+            reduce_image(bh.load_image(image, order, (img_size, img_size)), (img_size, img_size))
+            for image in images
+        ]
+        if not pixels:
+            return []
+        return [ImageHash(bits) for bits in phash_stack(pixels, hash_size)]
+
     def phash_simple(self,
                      image,
                      hash_size=8,
@@ -65,13 +139,15 @@ class Hashing():
         """
         Perceptual Hash computation.
     	Params:
-            image      - must be a PIL instance image or numpy array in RGB or opencv image in BGR
+            image      - must be a PIL instance image or numpy array in RGB or opencv image in BGR, an image file path or encoded image bytes
             hash_size  - an integer specifying the hash size (hash_size * highfreq_factor should be less than number of rows or columns of the gray_image)
             highfreq_factor - an integer specyfing the highfrequency factor
         Returns:
             <ImageHash> object. To get the hash value simply use - str(<ImageHash>)
         """
-        image = helpers.format_image_to_PIL(image, order)
+        target_size = partial(hash_input_size, 'phash_simple', hash_size=hash_size,
+                              highfreq_factor=highfreq_factor)
+        image = bh.load_image(image, order, target_size)
         return phash_simple(image, hash_size, highfreq_factor)
 
     def whash(self,
@@ -84,7 +160,7 @@ class Hashing():
         """
         Wavelet Hash computation.
         Params:
-            image      - must be a PIL instance image or numpy array in RGB or opencv image in BGR
+            image      - must be a PIL instance image or numpy array in RGB or opencv image in BGR, an image file path or encoded image bytes
             hash_size  - must be a power of 2 and less than 'image_scale'
             image_scale- must be power of 2 and less than image size. By default is equal to max power of 2 for an input image.
             mode (see modes in pywt library):
@@ -94,5 +170,267 @@ class Hashing():
         Returns:
             <ImageHash> object. To get the hash value simply use - str(<ImageHash>)
         """
-        image = helpers.format_image_to_PIL(image, order)
+        target_size = partial(hash_input_size, 'whash', hash_size=hash_size, image_scale=image_scale)
+        image = bh.load_image(image, order, target_size)
         return whash(image, hash_size, image_scale, mode, remove_max_haar_ll)
+
+    def whash_fast(self,
+                   image,
+                   hash_size=8,
+                   image_scale=None,
+                   mode='haar',
+                   max_scale_factor=16,
+                   order: str = 'rgb'):
+        """
+        Fast Wavelet Hash computation. The lowest LL frequency is removed analytically instead of decomposing and
+        recomposing the image, and the default working scale is capped relative to hash_size.
+        With max_scale_factor=None the bits are those of whash (up to exactly tied coefficients).
+        Params:
+            image      - must be a PIL instance image or numpy array in RGB or opencv image in BGR, an image file path or encoded image bytes
+            hash_size  - must be a power of 2 and less than 'image_scale'
+            image_scale- must be power of 2 and less than image size. By default is equal to max power of 2 for an input image, capped at hash_size * max_scale_factor
+            mode (see modes in pywt library):
+                'haar'  - Haar wavelets, by default
+                'db4'   - Daubechies wavelets
+            max_scale_factor - (integer) cap of the default image_scale relative to hash_size, None for no cap
+            order      - (string) RGB, BGR: input order of the colors BGR/RGB. Deafult order: RGB
+        Returns:
+            <ImageHash> object. To get the hash value simply use - str(<ImageHash>)
+        """
+        target_size = partial(hash_input_size, 'whash', hash_size=hash_size, image_scale=image_scale,
+                              max_scale_factor=max_scale_factor)
+        image = bh.load_image(image, order, target_size)
+        return whash_fast(image, hash_size, image_scale, mode, max_scale_factor)
+
+    def whash_batch(self,
+                    images,
+                    hash_size=8,
+                    image_scale=None,
+                    mode='haar',
+                    max_scale_factor=16,
+                    order: str = 'rgb'):
+        """
+        Fast Wavelet Hash computation of many images at once, see whash_fast.
+        Images that share the same working scale are hashed together in one vectorized pass.
+        Params:
+            images     - list of PIL instance images or numpy arrays in RGB or opencv images in BGR, image file paths or encoded images (bytes)
+            hash_size, image_scale, mode, max_scale_factor - see whash_fast
+            order      - (string) RGB, BGR: input order of the colors BGR/RGB. Deafult order: RGB
+        Returns:
+            list of <ImageHash> objects, in the order of images
+        """
+        # group the reduced images by their working scale
+        target_size = partial(hash_input_size, 'whash', hash_size=hash_size, image_scale=image_scale,
+                              max_scale_factor=max_scale_factor)
+        stacks = {}
+        for index, image in enumerate(images):
+            image = bh.load_image(image, order, target_size)
+            scale = hash_input_size('whash', image_size(image), hash_size, image_scale=image_scale,
+                                    max_scale_factor=max_scale_factor)[0]
+            stacks.setdefault(scale, []).append((index, reduce_image(image, (scale, scale))))
+
+        hashes = [None] * sum(len(stack) for stack in stacks.values())
+        for stack in stacks.values():
+            indices, pixels = zip(*stack)
+            for index, bits in zip(indices, whash_stack(np.stack(pixels), hash_size, mode)):
+                hashes[index] = ImageHash(bits)
+        return hashes
+
+    def crop_resistant_hash(self,
+                            image,
+                            hash_size=8,
+                            scales=(1, 0.9, 0.8, 0.7, 0.6),
+                            stride: float = 0.1,
+                            hash_func: str = 'ahash',
+                            order: str = 'rgb'):
+        """
+        Crop resistant hash: hashes of overlapping regions of the image, from the whole image down to windows of 60% of it.
+        Images that were cropped or letterboxed still share regions with the original, match them with CropResistantIndex.
+        The image is converted to grayscale and downscaled only once for all the regions.
+        Params:
+            image      - must be a PIL instance image or numpy array in RGB or opencv image in BGR, an image file path or encoded image bytes
+            hash_size  - (integer) hash size of the regions, default 8 for 64 bit hashes
+            scales     - sizes of the regions relative to the image
+            stride     - offset between the regions of a scale, relative to the image
+            hash_func  - (string) hashing algorithm of the regions, 'ahash', 'dhash' or 'phash'. Default: ahash
+            order      - (string) RGB, BGR: input order of the colors BGR/RGB. Deafult order: RGB
+        Returns:
+            <MultiHash> object. To get the hash value simply use - str(<MultiHash>)
+        """
+        image = bh.load_image(image, order, (CROP_RESISTANT_BASE_SIZE, CROP_RESISTANT_BASE_SIZE))
+        return crop_resistant_hash(image, hash_size, scales, stride, hash_func)
+
+    def hash_frames(self,
+                    file_name: str,
+                    interval: float = 1.0,
+                    algorithm: str = 'phash',
+                    min_change: int = 4,
+                    hash_size: int = 8):
+        """
+        Fingerprint a video (any format opencv reads) or a multi-frame image (animated GIF, multi-page TIFF...) as the
+        sequence of the hashes of its frames. A frame is sampled every 'interval' seconds. Videos seek from one sample
+        to the next when they are 25 frames or more apart, which only decodes the frames from the previous key frame,
+        closer samples decode every frame (without converting the skipped ones). A sampled frame whose dhash is within min_change bits of the last kept frame
+        (a static scene) is dropped. Compare two signatures with Similarity.sequence_similarity.
+        Params:
+            file_name  - (string) path of the video or image file
+            interval   - (float) seconds between two sampled frames, 0 samples every frame. Default: 1 second
+            algorithm  - (string) hash of the kept frames, 'ahash', 'dhash', 'phash', 'whash'... Default: phash
+            min_change - (integer) minimum dhash distance to the last kept frame to keep a frame, 0 keeps every sampled frame
+            hash_size  - (integer) default 8 for 64 bit hashes
+        Returns:
+            <FrameSignature> object. To get the signature simply use - str(<FrameSignature>)
+        """
+        return hash_frames(file_name, interval, algorithm, min_change, hash_size)
+
+    def fingerprint(self,
+                    image,
+                    algorithms: [str] = ('ahash', 'dhash', 'dhash_vertical', 'phash', 'whash_fast'),
+                    hash_size=8,
+                    highfreq_factor=4,
+                    image_scale=None,
+                    mode='haar',
+                    remove_max_haar_ll=True,
+                    max_scale_factor=16,
+                    order: str = 'rgb'):
+        """
+        Compute several hashes of an image at once. The image is converted to grayscale and downscaled only once,
+        every hash is derived from the smallest downscaled image it needs. A hash may hence differ by a bit or two from
+        the hash computed by its own method.
+        Params:
+            image      - must be a PIL instance image or numpy array in RGB or opencv image in BGR, an image file path or encoded image bytes
+            algorithms - list of hashes to compute: 'ahash', 'dhash', 'dhash_vertical', 'phash', 'phash_simple',
+                         'phash_canonical', 'whash', 'whash_fast'
+            hash_size, highfreq_factor, image_scale, mode, remove_max_haar_ll, max_scale_factor - see the individual hashing methods
+            order      - (string) RGB, BGR: input order of the colors BGR/RGB. Deafult order: RGB
+        Returns:
+            dict of algorithm name -> <ImageHash> object
+        """
+        target_size = partial(fingerprint_input_size, algorithms, hash_size=hash_size,
+                              highfreq_factor=highfreq_factor, image_scale=image_scale,
+                              max_scale_factor=max_scale_factor)
+        image = bh.load_image(image, order, target_size)
+        return fingerprint(image, algorithms, hash_size, highfreq_factor,
+                           image_scale, mode, remove_max_haar_ll, max_scale_factor)
+
+    def hash_many(self,
+                  images_or_paths,
+                  algorithm: str = 'phash',
+                  workers: int = None,
+                  chunksize: int = 8,
+                  order: str = 'rgb',
+                  **params):
+        """
+        Hash many images at once, reading and hashing them across a pool of worker processes
+        Params:
+            images_or_paths - iterable of PIL images, numpy arrays, opencv images or image file paths
+            algorithm  - (string) 'ahash', 'dhash', 'dhash_vertical', 'phash', 'phash_simple', 'phash_canonical' or 'whash'. Default: phash
+            workers    - (integer) number of worker processes, defaults to the number of cpus. 0 or 1 hashes in the calling process
+            chunksize  - (integer) number of images handed to a worker process at a time
+            order      - (string) RGB, BGR: input order of the colors of in-memory images. Image files are always read as BGR
+            params     - keyword arguments of the algorithm, e.g. hash_size=16
+        Returns:
+            list of <ImageHash> objects in the input order. An image that could not be read or hashed is returned
+            as the Exception instance raised for it, the rest of the batch is unaffected.
+            With a cache, files whose hash is cached (and unchanged since) are not read again
+        """
+        return bh.hash_many(images_or_paths, algorithm, workers, chunksize,
+                            order, self.cache, **params)
+
+    def iter_hash_directory(self,
+                            root: str,
+                            pattern: str = '*',
+                            algorithms: [str] = ('phash', ),
+                            prefetch: int = 16,
+                            workers: int = None,
+                            io_workers: int = 4,
+                            recursive: bool = True,
+                            **params):
+        """
+        Lazily hash the image files of a directory tree. The tree is walked lazily, files are read on a small pool of
+        threads while they are decoded and hashed on a pool of worker processes, so disk reads and hashing overlap.
+        At most 'prefetch' files are held in memory at any time, however big the tree is.
+        Every file is decoded once for all the algorithms.
+        Params:
+            root       - (string) directory to walk
+            pattern    - (string) glob pattern the file names must match, e.g. '*.jpg'. Default: all files
+            algorithms - list of hashes to compute: 'ahash', 'dhash', 'dhash_vertical', 'phash', 'phash_simple', 'whash'
+            prefetch   - (integer) maximum number of files being read or hashed at a time
+            workers    - (integer) number of worker processes, defaults to the number of cpus. 0 or 1 hashes in the reading threads
+            io_workers - (integer) number of threads reading the files
+            recursive  - (bool) walk the sub directories too
+            params     - keyword arguments of the algorithms, e.g. hash_size=16. Each algorithm gets the ones it accepts
+        Yields:
+            (path, hashes) as soon as a file is hashed (not in walk order). hashes is a dict of algorithm name -> <ImageHash>,
+            or the Exception instance raised if the file could not be read or hashed
+        """
+        return sh.iter_hash_directory(root, pattern, algorithms, prefetch, workers,
+                                      io_workers, recursive, self.cache, **params)
+
+    def iter_hash_archive(self,
+                          archive,
+                          pattern: str = '*',
+                          algorithms: [str] = ('phash', ),
+                          prefetch: int = 16,
+                          workers: int = None,
+                          **params):
+        """
+        Lazily hash the image files of a zip or tar archive (tar.gz, tar.bz2, tar.xz...) without extracting it.
+        The members are read in the order they are stored, decoded from memory and hashed on a pool of worker
+        processes while the next members are read. At most 'prefetch' members are held in memory at any time,
+        so archives of any size are hashed with a constant memory footprint and without temporary files.
+        Params:
+            archive    - path or binary file object of the archive. tar archives are read as a stream and may come
+                         from a non seekable file object (a pipe, a network stream), zip archives must be seekable
+            pattern    - (string) glob pattern the names of the members must match, e.g. '*.jpg'. Default: all files
+            algorithms - list of hashes to compute: 'ahash', 'dhash', 'dhash_vertical', 'phash', 'phash_simple', 'whash'
+            prefetch   - (integer) maximum number of members being hashed at a time
+            workers    - (integer) number of worker processes, defaults to the number of cpus. 0 or 1 hashes in a thread
+            params     - keyword arguments of the algorithms, e.g. hash_size=16. Each algorithm gets the ones it accepts
+        Yields:
+            (member name, hashes) as soon as a member is hashed (not in archive order). hashes is a dict of
+            algorithm name -> <ImageHash>, or the Exception instance raised if the member could not be decoded or hashed
+        """
+        return sh.iter_hash_archive(archive, pattern, algorithms, prefetch, workers, **params)
+
+    def save_hashes(self, file_name: str, hashes, algorithm: str, hash_size: int = 8):
+        """
+        Save a set of hashes to a binary hash file: a 64 byte header (algorithm, hash_size, bits and count) followed
+        by the hashes packed back to back, see hash_io for the format
+        Params:
+            file_name  - path of the file
+            hashes     - list of <ImageHash> / <PackedImageHash> objects, list of hex strings or a numpy.array
+                         of uint8 of packed hashes (see hash_io.hashes_to_packed), all of hash_size x hash_size bits
+            algorithm  - (string) name of the hashing algorithm, recorded in the header
+            hash_size  - (integer) hash_size the hashes were computed with
+        """
+        bits = hash_size * hash_size
+        if not isinstance(hashes, np.ndarray):
+            hashes = list(hashes)
+            if all(isinstance(image_hash, str) for image_hash in hashes):
+                hashes = hash_io.hex_to_packed(hashes, bits)
+            elif hashes:
+                hashes = hash_io.hashes_to_packed(hashes)
+            else:
+                hashes = np.zeros((0, hash_io.row_bytes(bits)), dtype=np.uint8)
+        hash_io.save_hashes(file_name, hashes, algorithm, hash_size, bits)
+
+    def load_hashes(self, file_name: str, mmap: bool = True, as_hashes: bool = False):
+        """
+        Load a binary hash file written by save_hashes
+        Params:
+            file_name  - path of the file
+            mmap       - (bool) memory map the file rather than reading it into memory
+            as_hashes  - (bool) return a list of <ImageHash> objects rather than the packed array
+        Returns:
+            (header, hashes) where header is a dict with the keys 'algorithm', 'hash_size', 'bits' and 'count', and
+            hashes a numpy.array of uint8 of shape (count, ceil(bits / 8)), one packed hash per row
+            (see hash_io.packed_to_uint64 to view it as 64 bit words), or the list of <ImageHash> objects
+        """
+        header, packed = hash_io.load_hashes(file_name, mmap)
+        if as_hashes:
+            shape = (header['hash_size'], ) * 2
+            if header['bits'] != header['hash_size'] * header['hash_size']:
+                shape = (header['bits'], )
+            return header, hash_io.packed_to_hashes(packed, shape)
+        return header, packed
@@ -0,0 +1,232 @@
+""" Streaming hashing of images read from a directory tree, overlapping disk reads with hashing """
+import fnmatch
+import functools
+import inspect
+import os
+import queue
+import tarfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from imagewizard.helpers import helpers
+from imagewizard.image_hashing.api.batch_hashing import get_algorithm
+from imagewizard.image_hashing.api.hash_algorithms import hash_input_size
+
+
+def algorithm_params(algorithm: str, params: dict) -> dict:
+    """ the subset of params accepted by the algorithm, so that e.g. highfreq_factor only goes to phash """
+    accepted = inspect.signature(get_algorithm(algorithm)).parameters
+    return {name: value for name, value in params.items() if name in accepted}
+
+
+def hash_buffer(buffer, algorithms: [str], params: dict) -> dict:
+    """
+    decode an encoded image (bytes of an image file) once, straight to grayscale, and compute every requested hash of it
+    Returns:
+        dict of algorithm name -> <ImageHash> object
+    """
+    # JPEG images are decoded at the least resolution all the algorithms need
+    image = helpers.decode_buffer(buffer, functools.partial(hash_input_size, algorithms, **params), grayscale=True)
+    return {
+        algorithm: get_algorithm(algorithm)(image, **algorithm_params(algorithm, params))
+        for algorithm in algorithms
+    }
+
+
+def _hash_buffer_task(task):
+    """ worker entry point, task is a tuple of (buffer, algorithms, params), exceptions are returned """
+    try:
+        return hash_buffer(*task)
+    except Exception as inst:
+        return inst
+
+
+def read_file(file_name: str) -> bytes:
+    """ read the whole content of a file """
+    with open(file_name, 'rb') as file:
+        return file.read()
+
+
+def walk_files(root: str, pattern: str = '*', recursive: bool = True):
+    """ lazily yield the paths of the files under root whose name matches the (glob) pattern """
+    for directory, sub_directories, file_names in os.walk(root):
+        sub_directories.sort()
+        for file_name in sorted(fnmatch.filter(file_names, pattern)):
+            yield os.path.join(directory, file_name)
+        if not recursive:
+            return
+
+
+def iter_hash_sources(sources,
+                      algorithms: [str] = ('phash', ),
+                      workers: int = None,
+                      io_workers: int = 4,
+                      prefetch: int = 16,
+                      **params):
+    """
+    Hash a stream of encoded images, yielding the results as they complete (not in input order).
+    Every source is read on a pool of io_workers threads and then decoded and hashed on a pool of worker processes.
+    At most prefetch sources are read or hashed at any time, which bounds the memory however long the stream is.
+    Params:
+        sources    - iterable of (key, source) where source is either the encoded image (bytes), a file path to read
+                     or a dict of already known hashes, which is passed through
+        algorithms - list of hashing algorithm names, see HASH_ALGORITHMS
+        workers    - (integer) number of worker processes, defaults to the number of cpus. 0 or 1 hashes in the io threads
+        io_workers - (integer) number of threads reading the sources
+        prefetch   - (integer) maximum number of sources in flight
+        params     - keyword arguments of the algorithms, each algorithm gets the ones it accepts
+    Yields:
+        (key, hashes) where hashes is a dict of algorithm name -> <ImageHash> object,
+        or the Exception instance raised while reading or hashing the source
+    """
+    algorithms = [algorithm.lower() for algorithm in algorithms]
+    for algorithm in algorithms:
+        get_algorithm(algorithm)
+    if prefetch < 1:
+        raise ValueError('prefetch: {} must be an integer >= 1'.format(prefetch))
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    results = queue.Queue()
+    hash_pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    if hash_pool is not None:
+        # the first submit starts the worker processes: do it from this thread, before the io threads run,
+        # since forking a process while other threads hold locks can deadlock the workers
+        hash_pool.submit(int)
+
+    def read_and_hash(key, source):
+        """ runs in an io thread: read the source and hand it over to the hash pool """
+        try:
+            buffer = read_file(source) if helpers.is_path(source) else source
+            task = (buffer, algorithms, params)
+            if hash_pool is None:
+                results.put((key, _hash_buffer_task(task)))
+            else:
+                # a failure of the pool itself (e.g. a killed worker) is reported as the item's result too
+                future = hash_pool.submit(_hash_buffer_task, task)
+                future.add_done_callback(lambda done: results.put((key, done.exception() or done.result())))
+        except Exception as inst:
+            # every source must put a result, which the consumer waits for
+            results.put((key, inst))
+
+    in_flight = 0
+    try:
+        with ThreadPoolExecutor(max_workers=max(io_workers, 1)) as read_pool:
+            for key, source in sources:
+                if in_flight >= prefetch:
+                    yield results.get()
+                    in_flight -= 1
+                if isinstance(source, dict):
+                    results.put((key, source))
+                else:
+                    read_pool.submit(read_and_hash, key, source)
+                in_flight += 1
+            while in_flight:
+                yield results.get()
+                in_flight -= 1
+    finally:
+        if hash_pool is not None:
+            hash_pool.shutdown(wait=True)
+
+
+def iter_hash_directory(root: str,
+                        pattern: str = '*',
+                        algorithms: [str] = ('phash', ),
+                        prefetch: int = 16,
+                        workers: int = None,
+                        io_workers: int = 4,
+                        recursive: bool = True,
+                        cache=None,
+                        **params):
+    """
+    Hash the image files of a directory tree, see Hashing.iter_hash_directory
+    cache is an optional HashCache, files whose hashes are all cached are not read again
+    """
+    algorithms = [algorithm.lower() for algorithm in algorithms]
+
+    def sources():
+        for file_name in walk_files(root, pattern, recursive):
+            yield file_name, file_name
+
+    if cache is None:
+        yield from iter_hash_sources(sources(), algorithms, workers, io_workers, prefetch, **params)
+        return
+
+    from_cache = set()
+    # stamps of the files to hash, taken before they are read, see HashCache.stamp
+    stamps = {}
+
+    def cached_sources():
+        """ files whose hashes are all cached are passed on as their hashes and not read """
+        for file_name, source in sources():
+            hashes = {
+                algorithm: cache.get(file_name, algorithm, algorithm_params(algorithm, params))
+                for algorithm in algorithms
+            }
+            if all(image_hash is not None for image_hash in hashes.values()):
+                from_cache.add(file_name)
+                source = hashes
+            else:
+                try:
+                    stamps[file_name] = cache.stamp(file_name)
+                except OSError:
+                    pass
+            yield file_name, source
+
+    for file_name, hashes in iter_hash_sources(cached_sources(), algorithms, workers, io_workers,
+                                               prefetch, **params):
+        stamp = stamps.pop(file_name, None)
+        if file_name in from_cache:
+            from_cache.discard(file_name)
+        elif stamp is not None and not isinstance(hashes, Exception):
+            for algorithm, image_hash in hashes.items():
+                cache.put(file_name, image_hash, algorithm, algorithm_params(algorithm, params), stamp)
+        yield file_name, hashes
+
+
+def iter_archive_members(archive, pattern: str = '*'):
+    """
+    lazily yield (member name, content) of the regular files of a zip or tar archive, in the order they are stored
+    and without extracting them. tar archives (compressed or not) are read as a stream, so archive may be a
+    non seekable file object (a pipe, a network stream), zip archives need a seekable file.
+    Only one member is held in memory at a time.
+    Params:
+        archive    - path or binary file object of the archive
+        pattern    - (string) glob pattern the (base) names of the members must match
+    """
+    is_path = helpers.is_path(archive)
+    start = None if is_path or not archive.seekable() else archive.tell()
+    if zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive if is_path else _rewind(archive, start)) as zip_file:
+            # the order of the local headers is the order of the data in the archive
+            for info in sorted(zip_file.infolist(), key=lambda info: info.header_offset):
+                if not info.is_dir() and fnmatch.fnmatch(os.path.basename(info.filename), pattern):
+                    yield info.filename, zip_file.read(info)
+        return
+
+    if is_path:
+        tar_file = tarfile.open(archive, mode='r|*')
+    else:
+        tar_file = tarfile.open(fileobj=_rewind(archive, start), mode='r|*')
+    with tar_file:
+        for member in tar_file:
+            if member.isfile() and fnmatch.fnmatch(os.path.basename(member.name), pattern):
+                yield member.name, tar_file.extractfile(member).read()
+
+
+def _rewind(file, position):
+    """ seek a file object back to position (if any), e.g. after zipfile.is_zipfile read from it """
+    if position is not None:
+        file.seek(position)
+    return file
+
+
+def iter_hash_archive(archive,
+                      pattern: str = '*',
+                      algorithms: [str] = ('phash', ),
+                      prefetch: int = 16,
+                      workers: int = None,
+                      **params):
+    """
+    Hash the image files of a zip or tar archive without extracting it, see Hashing.iter_hash_archive
+    """
+    yield from iter_hash_sources(iter_archive_members(archive, pattern), algorithms, workers, 1, prefetch, **params)
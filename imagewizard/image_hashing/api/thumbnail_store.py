@@ -0,0 +1,205 @@
+""" Store of small canonical grayscale thumbnails, to compute new hashes of a corpus without decoding its images again """
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy
+from imagewizard.helpers import helpers
+from imagewizard.image_hashing.api.batch_hashing import get_algorithm, load_image
+from imagewizard.image_hashing.api.hash_algorithms import ImageHash, hash_input_size, phash_stack, reduce_image, whash_stack
+
+# number of chunks (chunksize images) per worker decoded before their thumbnails are written
+ADD_CHUNKS_PER_WORKER = 4
+
+
+def make_thumbnail(image, size: int = 128, order: str = 'rgb') -> numpy.ndarray:
+    """
+    canonical thumbnail of an image: grayscale, size x size pixels (the aspect ratio is not kept, as by every hash)
+    image may be anything Hashing accepts: a PIL image, a numpy array, an image file path or encoded image bytes
+    """
+    return reduce_image(load_image(image, order, (size, size)), (size, size))
+
+
+def _thumbnail_task(task):
+    """ worker entry point, task is a tuple of (image, size, order), exceptions are returned """
+    try:
+        return make_thumbnail(*task)
+    except Exception as inst:
+        return inst
+
+
+class ThumbnailStore():
+    """
+    Append only store of canonical grayscale thumbnails (size x size uint8 pixels) of images, keyed by a string
+    (e.g. the path of the image). The thumbnails are stored back to back in a single raw file which is memory mapped,
+    so that any hash of the whole corpus can be computed again, with new parameters (hash_size, highfreq_factor,
+    mode...), from the thumbnails alone: without reading or decoding a single original image.
+    The store is a directory holding:
+        store.json      - {"size": <thumbnail size>}
+        thumbnails.u8   - the pixels of the thumbnails, N x size x size bytes, readable with numpy.memmap
+        keys.jsonl      - the keys of the thumbnails, one JSON string per line, in the same order
+    Hashes computed from a thumbnail may differ from the hashes of the full image by a bit or two, and the default
+    image_scale of whash is at most size.
+    """
+    def __init__(self, path: str, size: int = 128):
+        """
+        Params:
+            path       - directory of the store, created if it does not exist
+            size       - (integer) width and height of the thumbnails in pixels, must be at least the image size the
+                         hashes resize to: 128 covers phash up to hash_size 32 (highfreq_factor 4) and whash up to 128
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        meta_file = os.path.join(path, 'store.json')
+        if os.path.exists(meta_file):
+            with open(meta_file) as meta:
+                stored_size = json.load(meta)['size']
+            if stored_size != size:
+                raise ValueError('the thumbnails of the store {} are {} pixels, not {}'.format(path, stored_size, size))
+        else:
+            with open(meta_file, 'w') as meta:
+                json.dump({'size': size}, meta)
+        self.size = size
+        self._pixels_file = os.path.join(path, 'thumbnails.u8')
+        self._keys_file = os.path.join(path, 'keys.jsonl')
+        self.keys = []
+        if os.path.exists(self._keys_file):
+            with open(self._keys_file) as keys:
+                self.keys = [json.loads(line) for line in keys if line.endswith('\n')]
+        # an interrupted write may leave a partial thumbnail or key, only complete pairs are kept
+        count = min(len(self.keys), self._stored_count())
+        if count != len(self.keys) or count != self._stored_count():
+            self.keys = self.keys[:count]
+            self._truncate(count)
+
+    def _stored_count(self) -> int:
+        if not os.path.exists(self._pixels_file):
+            return 0
+        return os.path.getsize(self._pixels_file) // (self.size * self.size)
+
+    def _truncate(self, count: int):
+        with open(self._pixels_file, 'ab') as pixels:
+            pixels.truncate(count * self.size * self.size)
+        with open(self._keys_file, 'w') as keys:
+            keys.writelines(json.dumps(key) + '\n' for key in self.keys)
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def pixels(self) -> numpy.ndarray:
+        """ read only memory mapped numpy array of shape (N, size, size) of the thumbnails """
+        if not self.keys:
+            return numpy.empty((0, self.size, self.size), dtype=numpy.uint8)
+        return numpy.memmap(self._pixels_file, dtype=numpy.uint8, mode='r',
+                            shape=(len(self.keys), self.size, self.size))
+
+    def add_many(self, images_or_paths, keys: [str] = None, order: str = 'rgb', workers: int = None,
+                 chunksize: int = 8) -> list:
+        """
+        Decode, thumbnail and append many images, across a pool of worker processes. The images are consumed and
+        their thumbnails written a chunk at a time, so that the memory used does not grow with the number of images
+        Params:
+            images_or_paths - iterable of PIL images, numpy arrays, opencv images, image file paths or encoded images
+            keys       - iterable of the keys of the images, by default the file paths (or the index in the store)
+            order      - (string) RGB, BGR: input order of the colors of in-memory images
+            workers    - (integer) number of worker processes, defaults to the number of cpus. 0 or 1 in the calling process
+            chunksize  - (integer) number of images handed to a worker process at a time
+        Returns:
+            list of the indices of the thumbnails in the store, in the input order. An image that could not be read
+            is returned as the Exception instance raised for it and not stored
+        """
+        if keys is not None and hasattr(keys, '__len__') and hasattr(images_or_paths, '__len__') and \
+                len(keys) != len(images_or_paths):
+            raise ValueError('keys must have one key per image')
+        if workers is None:
+            workers = os.cpu_count() or 1
+        first = len(self.keys)
+
+        def keyed_items():
+            missing = object()
+            items = enumerate(images_or_paths)
+            if keys is not None:
+                items = itertools.zip_longest(items, keys, fillvalue=missing)
+            else:
+                items = ((item, None) for item in items)
+            for index_item, key in items:
+                if index_item is missing or key is missing:
+                    raise ValueError('keys must have one key per image')
+                index, item = index_item
+                if keys is None:
+                    key = helpers.fspath(item) if helpers.is_path(item) else str(first + index)
+                yield key, item
+
+        results = []
+        executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        try:
+            with open(self._pixels_file, 'ab') as pixels, open(self._keys_file, 'a') as key_lines:
+                keyed = keyed_items()
+                while True:
+                    chunk = list(itertools.islice(keyed, max(workers, 1) * chunksize * ADD_CHUNKS_PER_WORKER))
+                    if not chunk:
+                        break
+                    tasks = ((item, self.size, order) for _, item in chunk)
+                    if executor is None:
+                        thumbnails = map(_thumbnail_task, tasks)
+                    else:
+                        thumbnails = executor.map(_thumbnail_task, tasks, chunksize=chunksize)
+                    for (key, _), thumbnail in zip(chunk, thumbnails):
+                        if isinstance(thumbnail, Exception):
+                            results.append(thumbnail)
+                            continue
+                        pixels.write(numpy.ascontiguousarray(thumbnail, dtype=numpy.uint8).tobytes())
+                        key_lines.write(json.dumps(key) + '\n')
+                        results.append(len(self.keys))
+                        self.keys.append(key)
+                    # the thumbnails of a chunk are stored before the next chunk is decoded
+                    pixels.flush()
+                    key_lines.flush()
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+        return results
+
+    def add(self, key: str, image, order: str = 'rgb') -> int:
+        """ thumbnail and append an image, returns its index in the store """
+        result = self.add_many([image], [key], order, workers=1)[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def hash(self, algorithm: str = 'phash', batch_size: int = 4096, **params) -> list:
+        """
+        Hash every thumbnail of the store, see HASH_ALGORITHMS. phash and whash are computed on whole batches
+        of thumbnails at once (see phash_stack and whash_stack), the other hashes thumbnail by thumbnail.
+        Params:
+            algorithm  - (string) 'ahash', 'dhash', 'dhash_vertical', 'phash', 'phash_simple', 'phash_canonical' or 'whash'
+            batch_size - (integer) number of thumbnails read from the store at a time
+            params     - keyword arguments of the algorithm, e.g. hash_size=16
+        Returns:
+            list of <ImageHash> objects, in the order of the store
+        """
+        function = get_algorithm(algorithm)
+        algorithm = algorithm.lower()
+        hash_size = params.get('hash_size', 8)
+        # (width, height) the algorithm resizes the thumbnails to
+        width, height = hash_input_size(algorithm, (self.size, self.size), **params)
+        if max(width, height) > self.size:
+            raise ValueError('{} with {} needs images of at least {} pixels, the thumbnails are {}'.format(
+                algorithm, params, max(width, height), self.size))
+        stacked = algorithm == 'phash' or (algorithm == 'whash' and params.get('remove_max_haar_ll', True))
+
+        pixels, hashes = self.pixels, []
+        for start in range(0, len(pixels), batch_size):
+            batch = pixels[start:start + batch_size]
+            if not stacked:
+                hashes.extend(function(numpy.asarray(thumbnail), **params) for thumbnail in batch)
+                continue
+            if width != self.size:
+                batch = numpy.stack([reduce_image(numpy.asarray(thumbnail), (width, height)) for thumbnail in batch])
+            if algorithm == 'phash':
+                bits = phash_stack(batch, hash_size)
+            else:
+                bits = whash_stack(batch, hash_size, params.get('mode', 'haar'))
+            hashes.extend(ImageHash(image_bits) for image_bits in bits)
+        return hashes
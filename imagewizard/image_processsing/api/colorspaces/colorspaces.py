@@ -13,7 +13,7 @@ def img2grayscale(img,
                   order: str = 'rgb'):
     """ BGR/RGB to Grayscale conversion
         Params:
-            img: (numpy.array, PIL.image, cv2.image)
+            img: (numpy.array, PIL.image, cv2.image, encoded image bytes)
             thresholding_options: binary, zero, trunc, inverted binary, inverted zero
             order: (RGB, BGR) input order of the colors BGR/RGB. Deafult order: RGB
                 Note: The output will be a numpy.array of the same order
@@ -59,7 +59,7 @@ def img2grayscale(img,
 def luminosity(img, intensity_shift: int, order: str = 'rgb'):
     """ Increase/decrease the brightness of the image
         Params:
-            img: (numpy.array, PIL.image, cv2.image)
+            img: (numpy.array, PIL.image, cv2.image, encoded image bytes)
             intensity_shift: decrease or increase the brightness level
             order: (RGB, BGR) input order of the colors BGR/RGB. Deafult order: RGB
                 Note: The output will be a numpy.array of the same order
@@ -104,7 +104,7 @@ def luminosity(img, intensity_shift: int, order: str = 'rgb'):
 def image_segmentation(image, rgb_list, order: str = 'rgb'):
     """ reconstruct an image with only a specified list of colors
         Params:
-            img: (numpy.array, PIL.image, cv2.image)
+            img: (numpy.array, PIL.image, cv2.image, encoded image bytes)
             rgb_list: colors list - a 2 dimensional np array with shape (n,3) 3 being the channel values in order RGB, eg: [[224, 166, 147], [110, 34, 71], [195, 98, 100]]
             order: (RGB, BGR) input order of the colors BGR/RGB. Deafult order: RGB
                 Note: The output will be a numpy.array of the same order
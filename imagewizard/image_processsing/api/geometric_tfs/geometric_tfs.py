@@ -12,7 +12,7 @@ def resize(img,
            order: str = 'rgb'):
     """ Resize (scale or shrink) image to specified dimensions
         Params:
-            img: (numpy.array, PIL.image, cv2.image)
+            img: (numpy.array, PIL.image, cv2.image, image file path, encoded image bytes) JPEG images are decoded at a reduced resolution when the transformed image is small enough
             interpolation_method: (s, z) s/shrink or z/zoom; default to shrink
             resize_percentage: (0, 100) floating value. to resize image by the specified percentage            
             resize_width, resize_height: (in pixels) if unspecified, defaults to 50% of original img width & height. If either only width or height is specified, the other dimension is scale to keep the aspect ratio intact.
@@ -22,11 +22,6 @@ def resize(img,
         Returns:
             numpy.array of the order specified
     """
-    # img object passed is converted to a BGR array
-    # and all the operations are performed. The image will be converted
-    # back to specified order and returned as numpy.array
-    img = helpers.image2BGR(img, order)
-
     interpolation_method = 's'
     # set the size of image along with interploation methods
     # cv2.INTER_AREA is used for shrinking, whereas cv2.INTER_LINEAR
@@ -36,23 +31,37 @@ def resize(img,
     elif interpolation_method in ['zoom', 'z']:
         interpolation = cv.INTER_LINEAR
 
-    # get number of pixel horizontally and vertically
-    (height, width) = img.shape[:2]
-
-    # set width and height pixels of transformed image
-    if resize_percentage is not None:
-        ratio = resize_percentage / 100     
-        dim = (int(width * ratio), int(height * ratio))
-    elif resize_width is None and resize_height is not None:
-        ratio = resize_height / img.shape[0]
-        dim = (int(img.shape[1] * ratio), resize_height)
-    elif resize_height is None and resize_width is not None:
-        ratio = resize_width / img.shape[1]
-        dim = (resize_width, int(img.shape[0] * ratio))
-    elif resize_height is not None and resize_width is not None:
-        dim = (resize_width, resize_height)
+    def target_size(size):
+        """ (width, height) of the transformed image given the (width, height) of the image """
+        (width, height) = size
+        if resize_percentage is not None:
+            ratio = resize_percentage / 100
+            return (int(width * ratio), int(height * ratio))
+        elif resize_width is None and resize_height is not None:
+            ratio = resize_height / height
+            return (int(width * ratio), resize_height)
+        elif resize_height is None and resize_width is not None:
+            ratio = resize_width / width
+            return (resize_width, int(height * ratio))
+        elif resize_height is not None and resize_width is not None:
+            return (resize_width, resize_height)
+        return (int(width / 2), int(height / 2))
+
+    if helpers.is_path(img) or helpers.is_buffer(img):
+        # image files and encoded images are read as BGR arrays, JPEG images at the least
+        # resolution from which the transformed image can be shrunk, see helpers.imread_scaled
+        source, info = img, helpers.image_file_info(img)
+        img = helpers.imread_scaled(source, target_size)
+        if img is None:
+            raise ValueError('unable to read image {}'.format('buffer' if helpers.is_buffer(source) else source))
+        # the size of the transformed image is relative to the original image, not to the decoded one
+        dim = target_size(info[1] if info is not None else img.shape[1::-1])
     else:
-        dim = (int(width / 2), int(height / 2))
+        # img object passed is converted to a BGR array
+        # and all the operations are performed. The image will be converted
+        # back to specified order and returned as numpy.array
+        img = helpers.image2BGR(img, order)
+        dim = target_size(img.shape[1::-1])
 
     res_img = cv.resize(img, dim, interpolation=interpolation)
     return helpers.format_output_order_input_BGR(res_img, order)
@@ -64,7 +73,7 @@ def rotate(img,
            order: str = 'rgb'):
     """ Rotate image by specified degrees anti-clockwise
         Params:
-            img: (numpy.array, PIL.image, cv2.image)
+            img: (numpy.array, PIL.image, cv2.image, encoded image bytes)
             rotation_degree: rotation angle (in degrees)
             scaling_factor: 1.0 to maintain the original scale of the image. 0.5 to halve the size of the image, to double the size of the image, use 2.0.
             order: (RGB, BGR) input order of the colors BGR/RGB. Deafult order: RGB
@@ -99,7 +108,7 @@ def crop(img,
          order: str = 'rgb'):
     """ Crop the image to specified pixel coordinates
         Params:
-            img: (numpy.array, PIL.image, cv2.image)
+            img: (numpy.array, PIL.image, cv2.image, encoded image bytes)
             start_x: starting pixel coordinate along the x-axis/width of the image
             end_x: ending pixel coordinate along the x-axis/width of the image
             start_y: starting pixle coordinate along the y-axis/height of the image
@@ -163,7 +172,7 @@ def crop(img,
 def mirror(img, flip_code: int, order: str):
     """ Mirror the image
         Params:
-            img: (numpy.array, PIL.image, cv2.image)
+            img: (numpy.array, PIL.image, cv2.image, encoded image bytes)
             flip_code:  = 0 for flipping the image around the y-axis (vertical flipping);
                         > 0 for flipping around the x-axis (horizontal flipping);
                         < 0 for flipping around both axes
@@ -190,7 +199,7 @@ def skew_affine(img,
                 order: str = 'rgb'):
     """ skew image by applying affine transformation
         Params:
-            img: (numpy.array, PIL.image, cv2.image)
+            img: (numpy.array, PIL.image, cv2.image, encoded image bytes)
             input_points: three points on input image, ex: np.float32([[50,50],[200,50],[50,200]])
             output_points: three points on output location correspoinding to input_points' to be transformed, np.float32([[10,100],[200,50],[100,250]])
             order: (RGB, BGR) input order of the colors BGR/RGB. Deafult order: RGB
@@ -22,7 +22,7 @@ class Processing():
                order: str = 'rgb'):
         """ Resize (scale or shrink) image to specified dimensions
             Params:
-                img: (numpy.array, PIL.image, cv2.image)
+                img: (numpy.array, PIL.image, cv2.image, image file path, encoded image bytes) JPEG images are decoded at a reduced resolution when the transformed image is small enough
                 interpolation_method: (s, z) s/shrink or z/zoom; default to shrink
                 resize_percentage: (0, 100) floating value. to resize image by the specified percentage            
                 resize_width, resize_height: (in pixels) if unspecified, defaults to 50% of original img width & height. If either only width or height is specified, the other dimension is scale to keep the aspect ratio intact.
@@ -45,7 +45,7 @@ class Processing():
                       order: str = 'rgb'):
         """ BGR/RGB to Grayscale conversion
             Params:
-                img: (numpy.array, PIL.image, cv2.image)
+                img: (numpy.array, PIL.image, cv2.image, encoded image bytes)
                 thresholding_options: binary, zero, trunc, inverted binary, inverted zero
                 order: (RGB, BGR) input order of the colors BGR/RGB. Deafult order: RGB
                     Note: The output will be a numpy.array of the same order
@@ -62,7 +62,7 @@ class Processing():
                order: str = 'rgb'):
         """ Rotate image by specified degrees anti-clockwise
             Params:
-                img: (numpy.array, PIL.image, cv2.image)
+                img: (numpy.array, PIL.image, cv2.image, encoded image bytes)
                 rotation_degree: rotation angle (in degrees)
                 scaling_factor: 1.0 to maintain the original scale of the image. 0.5 to halve the size of the image, to double the size of the image, use 2.0.
                 order: (RGB, BGR) input order of the colors BGR/RGB. Deafult order: RGB
@@ -82,7 +82,7 @@ class Processing():
              order: str = 'rgb'):
         """ Crop the image to specified pixel coordinates
             Params:
-                img: (numpy.array, PIL.image, cv2.image)
+                img: (numpy.array, PIL.image, cv2.image, encoded image bytes)
                 start_x: starting pixel coordinate along the x-axis/width of the image
                 end_x: ending pixel coordinate along the x-axis/width of the image
                 start_y: starting pixle coordinate along the y-axis/height of the image
@@ -99,7 +99,7 @@ class Processing():
     def mirror(self, img, flip_code: int = 0, order: str = 'rgb'):
         """ Mirror the image
             Params:
-                img: (numpy.array, PIL.image, cv2.image)
+                img: (numpy.array, PIL.image, cv2.image, encoded image bytes)
                 flip_code:  = 0 for flipping the image around the y-axis (vertical flipping);
                             > 0 for flipping around the x-axis (horizontal flipping);
                             < 0 for flipping around both axes
@@ -113,7 +113,7 @@ class Processing():
     def blur(self, img, blur_level: int = 5, order: str = 'rgb'):
         """ Averaging blur by convolving the image with a normalized box filter of kernel_size
             Params:
-                img: (numpy.array, PIL.image, cv2.image)
+                img: (numpy.array, PIL.image, cv2.image, encoded image bytes)
                 blur_level: (int, > 0) intensity of blur
                 order: (RGB, BGR) input order of the colors BGR/RGB. Deafult order: RGB
                     Note: The output will be a numpy.array of the same order
@@ -127,7 +127,7 @@ class Processing():
     def luminosity(self, img, intensity_shift: int = 20, order: str = 'rgb'):
         """ Increase/decrease the brightness of the image
             Params:
-                img: (numpy.array, PIL.image, cv2.image)
+                img: (numpy.array, PIL.image, cv2.image, encoded image bytes)
                 intensity_shift: decrease or increase the brightness level
                 order: (RGB, BGR) input order of the colors BGR/RGB. Deafult order: RGB
                     Note: The output will be a numpy.array of the same order
@@ -143,7 +143,7 @@ class Processing():
                          order: str = 'rgb'):
         """ skew image by applying perspective transformation
             Params:
-                img: (numpy.array, PIL.image, cv2.image)
+                img: (numpy.array, PIL.image, cv2.image, encoded image bytes)
                 input_points: four points on input image, ex: np.float32([[56,65],[368,52],[28,387],[389,390]])
                 output_points: four points on output location correspoinding to input_points' to be transformed, ex: np.float32([[0,0],[300,0],[0,300],[300,300]])
                 order: (RGB, BGR) input order of the colors BGR/RGB. Deafult order: RGB
@@ -161,7 +161,7 @@ class Processing():
                     order: str = 'rgb'):
         """ skew image by applying affine transformation
             Params:
-                img: (numpy.array, PIL.image, cv2.image)
+                img: (numpy.array, PIL.image, cv2.image, encoded image bytes)
                 input_points: three points on input image, ex: np.float32([[50,50],[200,50],[50,200]])
                 output_points: three points on output location correspoinding to input_points' to be transformed, np.float32([[10,100],[200,50],[100,250]])
                 order: (RGB, BGR) input order of the colors BGR/RGB. Deafult order: RGB
@@ -175,7 +175,7 @@ class Processing():
     def segmentation(self, img, rgb_list: [[int]], order: str = 'rgb'):
         """ reconstruct an image with only a specified list of colors
             Params:
-                img: (numpy.array, PIL.image, cv2.image)
+                img: (numpy.array, PIL.image, cv2.image, encoded image bytes)
                 rgb_list: 2 dimensional np array with shape (n,3) 3 being the channel values in order RGB, eg: [[224, 166, 147], [110, 34, 71], [195, 98, 100]]
                 order: (RGB, BGR) input order of the colors BGR/RGB. Deafult order: RGB
                     Note: The output will be a numpy.array of the same order
@@ -4,7 +4,7 @@ from imagewizard.helpers import helpers
 def blur(img, kernel_size: int, order: str):
     """ Averaging blur by convolving the image with a normalized box filter of kernel_size
         Params:
-            img: (numpy.array, PIL.image, cv2.image)
+            img: (numpy.array, PIL.image, cv2.image, encoded image bytes)
             kernel_size(k): (k X k) normalized box filter for blurring
     """
     # img object passed is converted to a BGR array
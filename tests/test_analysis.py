@@ -38,5 +38,14 @@ class TestAnalysis(unittest.TestCase):
     def test_trim(self):
         npt.assert_array_equal(self.trim_actual, self.trim_test, 'trimmed test image does not equal actual result')
 
+    def test_buffer_input(self):
+        # encoded images are decoded as BGR whatever the order
+        with open("data/original_images/lenna.png", 'rb') as image_file:
+            buffer = image_file.read()
+        for image in [buffer, bytearray(buffer), memoryview(buffer)]:
+            with self.subTest(type=type(image).__name__):
+                npt.assert_array_equal(self.mean_actual, self.im_analysis.mean_color(image))
+                npt.assert_array_equal(self.mode_actual, self.im_analysis.frequent_color(image, 'bgr'))
+
     def test_dominant(self):
         npt.assert_array_equal(self.dominant_actual, self.dominant_test, 'dominant colors does not equal actual result')
@@ -1,9 +1,26 @@
 import unittest
+import os
+import shutil
 import sys
+import tempfile
+import threading
+import multiprocessing
+import numpy
+from unittest import mock
 sys.path.append("..")
 import imagewizard
 from PIL import Image
 import cv2 as cv
+from imagewizard.image_hashing.api.hash_algorithms import PackedImageHash, phash, phash_stack
+from imagewizard.image_hashing.api.crop_resistant import MultiHash
+from imagewizard.image_hashing.api.frame_hashing import FrameSignature
+from imagewizard.image_hashing.api import batch_hashing, hash_io, stream_hashing
+from imagewizard.helpers import helpers
+
+
+def _exit_worker(*args):
+    """ stands for a worker process killed while hashing, e.g. out of memory """
+    os._exit(1)
 
 
 class TestHashing(unittest.TestCase):
@@ -76,3 +93,457 @@ class TestHashing(unittest.TestCase):
             with self.subTest():
                 self.assertNotEqual(str(result), incorrect_result,
                                     'output a hash - {}'.format(str(result)))
+
+    def test_hash_many(self):
+        images = ['data/test.png', self.pil_image, 'data/does_not_exist.png']
+        for workers in [1, 2]:
+            results = self.im_hash.hash_many(images,
+                                             algorithm='ahash',
+                                             workers=workers,
+                                             chunksize=1)
+            with self.subTest(workers=workers):
+                self.assertEqual(len(results), len(images))
+                self.assertEqual(str(results[0]), self.a_hash_result[0])
+                self.assertEqual(str(results[1]), self.a_hash_result[0])
+                self.assertIsInstance(results[2], Exception)
+        with self.assertRaises(ValueError):
+            self.im_hash.hash_many(images, algorithm='xhash')
+
+    def test_fingerprint(self):
+        for input_image in self.test_input:
+            result = self.im_hash.fingerprint(image=input_image[0],
+                                              order=input_image[1])
+            expected = {
+                'ahash': self.im_hash.ahash(input_image[0], order=input_image[1]),
+                'dhash': self.im_hash.dhash(input_image[0], order=input_image[1]),
+                'dhash_vertical': self.im_hash.dhash_vertical(input_image[0], order=input_image[1]),
+                'phash': self.im_hash.phash(input_image[0], order=input_image[1]),
+                'whash_fast': self.im_hash.whash_fast(input_image[0], order=input_image[1]),
+            }
+            self.assertEqual(sorted(result), sorted(expected))
+            # 'whash' is computed with whash, which honours remove_max_haar_ll
+            for remove_max_haar_ll in [True, False]:
+                result['whash', remove_max_haar_ll] = self.im_hash.fingerprint(
+                    image=input_image[0], algorithms=['whash'], remove_max_haar_ll=remove_max_haar_ll,
+                    order=input_image[1])['whash']
+                expected['whash', remove_max_haar_ll] = self.im_hash.whash(
+                    input_image[0], remove_max_haar_ll=remove_max_haar_ll, order=input_image[1])
+            for algorithm, value in expected.items():
+                with self.subTest(algorithm=algorithm):
+                    self.assertLessEqual(result[algorithm] - value, 3)
+
+    def test_array_backend(self):
+        # numpy arrays are hashed exactly like the PIL image of the same pixels
+        gray_image = numpy.asarray(self.pil_image.convert('L'))
+        rgba_image = cv.cvtColor(self.cv2_image, cv.COLOR_BGR2RGBA)
+        for algorithm in ['ahash', 'dhash', 'dhash_vertical', 'phash', 'phash_simple', 'whash']:
+            pil_hash = getattr(self.im_hash, algorithm)(self.pil_image)
+            with self.subTest(algorithm=algorithm):
+                self.assertEqual(getattr(self.im_hash, algorithm)(self.cv2_image, order='bgr'), pil_hash)
+                self.assertEqual(getattr(self.im_hash, algorithm)(rgba_image, order='rgb'), pil_hash)
+                self.assertEqual(getattr(self.im_hash, algorithm)(gray_image), pil_hash)
+
+    def test_packed_hash(self):
+        a_hash = self.im_hash.ahash(self.pil_image)
+        p_hash = self.im_hash.phash(self.pil_image)
+        packed = a_hash.pack()
+        self.assertEqual(str(packed), str(a_hash))
+        self.assertEqual(packed.to_image_hash(), a_hash)
+        self.assertEqual(PackedImageHash.from_hex(str(a_hash)), packed)
+        self.assertEqual(hash(packed), hash(PackedImageHash.from_hex(str(a_hash))))
+        self.assertEqual(packed - p_hash.pack(), a_hash - p_hash)
+        self.assertEqual(packed - p_hash, a_hash - p_hash)
+        self.assertEqual(p_hash - packed, a_hash - p_hash)
+        self.assertNotEqual(packed, p_hash.pack())
+        # ImageHash and PackedImageHash compare equal both ways and are the same set and dict key
+        self.assertTrue(a_hash == packed and packed == a_hash)
+        self.assertFalse(a_hash != packed or packed != a_hash)
+        self.assertNotEqual(p_hash, packed)
+        self.assertEqual(hash(a_hash), hash(packed))
+        self.assertEqual(len({a_hash, packed, p_hash, p_hash.pack()}), 2)
+        self.assertNotEqual(a_hash, str(a_hash))
+        # hashes whose size is not a multiple of 8 bits
+        odd_hash = self.im_hash.dhash(self.pil_image, hash_size=5)
+        self.assertEqual(str(odd_hash.pack()), str(odd_hash))
+        self.assertEqual(odd_hash.pack().to_image_hash(), odd_hash)
+
+    def test_p_hash_batch(self):
+        lenna = Image.open('data/original_images/lenna.png')
+        flat = Image.new('RGB', (64, 64), (37, 37, 37))
+        images = [self.pil_image, lenna, flat]
+        results = self.im_hash.phash_batch(images)
+        self.assertEqual(len(results), len(images))
+        for image, result in zip(images, results):
+            with self.subTest():
+                self.assertEqual(str(result), str(self.im_hash.phash(image)))
+        results = self.im_hash.phash_batch([self.cv2_image], hash_size=16, order='bgr')
+        self.assertEqual(str(results[0]), str(self.im_hash.phash(self.cv2_image, hash_size=16, order='bgr')))
+        # the stack is transformed like every image is, ties with the median included
+        pixels = numpy.random.default_rng(3).integers(0, 256, size=(200, 32, 32), dtype=numpy.uint8)
+        pixels[:10] = pixels[:10] // 64 * 64
+        self.assertEqual(phash_stack(pixels).tolist(), [phash(image).hash.tolist() for image in pixels])
+
+    def test_w_hash_fast(self):
+        images = [
+            self.pil_image,
+            Image.open('data/original_images/lenna.png'),
+            Image.open('data/original_images/street.png')
+        ]
+        for image in images:
+            for mode in ['haar', 'db4']:
+                with self.subTest(mode=mode):
+                    # without the scale cap the bits are those of whash
+                    self.assertEqual(
+                        str(self.im_hash.whash_fast(image, mode=mode, max_scale_factor=None)),
+                        str(self.im_hash.whash(image, mode=mode)))
+                    self.assertEqual(
+                        str(self.im_hash.whash_fast(image, image_scale=64, mode=mode)),
+                        str(self.im_hash.whash(image, image_scale=64, mode=mode)))
+        self.assertEqual(str(self.im_hash.whash_fast(self.pil_image)), self.w_hash_result[0])
+        results = self.im_hash.whash_batch(images + [self.cv2_image], order='rgb')
+        for image, result in zip(images, results):
+            with self.subTest():
+                self.assertEqual(result, self.im_hash.whash_fast(image))
+        self.assertEqual(results[-1], self.im_hash.whash_fast(self.cv2_image))
+
+    def test_hash_cache(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            images = []
+            for name in ['a.png', 'b.png']:
+                images.append(os.path.join(tmp_dir, name))
+                shutil.copy('data/test.png', images[-1])
+            cache = imagewizard.HashCache(os.path.join(tmp_dir, 'hashes.db'), max_entries=3)
+            im_hash = imagewizard.Hashing(cache=cache)
+
+            results = im_hash.hash_many(images, algorithm='ahash', workers=1)
+            self.assertEqual(len(cache), 2)
+            self.assertEqual(cache.get(images[0], 'ahash', {'hash_size': 8}), results[0])
+            self.assertIsNone(cache.get(images[0], 'ahash', {'hash_size': 16}))
+            self.assertEqual(im_hash.hash_many(images, algorithm='ahash', workers=1), results)
+
+            # a modified file is hashed again
+            os.utime(images[1], (0, 0))
+            self.assertIsNone(cache.get(images[1], 'ahash'))
+            self.assertEqual(str(im_hash.hash_many(images[1:], algorithm='ahash', workers=1)[0]),
+                             self.a_hash_result[0])
+
+            # least recently used entries are evicted
+            im_hash.hash_many(images, algorithm='dhash', workers=1)
+            self.assertEqual(len(cache), 3)
+            cache.close()
+
+    def test_hash_cache_changed_while_hashing(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_name = os.path.join(tmp_dir, 'a.png')
+            shutil.copy('data/test.png', file_name)
+            cache = imagewizard.HashCache(os.path.join(tmp_dir, 'hashes.db'))
+            im_hash = imagewizard.Hashing(cache=cache)
+            hash_task = batch_hashing._hash_task
+
+            def rewrite_and_hash(task):
+                """ the file is replaced by another image after it was read """
+                image_hash = hash_task(task)
+                shutil.copy('data/original_images/lenna.png', task[0])
+                os.utime(task[0], ns=(0, 10**9))
+                return image_hash
+
+            with mock.patch.object(batch_hashing, '_hash_task', rewrite_and_hash):
+                im_hash.hash_many([file_name], algorithm='ahash', workers=1)
+            # the hash of the previous content is not served for the new one
+            self.assertIsNone(cache.get(file_name, 'ahash'))
+            cache.close()
+
+    def test_iter_hash_directory(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.mkdir(os.path.join(tmp_dir, 'sub'))
+            for name in ['a.png', 'b.png', os.path.join('sub', 'c.png')]:
+                shutil.copy('data/test.png', os.path.join(tmp_dir, name))
+            with open(os.path.join(tmp_dir, 'broken.png'), 'wb') as broken:
+                broken.write(b'not an image')
+            expected = {
+                'ahash': self.im_hash.ahash(self.cv2_image, order='bgr'),
+                'phash': self.im_hash.phash(self.cv2_image, order='bgr')
+            }
+            for workers in [1, 2]:
+                results = dict(
+                    self.im_hash.iter_hash_directory(tmp_dir, '*.png', ['ahash', 'phash'],
+                                                     prefetch=2, workers=workers))
+                with self.subTest(workers=workers):
+                    self.assertEqual(len(results), 4)
+                    self.assertIsInstance(results.pop(os.path.join(tmp_dir, 'broken.png')), Exception)
+                    for hashes in results.values():
+                        self.assertEqual(hashes, expected)
+            results = list(self.im_hash.iter_hash_directory(tmp_dir, 'a*', recursive=False, workers=1))
+            self.assertEqual([path for path, _ in results], [os.path.join(tmp_dir, 'a.png')])
+
+            # cached files are not read again
+            im_hash = imagewizard.Hashing(cache=imagewizard.HashCache(os.path.join(tmp_dir, 'hashes.db')))
+            first = dict(im_hash.iter_hash_directory(tmp_dir, '[abc].png', workers=1))
+            # garble a file, keeping its size and modification time
+            stat = os.stat(os.path.join(tmp_dir, 'a.png'))
+            with open(os.path.join(tmp_dir, 'a.png'), 'wb') as garbled:
+                garbled.write(bytes(stat.st_size))
+            os.utime(os.path.join(tmp_dir, 'a.png'), ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            self.assertEqual(dict(im_hash.iter_hash_directory(tmp_dir, '[abc].png', workers=1)), first)
+            im_hash.cache.close()
+
+    @unittest.skipUnless(multiprocessing.get_start_method() == 'fork', 'the workers must inherit the patched function')
+    def test_iter_hash_directory_killed_worker(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for index in range(20):
+                shutil.copy('data/test.png', os.path.join(tmp_dir, '{}.png'.format(index)))
+            results = []
+
+            def consume():
+                results.extend(self.im_hash.iter_hash_directory(tmp_dir, prefetch=4, workers=2))
+
+            # every file gets a result once the pool is broken, rather than the stream waiting forever
+            with mock.patch.object(stream_hashing, 'hash_buffer', _exit_worker):
+                consumer = threading.Thread(target=consume, daemon=True)
+                consumer.start()
+                consumer.join(60)
+            self.assertFalse(consumer.is_alive())
+            self.assertEqual(len(results), 20)
+            self.assertTrue(all(isinstance(hashes, Exception) for _, hashes in results))
+
+    def test_p_hash_dihedral(self):
+        lenna = cv.imread('data/original_images/lenna.png')
+        # orientations in the order of phash_dihedral
+        orientations = [
+            lenna, cv.flip(lenna, 0), cv.flip(lenna, 1), cv.flip(lenna, -1),
+            cv.transpose(lenna), cv.rotate(lenna, cv.ROTATE_90_COUNTERCLOCKWISE),
+            cv.rotate(lenna, cv.ROTATE_90_CLOCKWISE), cv.flip(cv.transpose(lenna), -1)
+        ]
+        hashes = self.im_hash.phash_dihedral(lenna, order='bgr')
+        self.assertEqual(len(hashes), 8)
+        self.assertEqual(hashes[0], self.im_hash.phash(lenna, order='bgr'))
+        canonical = self.im_hash.phash_canonical(lenna, order='bgr')
+        for orientation, dihedral_hash in zip(orientations, hashes):
+            with self.subTest():
+                self.assertLessEqual(self.im_hash.phash(orientation, order='bgr') - dihedral_hash, 2)
+                self.assertEqual(self.im_hash.phash_canonical(orientation, order='bgr'), canonical)
+
+    def test_crop_resistant_hash(self):
+        lenna = cv.imread('data/original_images/lenna.png')
+        street = cv.imread('data/original_images/street.png')
+        index = imagewizard.CropResistantIndex(max_distance=8)
+        index.add('lenna', self.im_hash.crop_resistant_hash(lenna, order='bgr'))
+        index.add('street', self.im_hash.crop_resistant_hash(street, order='bgr'))
+        index.add('test', self.im_hash.crop_resistant_hash(self.pil_image))
+        self.assertEqual(len(index), 3)
+
+        multi_hash = self.im_hash.crop_resistant_hash(lenna, order='bgr')
+        self.assertEqual(len(multi_hash), 55)
+        self.assertEqual(str(MultiHash.from_string(str(multi_hash))), str(multi_hash))
+
+        height, width = lenna.shape[:2]
+        cropped = lenna[int(height * 0.2):, int(width * 0.1):]
+        letterboxed = cv.copyMakeBorder(lenna[int(height * 0.15):int(height * 0.85)], 60, 60, 0, 0,
+                                        cv.BORDER_CONSTANT, value=(0, 0, 0))
+        for query in [cropped, letterboxed]:
+            results = index.query(self.im_hash.crop_resistant_hash(query, order='bgr'), min_regions=5)
+            with self.subTest():
+                self.assertEqual([image_id for image_id, _, _ in results], ['lenna'])
+
+        # enough regions to build the bucket tables, which find the same matches as a scan of every region
+        rng = numpy.random.default_rng(7)
+        values = rng.integers(0, 2**63, size=(1300, 55), dtype=numpy.uint64)
+        values[1:20] = values[0] ^ (numpy.uint64(1) << rng.integers(0, 63, size=(19, 55)).astype(numpy.uint64))
+        multi_hashes = [MultiHash([PackedImageHash(int(value), (8, 8)) for value in row]) for row in values]
+        index = imagewizard.CropResistantIndex(max_distance=4)
+        for image_id, multi_hash in enumerate(multi_hashes):
+            index.add(image_id, multi_hash)
+        self.assertTrue(index._tables)
+        self.assertEqual(len(index), 1300)
+        results = index.query(multi_hashes[0])
+        self.assertEqual(sorted(image_id for image_id, _, _ in results), list(range(20)))
+        for image_id, matched, _ in results:
+            self.assertEqual(matched, multi_hashes[0].matches(multi_hashes[image_id], max_distance=4))
+
+    def test_hash_frames(self):
+        scenes = [
+            cv.resize(cv.imread(file_name), (64, 48)) for file_name in [
+                'data/original_images/lenna.png', 'data/original_images/street.png',
+                'data/original_images/quiet_flow10.png'
+            ]
+        ]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_name = os.path.join(tmp_dir, 'scenes.avi')
+            # 3 scenes of 4 seconds at 25 frames per second
+            writer = cv.VideoWriter(file_name, cv.VideoWriter_fourcc(*'MJPG'), 25, (64, 48))
+            if not writer.isOpened():
+                self.skipTest('opencv can not write MJPG videos')
+            for scene in scenes:
+                for _ in range(100):
+                    writer.write(scene)
+            writer.release()
+            # samples 2 seconds apart seek to the next sample, 0.2 seconds apart grab every frame
+            for interval in [2, 0.2]:
+                signature = self.im_hash.hash_frames(file_name, interval=interval)
+                with self.subTest(interval=interval):
+                    self.assertEqual(signature.timestamps, [0, 4, 8])
+                    for scene, image_hash in zip(scenes, signature.hashes):
+                        self.assertLessEqual(self.im_hash.phash(scene, order='bgr').pack() - image_hash, 4)
+            self.assertEqual(len(self.im_hash.hash_frames(file_name, interval=2, min_change=0)), 6)
+            self.assertRaises(ValueError, self.im_hash.hash_frames, file_name, algorithm='nohash')
+
+    def test_hash_file(self):
+        # test.png is a JPEG file of 1280 x 960, decoded at 1/8 of its size for the 32 x 32 of phash
+        self.assertEqual(helpers.imread_scaled('data/test.png', (32, 32), grayscale=True).shape, (120, 160))
+        self.assertEqual(helpers.imread_scaled('data/test.png', (200, 200)).shape, (240, 320, 3))
+        self.assertEqual(helpers.imread_scaled('data/test.png').shape, (960, 1280, 3))
+        # PNG files are decoded in full, exactly as in-memory images
+        lenna = cv.imread('data/original_images/lenna.png')
+        self.assertEqual(self.im_hash.dhash('data/original_images/lenna.png'), self.im_hash.dhash(lenna, order='bgr'))
+
+        for method in ['ahash', 'dhash', 'phash', 'whash', 'whash_fast']:
+            with self.subTest(method=method):
+                file_hash = getattr(self.im_hash, method)('data/test.png')
+                self.assertLessEqual(file_hash - getattr(self.im_hash, method)(self.cv2_image, order='bgr'), 4)
+        hashes = self.im_hash.fingerprint('data/test.png', algorithms=['ahash', 'phash'])
+        self.assertLessEqual(hashes['phash'] - self.im_hash.phash(self.cv2_image, order='bgr'), 4)
+        self.assertEqual(len(self.im_hash.crop_resistant_hash('data/test.png')), 55)
+
+    def test_hash_buffer(self):
+        for file_name in ['data/test.png', 'data/original_images/lenna.png']:
+            with open(file_name, 'rb') as image_file:
+                buffer = image_file.read()
+            for image in [buffer, bytearray(buffer), memoryview(buffer)]:
+                with self.subTest(file_name=file_name, type=type(image).__name__):
+                    for method in ['ahash', 'dhash', 'phash', 'whash_fast']:
+                        self.assertEqual(getattr(self.im_hash, method)(image), getattr(self.im_hash, method)(file_name))
+                    self.assertEqual(self.im_hash.hash_many([image], 'phash', workers=1),
+                                     [self.im_hash.phash(file_name)])
+        self.assertIsNone(helpers.jpeg_size(b'not an image'))
+        self.assertIsNone(helpers.jpeg_size(b''))
+        with open('data/test.png', 'rb') as image_file:
+            self.assertEqual(helpers.jpeg_size(image_file.read()), (1280, 960))
+        self.assertRaises(ValueError, self.im_hash.phash, b'not an image')
+
+    def test_iter_hash_archive(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            images = os.path.join(tmp_dir, 'images')
+            os.makedirs(os.path.join(images, 'sub'))
+            shutil.copy('data/test.png', os.path.join(images, 'a.png'))
+            shutil.copy('data/original_images/lenna.png', os.path.join(images, 'sub', 'b.png'))
+            with open(os.path.join(images, 'broken.png'), 'wb') as broken:
+                broken.write(b'not an image')
+            with open(os.path.join(images, 'notes.txt'), 'w') as notes:
+                notes.write('not hashed')
+            expected = {
+                os.path.relpath(path, images).replace(os.sep, '/'): hashes
+                for path, hashes in self.im_hash.iter_hash_directory(images, '*.png', ['ahash', 'phash'], workers=1)
+            }
+            self.assertEqual(len(expected), 3)
+            archives = [
+                shutil.make_archive(os.path.join(tmp_dir, 'images'), archive_format, images)
+                for archive_format in ['zip', 'tar', 'gztar']
+            ]
+            for archive in archives:
+                for workers in [1, 2]:
+                    results = {
+                        os.path.normpath(name).replace(os.sep, '/'): hashes
+                        for name, hashes in self.im_hash.iter_hash_archive(archive, '*.png', ['ahash', 'phash'],
+                                                                          prefetch=2, workers=workers)
+                    }
+                    with self.subTest(archive=os.path.basename(archive), workers=workers):
+                        self.assertIsInstance(results.pop('broken.png'), Exception)
+                        expected_hashes = dict(expected)
+                        expected_hashes.pop('broken.png')
+                        self.assertEqual(results, expected_hashes)
+            # tar archives can be read from a non seekable stream
+            read_fd, write_fd = os.pipe()
+
+            def write_stream():
+                with open(archives[2], 'rb') as archive_file, os.fdopen(write_fd, 'wb') as pipe:
+                    shutil.copyfileobj(archive_file, pipe)
+
+            writer = threading.Thread(target=write_stream)
+            writer.start()
+            with os.fdopen(read_fd, 'rb') as stream:
+                results = dict(self.im_hash.iter_hash_archive(stream, 'a.png', workers=1))
+            writer.join()
+            self.assertEqual(list(results), ['./a.png'])
+            self.assertEqual(results['./a.png'], {'phash': expected['a.png']['phash']})
+
+    def test_thumbnail_store(self):
+        lenna = cv.imread('data/original_images/lenna.png')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = imagewizard.ThumbnailStore(os.path.join(tmp_dir, 'thumbnails'), size=128)
+            results = store.add_many(['data/test.png', 'data/original_images/street.png', 'data/missing.png'],
+                                     workers=1)
+            self.assertEqual(results[:2], [0, 1])
+            self.assertIsInstance(results[2], Exception)
+            self.assertEqual(store.add('lenna', lenna, order='bgr'), 2)
+            self.assertEqual(store.add_many([lenna], workers=2, order='bgr'), [3])
+            self.assertEqual(store.pixels.shape, (4, 128, 128))
+
+            # the store is reopened from disk, hashes are computed from the thumbnails alone
+            store = imagewizard.ThumbnailStore(os.path.join(tmp_dir, 'thumbnails'), size=128)
+            self.assertEqual(store.keys, ['data/test.png', 'data/original_images/street.png', 'lenna', '3'])
+            self.assertRaises(ValueError, imagewizard.ThumbnailStore, os.path.join(tmp_dir, 'thumbnails'), 64)
+            for algorithm, params in [('ahash', {}), ('dhash', {'hash_size': 16}), ('phash', {}),
+                                      ('phash', {'hash_size': 16, 'highfreq_factor': 8}), ('whash', {}),
+                                      ('whash', {'mode': 'db4', 'image_scale': 64})]:
+                hashes = store.hash(algorithm, batch_size=3, **params)
+                with self.subTest(algorithm=algorithm, params=params):
+                    # batched hashes are the hashes of the thumbnails
+                    for thumbnail, image_hash in zip(store.pixels, hashes):
+                        self.assertLessEqual(getattr(self.im_hash, algorithm)(numpy.asarray(thumbnail), **params) -
+                                             image_hash, 0 if algorithm != 'whash' else 2)
+                    # and close to the hashes of the original images
+                    self.assertLessEqual(hashes[2] - getattr(self.im_hash, algorithm)(lenna, order='bgr', **params),
+                                         len(hashes[2].hash.flatten()) // 10)
+            self.assertRaises(ValueError, store.hash, 'phash', hash_size=64)
+
+            # the images are consumed a chunk at a time, the thumbnails of the previous chunks are already stored
+            store = imagewizard.ThumbnailStore(os.path.join(tmp_dir, 'stream'), size=32)
+            stored = []
+
+            def images():
+                for _ in range(10):
+                    stored.append(store._stored_count())
+                    yield lenna
+
+            self.assertEqual(store.add_many(images(), order='bgr', workers=1, chunksize=1), list(range(10)))
+            self.assertEqual(stored, [0] * 4 + [4] * 4 + [8] * 2)
+            self.assertRaises(ValueError, store.add_many, iter([lenna]), keys=iter(['a', 'b']), workers=1)
+
+    def test_hash_io(self):
+        lenna = cv.imread('data/original_images/lenna.png')
+        images = [self.cv2_image, lenna, cv.imread('data/original_images/street.png')]
+        for hash_size in (3, 8, 16):
+            hashes = [self.im_hash.phash(image, hash_size=hash_size, order='bgr') for image in images]
+            hexes = [str(image_hash) for image_hash in hashes]
+            bits = hash_size * hash_size
+            with self.subTest(hash_size=hash_size):
+                packed = hash_io.hashes_to_packed(hashes)
+                self.assertEqual(packed.shape, (3, (bits + 7) // 8))
+                numpy.testing.assert_array_equal(hash_io.hashes_to_packed([h.pack() for h in hashes]), packed)
+                numpy.testing.assert_array_equal(hash_io.hex_to_packed(hexes, bits), packed)
+                self.assertEqual(hash_io.packed_to_hex(packed, bits), hexes)
+                self.assertEqual(hash_io.packed_to_hashes(packed, (hash_size, hash_size)), hashes)
+                words = hash_io.packed_to_uint64(packed)
+                self.assertEqual(words.shape, (3, (bits + 63) // 64))
+                numpy.testing.assert_array_equal(hash_io.uint64_to_packed(words, bits), packed)
+                if hash_size == 8:
+                    self.assertEqual([int(word) for word in words[:, 0]], [int(hexstr, 16) for hexstr in hexes])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_name = os.path.join(tmp_dir, 'hashes.iwh')
+            hashes = [self.im_hash.phash(image, order='bgr') for image in images]
+            self.im_hash.save_hashes(file_name, hashes, 'phash', hash_size=8)
+            self.assertEqual(os.path.getsize(file_name), 64 + 3 * 8)
+            for mmap in (True, False):
+                header, packed = self.im_hash.load_hashes(file_name, mmap=mmap)
+                self.assertEqual(header, {'algorithm': 'phash', 'hash_size': 8, 'bits': 64, 'count': 3})
+                self.assertEqual(hash_io.packed_to_hex(packed), [str(image_hash) for image_hash in hashes])
+            self.assertEqual(self.im_hash.load_hashes(file_name, as_hashes=True)[1], hashes)
+            # hex strings are saved the same way
+            self.im_hash.save_hashes(file_name, [str(image_hash) for image_hash in hashes], 'phash')
+            self.assertEqual(self.im_hash.load_hashes(file_name, as_hashes=True)[1], hashes)
+            self.im_hash.save_hashes(file_name, [], 'phash')
+            self.assertEqual(self.im_hash.load_hashes(file_name)[1].shape, (0, 8))
+            with open(file_name, 'wb') as not_hashes:
+                not_hashes.write(b'not a hash file')
+            self.assertRaises(ValueError, self.im_hash.load_hashes, file_name)
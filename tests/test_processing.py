@@ -62,6 +62,28 @@ class TestProcessing(unittest.TestCase):
     def test_resize(self):
         npt.assert_array_equal(self.resize_test, self.resize_actual, 'Resized image does not equal actual result')
 
+        # street.png is a JPEG file, decoded at half its size (640 x 480) to be shrunk to 300 x 300
+        resize_file = self.im_pro.resize("data/original_images/street.png",
+                                         resize_width=300,
+                                         resize_height=300,
+                                         order='bgr')
+        self.assertEqual(resize_file.shape, self.resize_actual.shape)
+        self.assertLess(abs(resize_file.astype(int) - self.resize_actual).mean(), 2)
+        resize_file = self.im_pro.resize("data/original_images/street.png", resize_percentage=10, order='bgr')
+        self.assertEqual(resize_file.shape, (96, 128, 3))
+
+        # encoded images, decoded at a reduced resolution as files are
+        with open("data/original_images/street.png", 'rb') as image_file:
+            buffer = image_file.read()
+        for image in [buffer, bytearray(buffer), memoryview(buffer)]:
+            with self.subTest(type=type(image).__name__):
+                npt.assert_array_equal(
+                    self.im_pro.resize(image, resize_width=300, resize_height=300, order='bgr'),
+                    self.im_pro.resize("data/original_images/street.png", resize_width=300, resize_height=300,
+                                       order='bgr'))
+        npt.assert_array_equal(self.im_pro.img2grayscale(memoryview(buffer), order='bgr'),
+                               self.im_pro.img2grayscale(self.street_org, order='bgr'))
+
     def test_grayscale(self):
         npt.assert_array_equal(
             self.grayscale_actual, self.grayscale_test,
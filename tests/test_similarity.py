@@ -1,7 +1,16 @@
+import os
+import tempfile
 import unittest
 import sys
 sys.path.append("..")
 import imagewizard
+import cv2 as cv
+import numpy
+from imagewizard.image_hashing.api.hash_algorithms import ImageHash
+from imagewizard.image_hash_similarity.api import bit_ops, mih
+from imagewizard.image_hash_similarity.api.distance_algorithms import BitDistanceAlgorithms, DistanceAlgorithms
+from imagewizard.helpers.helpers import hash_to_binary_array
+from imagewizard.image_hashing.api import hash_io
 
 
 class TestSimilarity(unittest.TestCase):
@@ -52,3 +61,357 @@ class TestSimilarity(unittest.TestCase):
             result = self.im_sim.similarity(a, b, metric='minkowski')
             with self.subTest():
                 self.assertEqual(result, actual_result, 'input a = {}, b = {}'.format(str(a), str(b)))
+
+    def test_similarity_dihedral(self):
+        im_hash = imagewizard.Hashing()
+        lenna = cv.imread('data/original_images/lenna.png')
+        hashes = im_hash.phash_dihedral(lenna, order='bgr')
+        rotated = im_hash.phash(cv.rotate(lenna, cv.ROTATE_90_CLOCKWISE), order='bgr')
+        self.assertGreater(self.im_sim.similarity(hashes[0], rotated), 10)
+        self.assertLessEqual(self.im_sim.similarity_dihedral(hashes, rotated), 2)
+        self.assertGreaterEqual(self.im_sim.similarity_dihedral(hashes, rotated, metric='cosine'), 0.95)
+        # the similarity metrics take the best (highest) score of the orientations
+        self.assertEqual(self.im_sim.similarity_dihedral([0xff, 0xf0f0], 0xff, metric='bit_jaccard'), 1.0)
+
+    def test_sequence_similarity(self):
+        im_hash = imagewizard.Hashing()
+        scenes = [
+            im_hash.phash(cv.imread(file_name), order='bgr') for file_name in [
+                'data/original_images/lenna.png', 'data/original_images/street.png',
+                'data/original_images/quiet_flow10.png'
+            ]
+        ]
+        self.assertEqual(self.im_sim.sequence_similarity(scenes, scenes[1:]), 1.0)
+        self.assertEqual(self.im_sim.sequence_similarity(scenes, scenes[::-1]), 1 / 3)
+        self.assertEqual(self.im_sim.sequence_similarity(scenes[:1], scenes[1:]), 0.0)
+        self.assertEqual(self.im_sim.sequence_similarity(scenes, []), 0.0)
+
+    def test_similarity_many(self):
+        rng = numpy.random.default_rng(0)
+        values = rng.integers(0, 2**63, size=50, dtype=numpy.uint64) * 2 + rng.integers(0, 2, 50, dtype=numpy.uint64)
+        values[1] = values[0]
+        query = int(values[0])
+        for metric in ['hamming', 'euclidean', 'cosine', 'manhattan', 'jaccard', 'minkowski']:
+            expected = [self.im_sim.similarity(query, int(value), metric=metric) for value in values]
+            with self.subTest(metric=metric):
+                numpy.testing.assert_allclose(self.im_sim.similarity_many(query, values, metric=metric), expected)
+                numpy.testing.assert_allclose(self.im_sim.similarity_many(query, values, metric=metric, chunk_size=7),
+                                              expected)
+                distances = self.im_sim.cdist(values[:3], values, metric=metric, chunk_size=64)
+                self.assertEqual(distances.shape, (3, 50))
+                numpy.testing.assert_allclose(distances[0], expected)
+        # packed uint8 hashes, hex strings and ImageHash objects of any size are the same words
+        im_hash = imagewizard.Hashing()
+        images = [cv.imread('data/original_images/' + name) for name in ['lenna.png', 'street.png', 'quiet_flow10.png']]
+        for hash_size in (8, 16):
+            hashes = [im_hash.phash(image, hash_size=hash_size, order='bgr') for image in images]
+            expected = [hashes[0] - image_hash for image_hash in hashes]
+            with self.subTest(hash_size=hash_size):
+                for values_src in [hashes, [str(image_hash) for image_hash in hashes], hash_io.hashes_to_packed(hashes)]:
+                    self.assertEqual(self.im_sim.similarity_many(hashes[0], values_src).tolist(), expected)
+                self.assertEqual(self.im_sim.cdist(hashes, hashes).tolist(),
+                                 [[a - b for b in hashes] for a in hashes])
+        self.assertRaises(ValueError, self.im_sim.similarity_many, query, values, 'chebyshev')
+
+    def test_popcount(self):
+        words = numpy.random.default_rng(1).integers(0, 2**63, size=(100, 2), dtype=numpy.uint64)
+        expected = [[bin(int(word)).count('1') for word in row] for row in words]
+        self.assertEqual(bit_ops._popcount_table(words).tolist(), expected)
+        self.assertEqual(bit_ops.row_popcount(words).tolist(), [sum(row) for row in expected])
+        self.assertEqual([bit_ops.int_popcount(int(word)) for word in words[:, 0]], [row[0] for row in expected])
+
+    def test_similarity_image_hash(self):
+        rng = numpy.random.default_rng(2)
+        metrics = ['hamming', 'euclidean', 'cosine', 'manhattan', 'jaccard', 'minkowski']
+        for _ in range(20):
+            a, b = ImageHash(rng.random((8, 8)) > 0.5), ImageHash(rng.random((8, 8)) > 0.5)
+            for metric in metrics:
+                # the values of the hex strings, which are compared as bit arrays
+                expected = self.im_sim.similarity(str(a), str(b), metric=metric)
+                with self.subTest(metric=metric):
+                    self.assertEqual(self.im_sim.similarity(a, b, metric=metric), expected)
+                    self.assertEqual(self.im_sim.similarity(a.pack(), str(b), metric=metric), expected)
+        # 256 bit hashes are compared over all of their bits
+        a, b = ImageHash(rng.random((16, 16)) > 0.5), ImageHash(rng.random((16, 16)) > 0.5)
+        self.assertEqual(self.im_sim.similarity(a, b), a - b)
+        self.assertEqual(self.im_sim.similarity(a, b, metric='euclidean'), numpy.sqrt(a - b))
+        self.assertEqual(self.im_sim.similarity(a, a, metric='cosine'), 1.0)
+        self.assertRaises(TypeError, self.im_sim.similarity, a, ImageHash(rng.random((8, 8)) > 0.5))
+
+    def test_bit_distance_algorithms(self):
+        measures, bit_measures = DistanceAlgorithms(), BitDistanceAlgorithms(64)
+        rng = numpy.random.default_rng(3)
+        values = [int(value) for value in rng.integers(1, 2**63, size=30, dtype=numpy.uint64)] + [0x4bd1, 2**64 - 1]
+        for a, b in zip(values, values[::-1]):
+            bits_a, bits_b = hash_to_binary_array(a), hash_to_binary_array(b)
+            for name in ['manhattan_distance', 'euclidean_distance', 'minkowski_distance', 'cosine_similarity',
+                         'jaccard_similarity', 'bit_jaccard_similarity']:
+                with self.subTest(name=name):
+                    self.assertEqual(getattr(bit_measures, name)(a, b), getattr(measures, name)(bits_a, bits_b))
+        self.assertEqual(bit_measures.bit_jaccard_similarity(0b1100, 0b0110), 1 / 3)
+        self.assertEqual(self.im_sim.similarity([1, 1, 0, 0], [0, 1, 1, 0], metric='bit_jaccard'), 1 / 3)
+        self.assertEqual(self.im_sim.similarity('c', '6', metric='bit_jaccard'), 1 / 3)
+        # the vectorized measures are the same
+        words = numpy.array(values, dtype=numpy.uint64)
+        for metric in ['bit_jaccard', 'jaccard', 'cosine']:
+            numpy.testing.assert_allclose(self.im_sim.similarity_many(values[0], words, metric=metric),
+                                          [self.im_sim.similarity(values[0], value, metric=metric) for value in values])
+
+    def test_bk_tree_index(self):
+        rng = numpy.random.default_rng(4)
+        values = rng.integers(0, 2**63, size=2000, dtype=numpy.uint64) * 2
+        values[10:15] = values[0]
+        index = imagewizard.BKTreeIndex()
+        index.build(values)
+        # hashes added one by one, as integers, hex strings and ImageHash objects, go to the same tree
+        index.add(2000, int(values[1]) ^ 1)
+        index.add(2001, '{:016x}'.format(int(values[2]) ^ 3))
+        index.add(2002, ImageHash(numpy.unpackbits(numpy.array([values[3]], dtype='>u8').view(numpy.uint8)).astype(bool)))
+        self.assertEqual(len(index), 2003)
+        words = numpy.concatenate((values, [int(values[1]) ^ 1, int(values[2]) ^ 3, values[3]])).astype(numpy.uint64)
+        for query in [int(values[0]), int(values[1]) ^ 0b101, int(values[500]) ^ 0b1111]:
+            distances = self.im_sim.similarity_many(query, words)
+            for radius in (0, 2, 6, 16):
+                with self.subTest(query=query, radius=radius):
+                    results = index.query(query, radius)
+                    self.assertEqual(sorted(key for key, _ in results), numpy.flatnonzero(distances <= radius).tolist())
+                    self.assertEqual([distance for _, distance in results],
+                                     sorted(distances[distances <= radius].tolist()))
+            nearest = index.nearest('{:016x}'.format(query), k=8)
+            self.assertEqual([distance for _, distance in nearest], sorted(distances.tolist())[:8])
+            self.assertTrue(all(distances[key] == distance for key, distance in nearest))
+        self.assertEqual(sorted(key for key, _ in index.query(int(values[0]), 0)), [0, 10, 11, 12, 13, 14])
+        self.assertEqual(imagewizard.BKTreeIndex().query(0, 4), [])
+        self.assertEqual(imagewizard.BKTreeIndex().nearest(0, 4), [])
+
+    def test_mih_index(self):
+        # 1 + C(16, 1) + C(16, 2) substring values within 2 bits, as many as the enumerated XOR masks
+        self.assertEqual(mih.neighbourhood_size(16, 2), 137)
+        self.assertEqual(mih.neighbourhood_size(5, 3), len(mih.neighbourhood(5, 3)))
+        rng = numpy.random.default_rng(5)
+        for words in (1, 4):
+            values = rng.integers(0, 2**63, size=(3000, words), dtype=numpy.uint64) * 2
+            values[10:15] = values[0]
+            hexes = [''.join('{:016x}'.format(int(word)) for word in row) for row in values]
+            for substrings in (None, 1, 3, 5):
+                index = imagewizard.MIHIndex(substrings=substrings)
+                index.build(values[:2900])
+                # hashes added one by one are found before the tables are built again
+                for key in range(2900, 3000):
+                    index.add(key, hexes[key])
+                self.assertEqual(len(index), 3000)
+                for query in [0, 1, 2950]:
+                    query_words = values[query].copy()
+                    query_words[-1] ^= numpy.uint64(0b1011011)
+                    distances = bit_ops.row_popcount(values ^ query_words)
+                    for radius in (0, 5, 10, 12, 40):
+                        with self.subTest(words=words, substrings=substrings, query=query, radius=radius):
+                            results = index.query(int(''.join('{:016x}'.format(int(w)) for w in query_words), 16),
+                                                  radius)
+                            self.assertEqual(sorted(key for key, _ in results),
+                                             numpy.flatnonzero(distances <= radius).tolist())
+                            self.assertEqual([distance for _, distance in results],
+                                             sorted(distances[distances <= radius].tolist()))
+        # ImageHash objects, tables built again with new hashes
+        im_hash = imagewizard.Hashing()
+        hashes = [im_hash.phash(cv.imread('data/original_images/' + name), order='bgr')
+                  for name in ['lenna.png', 'street.png', 'quiet_flow10.png']]
+        index = imagewizard.MIHIndex()
+        index.build(hashes[:2], keys=['lenna', 'street'])
+        index.build(hashes[2:], keys=['quiet_flow'])
+        self.assertEqual(index.query(hashes[1], radius=0), [('street', 0)])
+        self.assertEqual(index.query(hashes[2], radius=64)[0], ('quiet_flow', 0))
+        self.assertEqual(len(index.query(hashes[2], radius=64)), 3)
+        self.assertEqual(imagewizard.MIHIndex().query(hashes[0]), [])
+
+    def test_lsh_index(self):
+        rng = numpy.random.default_rng(6)
+        for words, radius in ((1, 8), (4, 30)):
+            values = rng.integers(0, 2**63, size=(3000, words), dtype=numpy.uint64) * 2
+            # near duplicates of the first 50 hashes, radius bits apart
+            queries = []
+            for value in values[:50]:
+                query = value.copy()
+                for bit in rng.choice(64 * words, radius, replace=False):
+                    query[bit // 64] ^= numpy.uint64(1 << (63 - int(bit) % 64))
+                queries.append(int(''.join('{:016x}'.format(int(word)) for word in query), 16))
+            index = imagewizard.LSHIndex()
+            index.build(values[:2990])
+            for key in range(2990, 3000):
+                index.add(key, int(''.join('{:016x}'.format(int(word)) for word in values[key]), 16))
+            with self.subTest(words=words):
+                self.assertEqual((index.tables, index.bits_per_table),
+                                 tuple(imagewizard.image_hash_similarity.api.lsh.LSH_PRESETS[words * 64].values()))
+                # results are exact distances within radius, the exact neighbours are found with a high recall
+                for query in queries[:5]:
+                    distances = self.im_sim.similarity_many(query, values)
+                    for key, distance in index.query(query, radius):
+                        self.assertEqual(distances[key], distance)
+                        self.assertLessEqual(distance, radius)
+                self.assertEqual(index.query(''.join('{:016x}'.format(int(word)) for word in values[2995]), 0),
+                                 [(2995, 0)])
+                evaluation = index.evaluate_recall(queries, radius=radius)
+                self.assertGreater(evaluation['recall'], 0.6)
+                self.assertLess(evaluation['candidates'], 3000)
+                # fewer tables, fewer candidates
+                fewer = index.evaluate_recall(queries, radius=radius, tables=index.tables // 4)
+                self.assertLess(fewer['candidates'], evaluation['candidates'])
+                self.assertLessEqual(fewer['recall'], evaluation['recall'])
+                # fewer bits per table, more candidates and recall
+                more = index.evaluate_recall(queries, radius=radius, bits_per_table=index.bits_per_table - 4)
+                self.assertGreater(more['candidates'], evaluation['candidates'])
+                self.assertGreaterEqual(more['recall'], evaluation['recall'])
+                capped = index.evaluate_recall(queries, radius=radius, max_candidates=20)
+                self.assertLessEqual(capped['candidates'], 20 + 10)
+                # all the tables and no sampled bit: every hash is a candidate, the search is exact
+                self.assertEqual(index.evaluate_recall(queries, k=3, bits_per_table=0)['recall'], 1.0)
+                self.assertEqual(index.nearest(queries[0], k=1, bits_per_table=0), [(0, radius)])
+        self.assertEqual(imagewizard.LSHIndex().query(0), [])
+
+    def test_mapped_hash_index(self):
+        rng = numpy.random.default_rng(3)
+        for bits in (64, 256):
+            words = rng.integers(0, 2**63, size=(3000, bits // 64), dtype=numpy.uint64)
+            # near duplicates of the first hash
+            words[1:30] = words[0] ^ (numpy.uint64(1) << rng.integers(0, 63, size=(29, bits // 64)).astype(numpy.uint64))
+            query = hash_io.packed_to_hex(hash_io.uint64_to_packed(words[:1]))[0]
+            distances = bit_ops.row_popcount(words ^ words[0])
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                path = os.path.join(tmp_dir, 'index')
+                index = imagewizard.MappedHashIndex(path, bits=bits)
+                self.assertEqual(index.query(query), [])
+                index.add(words[:2000], ids=numpy.arange(2000) * 10)
+                index.compact()
+                self.assertTrue(index._tables)
+                index.add(words[2000:], ids=numpy.arange(2000, 3000) * 10)
+                index.delete([10, 20010])
+                # deleting a hash of the delta segment and adding it again
+                index.delete([20020])
+                index.add(words[2002:2003], ids=[20020])
+                expected_ids = set(numpy.arange(3000) * 10) - {10, 20010}
+                for radius in (0, 6, 20, bits // 2):
+                    expected = sorted((int(index_id), int(distance)) for index_id, distance in zip(numpy.arange(3000) * 10,
+                                                                                                 distances)
+                                      if distance <= radius and index_id in expected_ids)
+                    for indexed in (True, False):
+                        with self.subTest(bits=bits, radius=radius, indexed=indexed):
+                            found = index.query(query, radius=radius, indexed=indexed)
+                            self.assertEqual(sorted(found), expected)
+                            self.assertEqual([distance for _, distance in found],
+                                             sorted(distance for _, distance in found))
+                self.assertEqual(index.nearest(query, k=1), [(0, 0)])
+                self.assertEqual(len(index.nearest(query, k=5)), 5)
+                # another process opening the index sees the same hashes, and the changes made after it opened it
+                reader = imagewizard.MappedHashIndex(path)
+                self.assertEqual((reader.bits, len(reader)), (bits, 2998))
+                index.delete([0])
+                index.compact()
+                self.assertEqual(len(reader), 2997)
+                self.assertEqual(reader.query(query, radius=0), [])
+                self.assertEqual(len(os.listdir(path)), 4)
+                with self.assertRaises(ValueError):
+                    imagewizard.MappedHashIndex(path, bits=bits * 2)
+        # the default ids are not reused after the deleted hashes are compacted away
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'index')
+            index = imagewizard.MappedHashIndex(path)
+            index.add(list(range(1, 11)))
+            index.delete([3, 9])
+            index.compact()
+            index.add([11])
+            self.assertEqual(index.query(11, radius=0), [(10, 0)])
+            self.assertEqual(index.query(10, radius=0), [])
+            self.assertEqual(imagewizard.MappedHashIndex(path)._next_id, 11)
+
+    def test_sqlite_hash_store(self):
+        rng = numpy.random.default_rng(4)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'hashes.db')
+            # the file is created by the store of the largest hashes
+            for hash_size in (16, 8, 3):
+                bits = hash_size * hash_size
+                words = rng.integers(0, 2**63, size=(2000, -(-bits // 64)), dtype=numpy.uint64)
+                words[:, 0] &= numpy.uint64((1 << min(bits, 64)) - 1)
+                # near duplicates of the first hash
+                words[1:20] = words[0] ^ (numpy.uint64(1) << rng.integers(0, min(bits, 63), size=(19, words.shape[1])).astype(
+                    numpy.uint64))
+                store = imagewizard.SQLiteHashStore(path, hash_size=hash_size)
+                store.build(words, keys=list(range(1000, 3000)))
+                store.delete([1001])
+                self.assertEqual(len(store), 1999)
+                query = hash_io.packed_to_hex(hash_io.uint64_to_packed(words[:1], bits), bits)[0]
+                distances = bit_ops.row_popcount(words ^ words[0])
+                for radius in (0, 3, 8, bits // 2):
+                    with self.subTest(hash_size=hash_size, radius=radius):
+                        expected = sorted((key, int(distance)) for key, distance in zip(range(1000, 3000), distances)
+                                          if distance <= radius and key != 1001)
+                        found = store.query(query, radius=radius)
+                        self.assertEqual(sorted(found), expected)
+                        self.assertEqual([distance for _, distance in found], sorted(distance for _, distance in found))
+                self.assertEqual(store.nearest(query, k=1), [(1000, 0)])
+                store.close()
+            # the hashes of every algorithm and hash_size are kept apart, the SQL functions are usable in queries
+            store = imagewizard.SQLiteHashStore(path, algorithm='dhash', hash_size=8)
+            self.assertEqual(len(store), 0)
+            store.add(7, '0xffff')
+            self.assertEqual(store.query('0xfffe', radius=1), [(7, 1)])
+            # the file holds 256 bit hashes, 64 bit hashes are in the least significant word
+            sql = 'SELECT popcount(h3), hamming(h0, h1, h2, h3, 0, 0, 0, 1) FROM hashes WHERE id = 7'
+            self.assertEqual(store._connect().execute(sql).fetchone(), (16, 15))
+            store.close()
+            with self.assertRaises(ValueError):
+                imagewizard.SQLiteHashStore(path, hash_size=32)
+            # the substrings of the stored rows are kept when the store is opened again
+            store = imagewizard.SQLiteHashStore(path, algorithm='ahash', substrings=8)
+            store.add(5, '0xff00')
+            store.close()
+            store = imagewizard.SQLiteHashStore(path, algorithm='ahash')
+            self.assertEqual((store.substrings, store.query('0xff03', radius=2)), (8, [(5, 2)]))
+            store.close()
+            with self.assertRaises(ValueError):
+                imagewizard.SQLiteHashStore(path, algorithm='ahash', substrings=4)
+
+    def test_find_duplicates(self):
+        rng = numpy.random.default_rng(6)
+        for words, radius in ((rng.integers(0, 2**63, size=(2000, 1), dtype=numpy.uint64), 10),
+                              (rng.integers(0, 2**63, size=(800, 4), dtype=numpy.uint64), 40)):
+            # near duplicates of some hashes, and exact copies
+            for index in range(0, 300, 3):
+                flips = rng.integers(0, 64, size=(3, words.shape[1])).astype(numpy.uint64)
+                words[600 + index // 3] = words[index] ^ numpy.bitwise_or.reduce(numpy.uint64(1) << flips, axis=0)
+            words[500:505] = words[7]
+            distances = bit_ops.many_to_many(words, words)
+            near = numpy.triu(distances <= radius, 1)
+            # connected components of the pairs within radius
+            parent = list(range(len(words)))
+            for left, right in numpy.argwhere(near).tolist():
+                while parent[right] != right:
+                    right = parent[right]
+                while parent[left] != left:
+                    left = parent[left]
+                parent[max(left, right)] = min(left, right)
+            components = {}
+            for index in range(len(words)):
+                root = index
+                while parent[root] != root:
+                    root = parent[root]
+                components.setdefault(root, []).append(index)
+            expected = sorted(group for group in components.values() if len(group) > 1)
+            for workers in (1, 2):
+                with self.subTest(words=words.shape[1], workers=workers):
+                    edges = list(self.im_sim.iter_duplicate_edges(words, radius=radius, workers=workers))
+                    lefts, rights, found = (numpy.concatenate(column) for column in zip(*edges))
+                    self.assertTrue(numpy.all(lefts < rights))
+                    self.assertTrue(numpy.array_equal(found, distances[lefts, rights]))
+                    # every pair once, the copies of a hash only with its first occurrence
+                    self.assertEqual(len(set(zip(lefts.tolist(), rights.tolist()))), len(lefts))
+                    copies = set(range(501, 505)) | {500}
+                    expected_pairs = {(left, right) for left, right in numpy.argwhere(near).tolist()
+                                      if left not in copies and right not in copies}
+                    self.assertEqual({pair for pair in zip(lefts.tolist(), rights.tolist())
+                                      if pair[0] not in copies and pair[1] not in copies}, expected_pairs)
+                    self.assertEqual(self.im_sim.find_duplicates(words, radius=radius, workers=workers), expected)
+        keys = ['a', 'b', 'c']
+        self.assertEqual(self.im_sim.find_duplicates(['0xff00', '0xff01', '0x00ff'], radius=1, keys=keys, workers=1),
+                         [['a', 'b']])
+        self.assertEqual(self.im_sim.find_duplicates([], radius=4, workers=1), [])